@@ -0,0 +1,245 @@
+import numpy as np
+
+from config import ASSOCIATION_MAX_RIDERS
+
+
+# ── Geometry Helpers ─────────────────────────────────────────────────────────
+
+def _as_boxes(boxes):
+    """(N,4) float64 array from a list of [x1,y1,x2,y2] boxes."""
+    return np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+
+def _split(boxes):
+    """Columns x1, y1, x2, y2 plus width, height, cx, cy of an (N,4) array."""
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    return x1, y1, x2, y2, x2 - x1, y2 - y1, (x1 + x2) / 2, (y1 + y2) / 2
+
+
+# ── Score Matrices ───────────────────────────────────────────────────────────
+# Each builder returns (gate [A,B] bool, score [A,B] float) computed once per
+# frame by broadcasting rows (heads/persons) against columns (persons/motos).
+
+def head_person_matrix(head_boxes, person_boxes):
+    """
+    Head → person gating: head center inside the upper 60% of the person
+    box, expanded by max(20% width, 20% height). Score is the L1 distance
+    between head center and person center (lower = better).
+    """
+    _, _, _, _, _, _, hcx, hcy = _split(head_boxes)
+    px1, py1, px2, py2, p_w, p_h, p_cx, p_cy = _split(person_boxes)
+    hcx, hcy = hcx[:, None], hcy[:, None]
+
+    margin = np.maximum(p_w * 0.20, p_h * 0.20)
+    upper_y2 = py1 + p_h * 0.60
+    gate = (
+        (px1 - margin <= hcx) & (hcx <= px2 + margin)
+        & (py1 - margin <= hcy) & (hcy <= upper_y2 + margin)
+    )
+    dist = np.abs(hcx - p_cx) + np.abs(hcy - p_cy)
+    return gate, dist
+
+
+def head_moto_matrix(head_boxes, moto_boxes):
+    """
+    Head → motorcycle gating: head center within the motorcycle span (±30%),
+    head bottom at most 15% of the bike height below the bike, head top at
+    most 2× the bike height above it. Score is 1 / (1 + h_dist + v_dist).
+    """
+    _, h_top, _, h_bottom, _, _, hcx, hcy = _split(head_boxes)
+    mx1, my1, mx2, my2, m_w, m_h, m_cx, m_cy = _split(moto_boxes)
+    hcx, hcy = hcx[:, None], hcy[:, None]
+    h_top, h_bottom = h_top[:, None], h_bottom[:, None]
+
+    h_margin = m_w * 0.30
+    gate = (
+        (hcx >= mx1 - h_margin) & (hcx <= mx2 + h_margin)
+        & (h_bottom <= my2 + m_h * 0.15)
+        & (h_top >= my1 - m_h * 2.0)
+    )
+    h_dist = np.abs(hcx - m_cx) / np.maximum(m_w, 1)
+    v_dist = np.abs(hcy - m_cy) / np.maximum(m_h, 1)
+    score = 1.0 / (1.0 + h_dist + v_dist)
+    return gate, score
+
+
+def person_moto_matrix(person_boxes, moto_boxes):
+    """
+    Person → motorcycle fallback gating (standing-pedestrian filters):
+    height ≤ 1.5× bike height, center within the bike span (±30%), bottom
+    within 50% of the bike height of the bike bottom, vertical overlap ≥ 30%
+    of the person height. Score is v_ratio / (1 + h_dist + v_dist).
+    """
+    _, py1, _, py2, _, p_h, p_cx, p_cy = _split(person_boxes)
+    mx1, my1, mx2, my2, m_w, m_h, m_cx, m_cy = _split(moto_boxes)
+    py1, py2, p_h = py1[:, None], py2[:, None], p_h[:, None]
+    p_cx, p_cy = p_cx[:, None], p_cy[:, None]
+
+    h_margin = m_w * 0.30
+    v_overlap = np.maximum(0, np.minimum(py2, my2) - np.maximum(py1, my1))
+    v_ratio = v_overlap / np.maximum(p_h, 1)
+    gate = (
+        ~(p_h > m_h * 1.5)
+        & (p_cx >= mx1 - h_margin) & (p_cx <= mx2 + h_margin)
+        & ~(np.abs(py2 - my2) > m_h * 0.50)
+        & ~(v_ratio < 0.30)
+    )
+    h_dist = np.abs(p_cx - m_cx) / np.maximum(m_w, 1)
+    v_dist = np.abs(p_cy - m_cy) / np.maximum(m_h, 1)
+    score = v_ratio / (1.0 + h_dist + v_dist)
+    return gate, score
+
+
+# ── Assignment ───────────────────────────────────────────────────────────────
+
+def _best_per_row(gate, score, maximize=True):
+    """
+    Per-row best column among gated entries (first index wins on ties, like
+    the original strict-comparison loops). Returns (col [A] or -1, value [A]).
+    """
+    n_rows = gate.shape[0]
+    if gate.size == 0:
+        return np.full(n_rows, -1), np.zeros(n_rows)
+    fill = -np.inf if maximize else np.inf
+    masked = np.where(gate, score, fill)
+    best = masked.argmax(axis=1) if maximize else masked.argmin(axis=1)
+    value = masked[np.arange(n_rows), best]
+    best = np.where(gate.any(axis=1), best, -1)
+    return best, value
+
+
+def solve_assignment(cost):
+    """
+    Min-cost assignment (Hungarian / Jonker-Volgenant style potentials) for
+    an (n,m) cost matrix with n <= m. Returns the column index per row.
+    """
+    n, m = cost.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=np.int64)    # p[j] = row assigned to column j (1-based, 0 = none)
+    way = np.zeros(m + 1, dtype=np.int64)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            cur = np.full(m + 1, np.inf)
+            cur[1:] = cost[i0 - 1] - u[i0] - v[1:]
+            upd = ~used & (cur < minv)
+            minv[upd] = cur[upd]
+            way[upd] = j0
+            masked = np.where(used, np.inf, minv)
+            j1 = int(masked.argmin())
+            delta = masked[j1]
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[~used] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+    cols = np.full(n, -1, dtype=np.int64)
+    for j in range(1, m + 1):
+        if p[j]:
+            cols[p[j] - 1] = j - 1
+    return cols
+
+
+def _optimal_rider_assignment(unit_scores, n_motos, max_riders):
+    """
+    Assign rider units (rows of a [U,M] score matrix, NaN = not allowed) to
+    motorcycles, each bike offering `max_riders` seats, maximizing the total
+    score. Every unit ends up on at most one bike. Returns bike idx per unit or -1.
+    """
+    n_units = unit_scores.shape[0]
+    if n_units == 0 or n_motos == 0:
+        return np.full(n_units, -1)
+    seats = np.repeat(unit_scores, max_riders, axis=1)          # [U, M*max_riders]
+    cost = np.where(np.isnan(seats), 1e9, -seats)
+    cost = np.hstack([cost, np.zeros((n_units, n_units))])      # dummy "no bike" columns
+    cols = solve_assignment(cost)
+    return np.where(cols < n_motos * max_riders, cols // max_riders, -1)
+
+
+def associate(head_boxes, person_boxes, moto_boxes, mode="greedy", max_riders=ASSOCIATION_MAX_RIDERS):
+    """
+    Stage 3 association for one frame.
+
+    greedy  — each head / fallback person independently takes its best
+              gated match (identical to the original nested loops).
+    optimal — heads sharing a person form one rider unit; units (and
+              head-less fallback persons) are assigned jointly with a
+              per-bike seat limit, so one person is never counted on two bikes.
+
+    Returns (head_to_person, head_to_moto, fallback) where fallback maps
+    person idx → (moto idx, score) for persons matched without a head.
+    """
+    head_boxes, person_boxes, moto_boxes = _as_boxes(head_boxes), _as_boxes(person_boxes), _as_boxes(moto_boxes)
+    n_heads, n_persons, n_motos = len(head_boxes), len(person_boxes), len(moto_boxes)
+
+    hp_gate, hp_dist = head_person_matrix(head_boxes, person_boxes)
+    hp_best, _ = _best_per_row(hp_gate, hp_dist, maximize=False)
+    head_to_person = {h: int(p) for h, p in enumerate(hp_best) if p >= 0}
+
+    hm_gate, hm_score = head_moto_matrix(head_boxes, moto_boxes)
+    pm_gate, pm_score = person_moto_matrix(person_boxes, moto_boxes)
+    pm_gate &= pm_score > 0.1
+
+    if mode == "optimal":
+        # Rider units: one per person with a head, one per person-less head,
+        # one per head-less person (fallback); score = best gated head score.
+        units = {}
+        for h in range(n_heads):
+            units.setdefault(("p", head_to_person[h]) if h in head_to_person else ("h", h), []).append(h)
+        head_units = list(units.items())
+        head_unit_persons = {key[1] for key, _ in head_units if key[0] == "p"}
+        fallback_persons = [p for p in range(n_persons) if p not in head_unit_persons]
+
+        unit_scores = np.full((len(head_units) + len(fallback_persons), n_motos), np.nan)
+        for u_idx, (_, h_ids) in enumerate(head_units):
+            best = np.where(hm_gate[h_ids], hm_score[h_ids], -np.inf).max(axis=0)
+            unit_scores[u_idx] = np.where(np.isfinite(best), best, np.nan)
+        for f_idx, p in enumerate(fallback_persons):
+            unit_scores[len(head_units) + f_idx] = np.where(pm_gate[p], pm_score[p], np.nan)
+        # A person whose heads gate no bike falls back to the body-box signal
+        for u_idx, (key, _) in enumerate(head_units):
+            if key[0] == "p" and np.isnan(unit_scores[u_idx]).all():
+                p = key[1]
+                unit_scores[u_idx] = np.where(pm_gate[p], pm_score[p], np.nan)
+
+        bikes = _optimal_rider_assignment(unit_scores, n_motos, max_riders)
+        head_to_moto = {}
+        fallback = {}
+        for u_idx, (key, h_ids) in enumerate(head_units):
+            m = int(bikes[u_idx])
+            if m < 0:
+                continue
+            gated = [h for h in h_ids if hm_gate[h, m]]
+            if gated:
+                head_to_moto.update({h: m for h in gated})
+            elif key[0] == "p":
+                fallback[key[1]] = (m, float(pm_score[key[1], m]))
+        for f_idx, p in enumerate(fallback_persons):
+            m = int(bikes[len(head_units) + f_idx])
+            if m >= 0:
+                fallback[p] = (m, float(pm_score[p, m]))
+        return head_to_person, dict(sorted(head_to_moto.items())), dict(sorted(fallback.items()))
+
+    # Greedy: per-row best, exactly as the original loops
+    hm_best, _ = _best_per_row(hm_gate, hm_score)
+    head_to_moto = {h: int(m) for h, m in enumerate(hm_best) if m >= 0}
+
+    on_bike_via_head = {head_to_person[h] for h in head_to_moto if h in head_to_person}
+    pm_best, pm_value = _best_per_row(pm_gate, pm_score)
+    fallback = {
+        p: (int(pm_best[p]), float(pm_value[p]))
+        for p in range(n_persons)
+        if p not in on_bike_via_head and pm_best[p] >= 0
+    }
+    return head_to_person, head_to_moto, fallback
@@ -0,0 +1,109 @@
+import tarfile
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from config import BATCH_MAX_IN_FLIGHT
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff")
+
+
+# ── Batch Inputs ─────────────────────────────────────────────────────────────
+
+def is_archive(filename):
+    name = (filename or "").lower()
+    return name.endswith((".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz"))
+
+
+def iter_batch_items(sources):
+    """
+    Yield (name, bytes) for every image in `sources` — a list of
+    (filename, path) pairs that are single images or zip/tar archives.
+    Archive members are read lazily, one at a time, as the caller pulls them.
+    An unreadable archive yields (name, exception) so it is reported per item.
+    """
+    for filename, path in sources:
+        if not is_archive(filename):
+            with open(path, "rb") as f:
+                yield filename, f.read()
+            continue
+        try:
+            if filename.lower().endswith(".zip"):
+                with zipfile.ZipFile(path) as zf:
+                    for info in zf.infolist():
+                        if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                            yield f"{filename}/{info.filename}", zf.read(info)
+            else:
+                with tarfile.open(path, "r:*") as tf:
+                    for member in tf:
+                        if member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS):
+                            yield f"{filename}/{member.name}", tf.extractfile(member).read()
+        except (zipfile.BadZipFile, tarfile.TarError, OSError) as e:
+            yield filename, e
+
+
+# ── Bounded Concurrent Execution ─────────────────────────────────────────────
+
+def run_batch(items, process, max_in_flight=BATCH_MAX_IN_FLIGHT):
+    """
+    Run `process(bytes)` over (name, bytes) items with at most `max_in_flight`
+    images decoded / in the pipeline at once, and yield one event per image
+    as soon as it finishes (completion order, tagged with its input index),
+    followed by a summary. A failing image only fails its own event.
+
+    The concurrent pipelines' model calls meet in the inference scheduler,
+    which is what turns them into batched Stage 1/2 forward passes. Without
+    the scheduler they take turns on each model (see models.serialized);
+    the caller passes max_in_flight=1 for models that allow neither (see
+    main.pipeline_concurrency).
+    """
+    t_start = time.time()
+    max_in_flight = max(1, int(max_in_flight))
+    items = iter(items)
+    pending = {}
+    counts = {"images": 0, "succeeded": 0, "failed": 0}
+    early_errors = []
+
+    with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="batch") as pool:
+        def fill():
+            while len(pending) < max_in_flight:
+                try:
+                    name, data = next(items)
+                except StopIteration:
+                    return
+                index = counts["images"]
+                counts["images"] += 1
+                if isinstance(data, Exception):
+                    early_errors.append((index, name, data))
+                    continue
+                pending[pool.submit(process, data)] = (index, name)
+
+        fill()
+        while pending or early_errors:
+            for index, name, error in early_errors:
+                counts["failed"] += 1
+                yield {"event": "error", "index": index, "name": name, "error": f"Unreadable archive: {error}"}
+            early_errors.clear()
+            if not pending:
+                fill()
+                continue
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, name = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    counts["failed"] += 1
+                    yield {"event": "error", "index": index, "name": name, "error": str(e)}
+                else:
+                    counts["succeeded"] += 1
+                    yield {"event": "result", "index": index, "name": name, "result": result}
+            fill()
+
+    yield {
+        "event": "summary",
+        **counts,
+        "processing_time_ms": round((time.time() - t_start) * 1000),
+    }
+
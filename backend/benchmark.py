@@ -0,0 +1,254 @@
+"""
+Stage-level benchmark of the detection pipeline with stub detectors.
+
+    python benchmark.py --vehicles 1 5 10 25 50 100 200 --json bench.json
+    python benchmark.py --update-baseline          # store this machine's baseline
+    python benchmark.py                            # exit 1 if a stage regressed, 2 without a baseline
+
+No weights or network needed: a deterministic synthetic scene is generated
+per density (motorcycles with 1-3 riders, pedestrians, helmet / no-helmet
+heads painted as colored blobs). The stub base model returns the scene's
+person / motorcycle boxes; the stub helmet model finds the painted heads in
+whatever letterboxed crops it is given, so ROI planning, cropping and
+coordinate mapping run for real. Each stage of run_pipeline is timed
+separately (base_model, helmet_full, roi_plan, helmet_rois, nms, matching,
+violations, response, plus JSON serialization).
+
+A stage regresses when its median exceeds the baseline median by more than
+--tolerance (relative) and --noise-floor-ms (absolute). Without a baseline
+the check exits 2. Timings are machine-specific, so CI builds the baseline
+on the same runner: run --update-baseline on the target branch (or restore
+the file cached from its last run), then check the change against it:
+
+    git checkout main && python benchmark.py --update-baseline --baseline /tmp/bench_base.json
+    git checkout - && python benchmark.py --baseline /tmp/bench_base.json
+"""
+import argparse
+import json
+import os
+import platform
+import time
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+
+from config import BACKEND_DIR
+from pipeline import run_pipeline
+
+DEFAULT_BASELINE = os.path.join(BACKEND_DIR, "benchmark_baseline.json")
+STAGES = ("base_model", "helmet_full", "roi_plan", "helmet_rois", "nms", "matching", "violations", "response",
+          "serialize", "total")
+
+HELMET_COLOR = (0, 255, 0)      # painted "With Helmet" heads
+NO_HELMET_COLOR = (255, 0, 0)   # painted "Without Helmet" heads
+
+
+# ── Synthetic Scenes ─────────────────────────────────────────────────────────
+
+def make_scene(n_vehicles, width=1920, height=1080, seed=0):
+    """
+    Deterministic traffic scene: returns (RGB image, persons, motorcycles)
+    with boxes as [x1, y1, x2, y2] lists. Riders sit on their bike (so the
+    fallback matcher accepts them); about one pedestrian per three bikes.
+    """
+    rng = np.random.default_rng(seed * 1000 + n_vehicles)
+    img = np.zeros((height, width, 3), dtype=np.uint8)
+    persons, motorcycles = [], []
+
+    def add_person(x1, bottom, w, h, no_helmet):
+        box = [x1, bottom - h, x1 + w, bottom]
+        persons.append(box)
+        head = int(w * 0.4)
+        hx = int(x1 + (w - head) / 2)
+        hy = int(bottom - h)
+        img[hy:hy + head, hx:hx + head] = NO_HELMET_COLOR if no_helmet else HELMET_COLOR
+
+    for _ in range(n_vehicles):
+        mw = float(rng.uniform(60, 120))
+        mh = mw * 0.8
+        x1 = float(rng.uniform(0, width - mw))
+        y1 = float(rng.uniform(mh * 1.5, height - mh))
+        motorcycles.append([x1, y1, x1 + mw, y1 + mh])
+        n_riders = int(rng.choice([1, 2, 3], p=[0.5, 0.35, 0.15]))
+        pw = mw * 0.4
+        for r in range(n_riders):
+            px = x1 + mw * 0.1 + r * pw * 0.6
+            add_person(px, y1 + mh * 0.8, pw, mh * 1.3, bool(rng.random() < 0.3))
+
+    for _ in range(n_vehicles // 3):
+        pw = float(rng.uniform(25, 45))
+        px = float(rng.uniform(0, width - pw))
+        bottom = float(rng.uniform(pw * 4, height))
+        add_person(px, bottom, pw, pw * 3.5, bool(rng.random() < 0.5))
+
+    return img, persons, motorcycles
+
+
+def _result(boxes, confs, classes):
+    xyxy = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    return SimpleNamespace(boxes=SimpleNamespace(
+        xyxy=xyxy,
+        conf=np.asarray(confs, dtype=np.float32).reshape(-1),
+        cls=np.asarray(classes, dtype=np.float32).reshape(-1),
+    ))
+
+
+class StubBaseModel:
+    """Returns the scene's persons (class 0) and motorcycles (class 3)."""
+
+    names = {0: "person", 3: "motorcycle"}
+
+    def __init__(self, persons, motorcycles):
+        boxes = persons + motorcycles
+        self.result = _result(boxes, [0.9] * len(boxes), [0] * len(persons) + [3] * len(motorcycles))
+
+    def __call__(self, source, conf=0.25, imgsz=640, **kwargs):
+        images = source if isinstance(source, list) else [source]
+        return [self.result for _ in images]
+
+
+class StubHelmetModel:
+    """Finds the painted head blobs in each (letterboxed) image."""
+
+    names = {0: "With Helmet", 1: "Without Helmet"}
+
+    def __call__(self, source, conf=0.08, imgsz=640, **kwargs):
+        images = source if isinstance(source, list) else [source]
+        return [self._detect(img) for img in images]
+
+    @staticmethod
+    def _detect(img):
+        boxes, classes = [], []
+        r, g = img[..., 0], img[..., 1]
+        for cls_id, mask in ((0, (g > 160) & (r < 90)), (1, (r > 160) & (g < 90))):
+            n, _, stats, _ = cv2.connectedComponentsWithStats(mask.astype(np.uint8), connectivity=4)
+            for x, y, w, h, area in stats[1:]:
+                if area >= 4:
+                    boxes.append([x, y, x + w, y + h])
+                    classes.append(cls_id)
+        return _result(boxes, [0.6] * len(boxes), classes)
+
+
+# ── Measurement ──────────────────────────────────────────────────────────────
+
+def bench_density(n_vehicles, repeat, width, height, seed, mode=None):
+    img, persons, motorcycles = make_scene(n_vehicles, width, height, seed)
+    base, helmet = StubBaseModel(persons, motorcycles), StubHelmetModel()
+
+    samples = {stage: [] for stage in STAGES}
+    result = None
+    for r in range(repeat + 1):  # first run is a warm-up
+        timings = {}
+        t0 = time.perf_counter()
+        result = run_pipeline(img, base, helmet, timings=timings, mode=mode)
+        t_ser = time.perf_counter()
+        json.dumps(result)
+        timings["serialize"] = (time.perf_counter() - t_ser) * 1000
+        timings["total"] = (time.perf_counter() - t0) * 1000
+        if r > 0 or repeat == 0:
+            for stage in STAGES:
+                samples[stage].append(timings.get(stage, 0.0))
+
+    return {
+        "vehicles": n_vehicles,
+        "counts": {
+            "persons": len(result["persons"]),
+            "motorcycles": len(result["motorcycles"]),
+            "heads": len(result["detections"]),
+            "violations": len(result["violations"]),
+            **result["roi_plan"],
+        },
+        "stages": {
+            stage: {
+                "median_ms": round(float(np.median(v)), 4),
+                "p95_ms": round(float(np.percentile(v, 95)), 4),
+            }
+            for stage, v in samples.items()
+        },
+    }
+
+
+def find_regressions(results, baseline, tolerance, noise_floor_ms):
+    """(vehicles, stage, baseline_ms, current_ms) for every stage slower than the baseline allows."""
+    base_by_n = {row["vehicles"]: row["stages"] for row in baseline.get("results", [])}
+    regressions = []
+    for row in results:
+        base_stages = base_by_n.get(row["vehicles"])
+        if not base_stages:
+            continue
+        for stage, cur in row["stages"].items():
+            if stage not in base_stages:
+                continue
+            old, new = base_stages[stage]["median_ms"], cur["median_ms"]
+            if new > old * (1 + tolerance) and new - old > noise_floor_ms:
+                regressions.append((row["vehicles"], stage, old, new))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vehicles", type=int, nargs="+", default=[1, 5, 10, 25, 50, 100, 200],
+                        help="scene densities (motorcycles per image)")
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs per density (after one warm-up)")
+    parser.add_argument("--size", default="1920x1080", help="synthetic image size WxH")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mode", default="accurate", help="cascade mode (fast / balanced / accurate)")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline results to compare against")
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.30, help="allowed relative slowdown per stage")
+    parser.add_argument("--noise-floor-ms", type=float, default=0.2, help="ignore slowdowns smaller than this")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    results = []
+    for n in args.vehicles:
+        row = bench_density(n, args.repeat, width, height, args.seed, args.mode)
+        results.append(row)
+        print(f"▶ {n:4d} vehicles: total {row['stages']['total']['median_ms']:8.2f} ms "
+              f"({row['counts']['persons']} persons, {row['counts']['heads']} heads, {row['counts']['tiles']} tiles)")
+
+    print(f"\n{'vehicles':>8s} " + " ".join(f"{s:>16s}" for s in STAGES))
+    for row in results:
+        print(f"{row['vehicles']:8d} " + " ".join(f"{row['stages'][s]['median_ms']:16.3f}" for s in STAGES))
+
+    report = {
+        "meta": {
+            "size": [width, height],
+            "repeat": args.repeat,
+            "seed": args.seed,
+            "mode": args.mode,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "numpy": np.__version__,
+        },
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n📝 Results written to {args.json}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📌 Baseline written to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"\n❌ No baseline at {args.baseline} — run with --update-baseline to store one")
+        raise SystemExit(2)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = find_regressions(results, baseline, args.tolerance, args.noise_floor_ms)
+    if regressions:
+        print(f"\n❌ {len(regressions)} stage regression(s) vs {args.baseline}:")
+        for n, stage, old, new in regressions:
+            print(f"   {n:4d} vehicles  {stage:16s} {old:8.3f} → {new:8.3f} ms")
+        raise SystemExit(1)
+    print(f"\n✅ No stage regressed more than {args.tolerance:.0%} vs {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+from config import CASCADE_DEFAULT_MODE, CASCADE_PROFILES, HELMET_FULL_IMGSZ
+
+
+# ── Cascade Modes ────────────────────────────────────────────────────────────
+# Stage 2 is the expensive part of the pipeline. The cascade decides, from
+# Stage 1's output, which helmet passes are worth running:
+#   accurate  every pass (2a full image, 2b motorcycle ROIs, 2c person ROIs)
+#   balanced  no helmet passes on frames without motorcycles or persons;
+#             ROI tiles that barely out-zoom the full-image pass are skipped
+#   fast      no helmet passes without motorcycles; no 2c; stricter zoom gate
+
+def resolve_mode(mode=None):
+    """Validated cascade mode (None → CASCADE_DEFAULT_MODE); ValueError if unknown."""
+    mode = mode or CASCADE_DEFAULT_MODE
+    if mode not in CASCADE_PROFILES:
+        raise ValueError(f"Unknown mode: {mode} (expected one of {', '.join(CASCADE_PROFILES)})")
+    return mode
+
+
+def helmet_skip_reason(mode, n_persons, n_motorcycles):
+    """Why Stage 2 is skipped entirely for this frame, or None if it runs."""
+    rule = CASCADE_PROFILES[mode]["skip_helmet_when"]
+    if rule == "no_motorcycles" and n_motorcycles == 0:
+        return "no motorcycles"
+    if rule == "no_targets" and n_motorcycles == 0 and n_persons == 0:
+        return "no motorcycles or persons"
+    return None
+
+
+def full_image_scale(img_w, img_h, imgsz=HELMET_FULL_IMGSZ):
+    """Scale (≤ 1 for large images) at which the full-image pass sees the frame."""
+    return min(imgsz / max(img_w, 1), imgsz / max(img_h, 1))
+
+
+def select_tiles(mode, tiles, img_w, img_h):
+    """
+    Split planned ROI tiles into (kept, skipped_low_zoom). A tile's zoom gain
+    is its zoom relative to the full-image pass — near 1, the ROI pass would
+    see the heads at about the resolution pass 2a already did.
+    """
+    min_gain = CASCADE_PROFILES[mode]["min_zoom_gain"]
+    if min_gain <= 0:
+        return list(tiles), []
+    full_scale = full_image_scale(img_w, img_h)
+    kept, skipped = [], []
+    for tile in tiles:
+        (kept if tile["zoom"] / full_scale >= min_gain else skipped).append(tile)
+    return kept, skipped
@@ -0,0 +1,213 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from config import (
+    CHANGE_GATE_WIDTH, CHANGE_GATE_CELL_PX, CHANGE_GATE_PIXEL_DELTA, CHANGE_GATE_CELL_MIN_PIXELS,
+    CHANGE_GATE_MAX_SKIP_S, CHANGE_GATE_MAX_CAMERAS,
+)
+from metrics import CHANGE_GATE
+from roi_batching import make_head_detection
+
+RESULT_BYTES_PER_ITEM = 256  # rough JSON size of one detection / person / motorcycle / violation, for stats()
+
+_gates = OrderedDict()
+_gates_lock = threading.Lock()
+
+
+# ── Per-Camera Change Gate ───────────────────────────────────────────────────
+
+class ChangeGate:
+    """
+    Change detector for one fixed camera.
+
+    The "background" is not a learned background model but a small
+    grayscale copy (`width` px wide) of the frame the camera's last result
+    was computed from, replaced on every processed frame. That is what
+    reusing the result needs — does this frame still look like the one the
+    result describes? — so a vehicle that stops is "unchanged" from the next
+    frame on (its heads are in the reused result), and slow drift is
+    absorbed at each processed frame; while frames are skipped, drift builds
+    up against the same copy until it counts as change (or `max_skip_s`
+    forces a run).
+
+    Each new frame is shrunk the same way (from the reduced-size preview
+    decode) and compared with the copy. The global brightness shift (median difference) is removed
+    first, so exposure drift at dusk does not count as change. A cell of
+    `cell_px` × `cell_px` background pixels is changed when at least
+    `cell_min_pixels` of its pixels moved by more than `pixel_delta` gray
+    levels; changed cells are grown by one cell to cover motion at edges.
+    (At the default 320 px width a rider's head covers only a few background
+    pixels, hence a pixel count rather than a fraction of the cell.)
+
+    No changed cell: the frame is skipped and the last result is returned
+    (at most `max_skip_s` after it was computed). Otherwise the pipeline
+    runs, but ROI tiles that lie entirely in unchanged cells reuse the last
+    result's heads instead of a helmet pass (see GateDecision.restrict).
+    """
+
+    def __init__(self, width=CHANGE_GATE_WIDTH, cell_px=CHANGE_GATE_CELL_PX, pixel_delta=CHANGE_GATE_PIXEL_DELTA,
+                 cell_min_pixels=CHANGE_GATE_CELL_MIN_PIXELS, max_skip_s=CHANGE_GATE_MAX_SKIP_S):
+        self.width = width
+        self.cell_px = cell_px
+        self.pixel_delta = pixel_delta
+        self.cell_min_pixels = cell_min_pixels
+        self.max_skip_s = max_skip_s
+        self.background = None
+        self.result = None          # (result, mode, time) the background belongs to
+        self.result_bytes = 0       # estimated JSON size of that result, for stats()
+        self.lock = threading.Lock()
+        self.counters = {"frames": 0, "skipped": 0, "processed": 0, "tiles_reused": 0, "tiles_run": 0}
+
+    def _small(self, frame):
+        preview = frame.preview
+        h, w = preview.shape[:2]
+        size = (self.width, max(1, round(h * self.width / w)))
+        return cv2.cvtColor(cv2.resize(preview, size, interpolation=cv2.INTER_AREA), cv2.COLOR_RGB2GRAY)
+
+    def _changed_cells(self, small, background):
+        diff = small.astype(np.int16) - background
+        moved = np.abs(diff - int(np.median(diff))) > self.pixel_delta
+        h, w = moved.shape
+        rows, cols = -(-h // self.cell_px), -(-w // self.cell_px)
+        padded = np.zeros((rows * self.cell_px, cols * self.cell_px), dtype=np.uint16)
+        padded[:h, :w] = moved
+        cells = padded.reshape(rows, self.cell_px, cols, self.cell_px).sum(axis=(1, 3)) >= self.cell_min_pixels
+        grown = cells.copy()
+        grown[1:] |= cells[:-1]
+        grown[:-1] |= cells[1:]
+        grown[:, 1:] |= grown[:, :-1].copy()
+        grown[:, :-1] |= grown[:, 1:].copy()
+        return grown
+
+    def check(self, frame, mode, now=None):
+        """GateDecision for a new frame of this camera (a decode.py frame)."""
+        now = time.time() if now is None else now
+        small = self._small(frame)
+        with self.lock:
+            self.counters["frames"] += 1
+            background, last = self.background, self.result
+        if background is None or background.shape != small.shape or last is None or last[1] != mode:
+            return GateDecision(self, small, None, frame.width, frame.height, None)
+        cells = self._changed_cells(small, background)
+        reusable = now - last[2] <= self.max_skip_s
+        return GateDecision(self, small, cells, frame.width, frame.height, last if reusable else None)
+
+    def commit(self, decision, result, mode, now=None):
+        """Make the frame behind `decision` (and its pipeline result) the new background."""
+        result_bytes = RESULT_BYTES_PER_ITEM * sum(
+            len(result.get(key, ())) for key in ("detections", "persons", "motorcycles", "violations"))
+        with self.lock:
+            self.background = decision.small
+            self.result = (result, mode, time.time() if now is None else now)
+            self.result_bytes = result_bytes
+            self.counters["processed"] += 1
+            self.counters["tiles_reused"] += decision.tiles_reused
+            self.counters["tiles_run"] += decision.tiles_run
+        CHANGE_GATE.inc(kind="frame", outcome="processed")
+
+    def reuse(self, decision, t_start):
+        """The last result for a skipped frame (a copy, marked "change_gate.skipped")."""
+        result, _, computed_at = decision.last
+        result = copy.deepcopy(result)
+        result.pop("cached", None)
+        result["processing_time_ms"] = round((time.time() - t_start) * 1000)
+        result["change_gate"] = {"skipped": True, "changed_cells": 0, "reused_age_s": round(time.time() - computed_at, 3)}
+        with self.lock:
+            self.counters["skipped"] += 1
+        CHANGE_GATE.inc(kind="frame", outcome="skipped")
+        return result
+
+    def stats(self):
+        with self.lock:
+            frames = self.counters["frames"]
+            tiles = self.counters["tiles_reused"] + self.counters["tiles_run"]
+            return {
+                **self.counters,
+                "skip_rate": round(self.counters["skipped"] / frames, 4) if frames else 0.0,
+                "tile_reuse_rate": round(self.counters["tiles_reused"] / tiles, 4) if tiles else 0.0,
+                "state_bytes": (self.background.nbytes if self.background is not None else 0) + self.result_bytes,
+            }
+
+
+class GateDecision:
+    """Outcome of ChangeGate.check() for one frame; `skip` means no cell changed."""
+
+    def __init__(self, gate, small, cells, width, height, last):
+        self.gate = gate
+        self.small = small
+        self.cells = cells              # changed-cell grid, None: no usable background yet
+        self.last = last                # (result, mode, time) that unchanged areas may reuse
+        self.scale = (small.shape[1] / width, small.shape[0] / height)
+        self.tiles_reused = 0
+        self.tiles_run = 0
+
+    @property
+    def skip(self):
+        return self.last is not None and self.cells is not None and not self.cells.any()
+
+    def _unchanged(self, box):
+        sx, sy = self.scale
+        cell = self.gate.cell_px
+        x1, y1 = int(box[0] * sx) // cell, int(box[1] * sy) // cell
+        x2, y2 = int(np.ceil(box[2] * sx / cell)), int(np.ceil(box[3] * sy / cell))
+        return not self.cells[y1:max(y2, y1 + 1), x1:max(x2, x1 + 1)].any()
+
+    def restrict(self, tiles):
+        """
+        (tiles to run, reused raw heads): tiles entirely in unchanged cells
+        are dropped and the last result's heads centered in them reused.
+        """
+        if self.last is None or self.cells is None:
+            self.tiles_run = len(tiles)
+            return tiles, []
+        heads = self.last[0]["detections"]
+        run, reused = [], []
+        for tile in tiles:
+            if not self._unchanged(tile["box"]):
+                run.append(tile)
+                continue
+            x1, y1, x2, y2 = tile["box"]
+            for det in heads:
+                cx, cy = (det["box"][0] + det["box"][2]) / 2, (det["box"][1] + det["box"][3]) / 2
+                if x1 <= cx <= x2 and y1 <= cy <= y2:
+                    reused.append(make_head_detection(list(det["box"]), det["confidence"], det["class_id"],
+                                                      {det["class_id"]: det["label"]}, "unchanged"))
+        self.tiles_run, self.tiles_reused = len(run), len(tiles) - len(run)
+        if self.tiles_reused:
+            CHANGE_GATE.inc(self.tiles_reused, kind="tile", outcome="reused")
+        if self.tiles_run:
+            CHANGE_GATE.inc(self.tiles_run, kind="tile", outcome="run")
+        return run, reused
+
+    def report(self):
+        """The response's "change_gate" field for a processed frame."""
+        return {
+            "skipped": False,
+            "changed_cells": int(self.cells.sum()) if self.cells is not None else None,
+            "tiles_reused": self.tiles_reused,
+        }
+
+
+# ── Camera Registry ──────────────────────────────────────────────────────────
+
+def camera_gate(camera):
+    """The ChangeGate of `camera` (the least recently used camera is evicted past CHANGE_GATE_MAX_CAMERAS)."""
+    with _gates_lock:
+        gate = _gates.get(camera)
+        if gate is None:
+            gate = _gates[camera] = ChangeGate()
+            while len(_gates) > CHANGE_GATE_MAX_CAMERAS:
+                _gates.popitem(last=False)
+        _gates.move_to_end(camera)
+        return gate
+
+
+def gate_stats():
+    with _gates_lock:
+        gates = dict(_gates)
+    return {camera: gate.stats() for camera, gate in gates.items()}
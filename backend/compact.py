@@ -0,0 +1,193 @@
+import gzip
+import importlib.util
+import json
+
+import numpy as np
+
+from config import COMPACT_GZIP_MIN_BYTES
+
+# ── Compact Response Format ──────────────────────────────────────────────────
+# Opt-in alternative to the /detect JSON for high-volume consumers, chosen by
+# the Accept header. Every box is encoded once, in a columnar table per kind
+# (int16 pixel coordinates, float32 confidences); violations reference boxes
+# by row index instead of copying them, and repeated strings become codes
+# into small lookup lists. The default JSON contract is unchanged.
+#
+#   application/vnd.traffic.compact+json     arrays as JSON lists
+#   application/vnd.traffic.compact+msgpack  arrays as raw little-endian
+#                                            bytes: {"dtype", "data"}
+#
+# Either is gzip-compressed when Accept-Encoding allows gzip (q > 0).
+
+COMPACT_JSON = "application/vnd.traffic.compact+json"
+COMPACT_MSGPACK = "application/vnd.traffic.compact+msgpack"
+COMPACT_VERSION = 1
+
+HELMET_STATUSES = ["unknown", "helmet", "no_helmet"]
+VIOLATION_TYPES = ["no_helmet", "triple_riding"]
+SEVERITIES = ["high", "medium"]
+
+
+def _code(table, value):
+    if value not in table:
+        table.append(value)
+    return table.index(value)
+
+
+def _boxes(rows):
+    return np.asarray([r["box"] for r in rows], dtype=np.float32).reshape(-1, 4).round().astype(np.int16)
+
+
+def _ids(values):
+    """int16 ids with -1 for None."""
+    return np.asarray([-1 if v is None else v for v in values], dtype=np.int16)
+
+
+def _ragged(lists):
+    """(flat values, offsets) for a list of id lists — row i is flat[offsets[i]:offsets[i + 1]]."""
+    offsets = np.zeros(len(lists) + 1, dtype=np.int32)
+    offsets[1:] = np.cumsum([len(values) for values in lists])
+    flat = np.asarray([v for values in lists for v in values], dtype=np.int16)
+    return flat, offsets
+
+
+def to_compact(result):
+    """
+    Columnar form of a run_pipeline() result (numpy arrays, not yet encoded).
+    A no-helmet violation without a matched person points at its head via
+    "head_id"; descriptions are dropped (they follow from type, severity and
+    rider_count).
+    """
+    detections, persons, motorcycles = result["detections"], result["persons"], result["motorcycles"]
+    labels = {}
+    for det in detections:
+        labels[det["class_id"]] = det["label"]
+    statuses, types, severities = list(HELMET_STATUSES), list(VIOLATION_TYPES), list(SEVERITIES)
+
+    head_by_box = {tuple(det["box"]): h_idx for h_idx, det in enumerate(detections)}
+    violations = result["violations"]
+    head_ids = [
+        head_by_box.get(tuple(v["person_box"])) if v.get("person_id") is None and "person_box" in v else None
+        for v in violations
+    ]
+    person_ids, person_offsets = _ragged([
+        v["person_ids"] if "person_ids" in v else ([] if v.get("person_id") is None else [v["person_id"]])
+        for v in violations
+    ])
+    rider_ids, rider_offsets = _ragged([m["rider_ids"] for m in motorcycles])
+
+    compact = {
+        "format": COMPACT_VERSION,
+        "image_size": [result["image_size"]["width"], result["image_size"]["height"]],
+        "labels": {str(k): v for k, v in sorted(labels.items())},
+        "detections": {
+            "box": _boxes(detections),
+            "confidence": np.asarray([d["confidence"] for d in detections], dtype=np.float32),
+            "class_id": np.asarray([d["class_id"] for d in detections], dtype=np.int16),
+            "person_id": _ids(d["person_id"] for d in detections),
+        },
+        "persons": {
+            "box": _boxes(persons),
+            "confidence": np.asarray([p["confidence"] for p in persons], dtype=np.float32),
+            "helmet_status": np.asarray([_code(statuses, p["helmet_status"]) for p in persons], dtype=np.int16),
+            "motorcycle_id": _ids(p["motorcycle_id"] for p in persons),
+        },
+        "motorcycles": {
+            "box": _boxes(motorcycles),
+            "confidence": np.asarray([m["confidence"] for m in motorcycles], dtype=np.float32),
+            "rider_count": np.asarray([m["rider_count"] for m in motorcycles], dtype=np.int16),
+            "rider_ids": rider_ids,
+            "rider_offsets": rider_offsets,
+        },
+        "violations": {
+            "type": np.asarray([_code(types, v["type"]) for v in violations], dtype=np.int16),
+            "severity": np.asarray([_code(severities, v["severity"]) for v in violations], dtype=np.int16),
+            "motorcycle_id": _ids(v["motorcycle_id"] for v in violations),
+            "head_id": _ids(head_ids),
+            "rider_count": np.asarray([v.get("rider_count", 0) for v in violations], dtype=np.int16),
+            "person_ids": person_ids,
+            "person_offsets": person_offsets,
+        },
+        "helmet_statuses": statuses,
+        "violation_types": types,
+        "severities": severities,
+    }
+    if any("evidence" in v for v in violations):
+        # Evidence crop ids (see evidence.py), None where a crop was dropped
+        for name in ("rider", "vehicle"):
+            compact["violations"][f"evidence_{name}"] = [v.get("evidence", {}).get(name) for v in violations]
+    for key in ("roi_plan", "cascade", "processing_time_ms", "cached"):
+        if key in result:
+            compact[key] = result[key]
+    return compact
+
+
+# ── Encoding ─────────────────────────────────────────────────────────────────
+
+def _plain(value, binary):
+    if isinstance(value, np.ndarray):
+        if binary:
+            value = value.astype(value.dtype.newbyteorder("<"))
+            return {"dtype": value.dtype.str, "data": value.tobytes()}
+        return value.tolist()
+    if isinstance(value, dict):
+        return {k: _plain(v, binary) for k, v in value.items()}
+    return value
+
+
+def _weighted(header):
+    """[(token, q)] of an Accept / Accept-Encoding header; an unparsable q counts as 0."""
+    items = []
+    for part in (header or "").split(","):
+        token, *params = [p.strip() for p in part.split(";")]
+        if not token:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        items.append((token.lower(), q))
+    return items
+
+
+def negotiate(accept):
+    """Compact media type requested by an Accept header, or None for the default JSON."""
+    for media_type, q in _weighted(accept):
+        if media_type in (COMPACT_JSON, COMPACT_MSGPACK) and q > 0:
+            return media_type
+    return None
+
+
+def accepts_gzip(accept_encoding):
+    """True when Accept-Encoding allows gzip: "gzip" or "*" with q > 0 ("gzip;q=0" refuses it)."""
+    weights = dict(_weighted(accept_encoding))
+    q = weights.get("gzip", weights.get("x-gzip", weights.get("*", 0.0)))
+    return q > 0
+
+
+def available(media_type):
+    """False when `media_type` needs an optional package that is not installed."""
+    return media_type != COMPACT_MSGPACK or importlib.util.find_spec("msgpack") is not None
+
+
+def encode_compact(result, media_type, accept_encoding=""):
+    """
+    (body bytes, headers) for `result` in the compact `media_type`
+    (msgpack needs the optional msgpack package, see available()).
+    """
+    compact = to_compact(result)
+    if media_type == COMPACT_MSGPACK:
+        import msgpack
+        body = msgpack.packb(_plain(compact, binary=True), use_bin_type=True)
+    else:
+        body = json.dumps(_plain(compact, binary=False), separators=(",", ":")).encode()
+
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if accepts_gzip(accept_encoding) and len(body) >= COMPACT_GZIP_MIN_BYTES:
+        body = gzip.compress(body, compresslevel=5)
+        headers["Content-Encoding"] = "gzip"
+    return body, headers
@@ -0,0 +1,142 @@
+"""
+Accuracy / latency comparison of inference backends on local images.
+
+    python compare_backends.py --images ../samples \
+        --configs pytorch:fp32 onnx:fp32 openvino:fp16 openvino:int8 \
+        --calibration ../calib --json backend_report.json
+
+The first config is the reference: every other config is scored against
+its output (head / person / motorcycle boxes matched at IoU ≥ 0.5 with the
+same label, plus exact violation-list agreement).
+"""
+import argparse
+import glob
+import json
+import os
+import time
+
+import numpy as np
+from PIL import Image, ImageOps
+
+import config
+from models import load_models
+from nms import iou_matrix
+from pipeline import run_pipeline
+
+
+def load_images(folder):
+    paths = sorted(
+        p for p in glob.glob(os.path.join(folder, "*"))
+        if p.lower().endswith((".jpg", ".jpeg", ".png", ".bmp", ".webp"))
+    )
+    images = []
+    for path in paths:
+        image = ImageOps.exif_transpose(Image.open(path)).convert("RGB")
+        images.append((os.path.basename(path), np.array(image)))
+    return images
+
+
+def _objects(result):
+    """(label, box) pairs of everything a pipeline result reports."""
+    objs = [(d["label"], d["box"]) for d in result["detections"]]
+    objs += [("person", p["box"]) for p in result["persons"]]
+    objs += [("motorcycle", m["box"]) for m in result["motorcycles"]]
+    return objs
+
+
+def match_counts(reference, candidate, iou_threshold=0.5):
+    """True positives (greedy, per label), reference count and candidate count."""
+    tp = 0
+    for label in {lbl for lbl, _ in reference} | {lbl for lbl, _ in candidate}:
+        ref = np.asarray([b for lbl, b in reference if lbl == label], dtype=np.float64).reshape(-1, 4)
+        cand = np.asarray([b for lbl, b in candidate if lbl == label], dtype=np.float64).reshape(-1, 4)
+        if not len(ref) or not len(cand):
+            continue
+        ious = iou_matrix(ref, cand)
+        while ious.size and ious.max() >= iou_threshold:
+            r, c = np.unravel_index(ious.argmax(), ious.shape)
+            tp += 1
+            ious[r, :] = -1
+            ious[:, c] = -1
+    return tp, len(reference), len(candidate)
+
+
+def _violation_key(result):
+    return sorted((v["type"], v["severity"], v["motorcycle_id"]) for v in result["violations"])
+
+
+def run_config(backend, precision, images, repeat, calibration_dir):
+    t_load = time.perf_counter()
+    base_model, helmet_model = load_models(backend, precision, calibration_dir=calibration_dir)
+    load_s = time.perf_counter() - t_load
+
+    results, latencies = [], []
+    for _, img in images:
+        for r in range(repeat + 1):  # first run per image is a warm-up
+            t0 = time.perf_counter()
+            result = run_pipeline(img, base_model, helmet_model)
+            if r > 0 or repeat == 0:
+                latencies.append((time.perf_counter() - t0) * 1000)
+        results.append(result)
+    return results, latencies, load_s
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", required=True, help="folder of test images")
+    parser.add_argument("--configs", nargs="+", default=["pytorch:fp32", "onnx:fp32", "openvino:fp32"],
+                        help="backend:precision pairs; the first is the reference")
+    parser.add_argument("--calibration", default=config.INT8_CALIBRATION_DIR, help="INT8 calibration image folder")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per image (after one warm-up)")
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+
+    images = load_images(args.images)
+    if not images:
+        raise SystemExit(f"No images in {args.images}")
+
+    report = []
+    reference = None
+    for spec in args.configs:
+        backend, precision = spec.split(":")
+        print(f"▶ {backend}/{precision} on {len(images)} image(s)...")
+        results, latencies, load_s = run_config(backend, precision, images, args.repeat, args.calibration)
+
+        row = {
+            "backend": backend,
+            "precision": precision,
+            "load_s": round(load_s, 2),
+            "latency_ms_mean": round(float(np.mean(latencies)), 1),
+            "latency_ms_p50": round(float(np.percentile(latencies, 50)), 1),
+            "latency_ms_p95": round(float(np.percentile(latencies, 95)), 1),
+        }
+        if reference is None:
+            reference = results
+        else:
+            tp = n_ref = n_cand = 0
+            for ref, cand in zip(reference, results):
+                t, r, c = match_counts(_objects(ref), _objects(cand))
+                tp, n_ref, n_cand = tp + t, n_ref + r, n_cand + c
+            row["recall_vs_ref"] = round(tp / n_ref, 4) if n_ref else 1.0
+            row["precision_vs_ref"] = round(tp / n_cand, 4) if n_cand else 1.0
+            row["violations_agree"] = round(
+                sum(_violation_key(a) == _violation_key(b) for a, b in zip(reference, results)) / len(images), 4
+            )
+        report.append(row)
+
+    print(f"\n{'backend':10s} {'prec':5s} {'load s':>7s} {'mean ms':>8s} {'p50 ms':>8s} {'p95 ms':>8s} "
+          f"{'recall':>7s} {'precis':>7s} {'viol=':>6s}")
+    for row in report:
+        print(f"{row['backend']:10s} {row['precision']:5s} {row['load_s']:7.2f} {row['latency_ms_mean']:8.1f} "
+              f"{row['latency_ms_p50']:8.1f} {row['latency_ms_p95']:8.1f} "
+              f"{row.get('recall_vs_ref', 1.0):7.3f} {row.get('precision_vs_ref', 1.0):7.3f} "
+              f"{row.get('violations_agree', 1.0):6.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n📝 Report written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import os
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# ── Configuration ────────────────────────────────────────────────────────────
+
+# Asymmetric confidence: bias toward catching "Without Helmet"
+CONF_WITH_HELMET = 0.35       # higher bar to confirm helmet present
+CONF_WITHOUT_HELMET = 0.12    # low bar — catch violations aggressively
+HELMET_MODEL_CONF = 0.08      # model runs at very low conf; we filter per-class after
+
+# ROI Zooming configuration
+ROI_EXPAND_RATIO = 0.60       # expand motorcycle bbox by 60% in all directions for the crop
+ROI_TARGET_SIZE = 640         # resize each ROI crop to this size for helmet model
+ROI_ABOVE_EXPAND = 1.0        # expand MORE above the motorcycle (riders' heads are above)
+BASE_MODEL_IMGSZ = 640        # input size for base model
+HELMET_FULL_IMGSZ = 640       # input size for full-image helmet pass
+
+# Head NMS (merges full-image + ROI detections; see nms.py)
+HEAD_NMS_IOU = 0.40
+HEAD_NMS_CLASS_AWARE = False  # True: helmet/no-helmet boxes never suppress each other
+HEAD_NMS_PER_SOURCE = False   # True: only dedupe within one pass (full image / single ROI)
+
+# Stage 3 rider association (see association.py)
+ASSOCIATION_MODE = os.getenv("ASSOCIATION_MODE", "greedy")  # "greedy" (original) or "optimal"
+ASSOCIATION_MAX_RIDERS = 4    # seats per motorcycle in optimal mode (must stay > 2 to flag triple riding)
+
+# ROI tiling — overlapping motorcycle/person ROIs share one helmet pass (see roi_planner.py)
+ROI_MERGE_ENABLED = os.getenv("ROI_MERGE_ENABLED", "1") == "1"
+ROI_MERGE_MAX_ZOOM_LOSS = 0.20  # a merged tile keeps ≥80% of the zoom each member ROI had alone
+
+# ROI inference sizes — each tile runs at the smallest bucket ≥ its native side, raised so its heads
+# reach ROI_TARGET_HEAD_PX (see roi_planner.py); crops of one bucket share fixed-shape batches
+ROI_SIZE_BUCKETS = tuple(sorted(int(s) for s in os.getenv("ROI_SIZE_BUCKETS", f"320,480,{ROI_TARGET_SIZE}").split(",")))
+ROI_TARGET_HEAD_PX = float(os.getenv("ROI_TARGET_HEAD_PX", "32"))  # head size (px) wanted at the model input
+ROI_HEAD_FRACTION = {"moto": 0.08, "person": 0.25}  # expected head size ÷ longer side of the ROI, per ROI kind
+ROI_MAX_UPSCALE = 2.0         # never pick a bucket that upsamples a crop more than this
+
+# Adaptive cascade (see cascade.py) — per-request `mode` trades Stage 2 passes for throughput
+CASCADE_DEFAULT_MODE = os.getenv("CASCADE_DEFAULT_MODE", "accurate")
+CASCADE_PROFILES = {
+    # skip_helmet_when: "never" | "no_targets" (no motorcycles and no persons) | "no_motorcycles"
+    # min_zoom_gain: ROI tiles whose zoom is < this × the full-image pass's scale are skipped
+    "accurate": {"skip_helmet_when": "never", "person_rois": True, "min_zoom_gain": 0.0},
+    "balanced": {"skip_helmet_when": "no_targets", "person_rois": True, "min_zoom_gain": 1.15},
+    "fast": {"skip_helmet_when": "no_motorcycles", "person_rois": False, "min_zoom_gain": 1.5},
+}
+
+# Upload decoding (see decode.py)
+DECODE_PREVIEW_MIN_SIDE = max(BASE_MODEL_IMGSZ, HELMET_FULL_IMGSZ)  # reduced JPEG decode stays ≥ this
+
+# ROI batching — all helmet passes of a frame are letterboxed and run together
+ROI_BATCH_SIZE = 16           # max letterboxed crops per helmet-model forward pass
+LETTERBOX_PAD_VALUE = 114     # gray padding, same as the Ultralytics letterbox
+
+# Cross-request micro-batching (see scheduler.py)
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1") == "1"
+SCHEDULER_MAX_BATCH_SIZE = int(os.getenv("SCHEDULER_MAX_BATCH_SIZE", "16"))  # images per forward pass
+SCHEDULER_MAX_WAIT_MS = float(os.getenv("SCHEDULER_MAX_WAIT_MS", "5"))       # how long to wait for more requests
+SCHEDULER_MODEL_WORKERS = int(os.getenv("SCHEDULER_MODEL_WORKERS", "1"))     # >1: base + helmet batches run concurrently
+
+# Serving mode (see workers.py) — "threads": models in the API process; "processes": N inference
+# worker processes, frames handed over through shared memory
+SERVING_MODE = os.getenv("SERVING_MODE", "threads")
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", str(max(1, (os.cpu_count() or 2) // 2))))
+WORKER_QUEUE_DEPTH = int(os.getenv("WORKER_QUEUE_DEPTH", "2"))     # frames queued / in flight per worker
+WORKER_CPU_AFFINITY = os.getenv("WORKER_CPU_AFFINITY", "auto")     # "" | "auto" | "0-3;4-7" (one set per worker)
+WORKER_MODEL_LOADER = os.getenv("WORKER_MODEL_LOADER", "models:load_models")  # module:function → (base, helmet)
+
+# Concurrent passes within one request (see dag.py) — tune together with the thread / replica counts
+PIPELINE_PASS_WORKERS = int(os.getenv("PIPELINE_PASS_WORKERS", "4"))      # Stage 1 ‖ 2a, plan → ROIs; 0: sequential
+PIPELINE_ROI_WORKERS = int(os.getenv("PIPELINE_ROI_WORKERS", "2"))        # concurrent ROI batches (thread-safe models only)
+PIPELINE_SPECULATIVE_FULL_PASS = os.getenv("PIPELINE_SPECULATIVE_FULL_PASS", "0") == "1"  # 1: start 2a before the cascade decides (no skip savings)
+MODEL_REPLICAS = int(os.getenv("MODEL_REPLICAS", "1"))                    # copies of each model that may run at once
+INFERENCE_INTRA_OP_THREADS = int(os.getenv("INFERENCE_INTRA_OP_THREADS", "0"))  # torch threads per op; 0: library default
+
+# Video / frame-stream analysis (see video.py, tracking.py)
+VIDEO_FRAME_STRIDE = int(os.getenv("VIDEO_FRAME_STRIDE", "5"))  # analyse every Nth decoded frame
+VIDEO_DECODE_QUEUE = 8        # decoded frames buffered ahead of inference
+TRACK_IOU_THRESHOLD = 0.30    # min IoU to continue a motorcycle track between analysed frames
+TRACK_MAX_AGE = 10            # analysed frames a track survives without a match
+TRACK_CENTROID_GATE = 0.5     # Kalman tracks: unmatched boxes join a track whose center is within this × its diagonal
+TRACK_KALMAN_Q = 4.0          # process noise (px²) of the constant-velocity box filter
+TRACK_KALMAN_R = 9.0          # measurement noise (px²) of Stage 1 boxes
+
+# Per-track helmet status cache (see track_cache.py) — consecutive frames of one camera skip ROI
+# passes for motorcycles whose riders were classified confidently a few frames ago
+TRACK_CACHE_ENABLED = os.getenv("TRACK_CACHE_ENABLED", "1") == "1"
+TRACK_CACHE_MIN_CONF = float(os.getenv("TRACK_CACHE_MIN_CONF", "0.5"))  # decayed confidence needed to reuse
+TRACK_CACHE_DECAY = float(os.getenv("TRACK_CACHE_DECAY", "0.95"))       # confidence multiplier per frame
+TRACK_CACHE_TTL_S = float(os.getenv("TRACK_CACHE_TTL_S", "2.0"))        # re-infer a track at least this often
+TRACK_CACHE_MAX_CAMERAS = 256
+
+# Per-camera change gate (see change_gate.py) — static cameras: skip unchanged frames and ROI tiles
+CHANGE_GATE_ENABLED = os.getenv("CHANGE_GATE_ENABLED", "1") == "1"  # only frames tagged with a camera are gated
+CHANGE_GATE_WIDTH = int(os.getenv("CHANGE_GATE_WIDTH", "320"))        # width (px, grayscale) of the last processed frame's copy
+CHANGE_GATE_CELL_PX = 10                                              # change-mask cell size at that width
+CHANGE_GATE_PIXEL_DELTA = int(os.getenv("CHANGE_GATE_PIXEL_DELTA", "12"))        # gray levels counted as change
+CHANGE_GATE_CELL_MIN_PIXELS = int(os.getenv("CHANGE_GATE_CELL_MIN_PIXELS", "2"))  # changed pixels per changed cell
+CHANGE_GATE_MAX_SKIP_S = float(os.getenv("CHANGE_GATE_MAX_SKIP_S", "10"))  # full pipeline at least this often
+CHANGE_GATE_MAX_CAMERAS = 256
+
+# Model weights — downloaded once into WEIGHTS_DIR and checksum-verified on every load
+WEIGHTS_DIR = os.getenv("WEIGHTS_DIR", os.path.join(BACKEND_DIR, "..", "weights"))
+HELMET_WEIGHTS_SHA256 = os.getenv("HELMET_WEIGHTS_SHA256", "")   # empty: pin via .sha256 sidecar on first use
+BASE_WEIGHTS_SHA256 = os.getenv("BASE_WEIGHTS_SHA256", "")
+WARMUP_BATCH_SIZES = (1, ROI_BATCH_SIZE)  # warm every imgsz at these batch shapes before /readyz
+
+# Inference backends (see models.py) — exported artifacts are cached on disk
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "pytorch")      # pytorch | onnx | openvino
+INFERENCE_PRECISION = os.getenv("INFERENCE_PRECISION", "fp32")     # fp32 | fp16 | int8
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", os.path.join(WEIGHTS_DIR, "exported"))
+INT8_CALIBRATION_DIR = os.getenv("INT8_CALIBRATION_DIR", "")       # folder of local images for INT8
+INT8_CALIBRATION_MAX_IMAGES = 200
+
+# Bulk /detect/batch (see batch.py)
+BATCH_MAX_IN_FLIGHT = int(os.getenv("BATCH_MAX_IN_FLIGHT", "8"))  # images decoded / in the pipeline at once
+BATCH_MAX_IN_FLIGHT_LIMIT = 64                                    # cap on the per-request override
+
+# /detect result cache (see result_cache.py) — repeated uploads skip the pipeline
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1") == "1"
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 << 20)))  # JSON-encoded results held in memory
+RESULT_CACHE_TTL_S = float(os.getenv("RESULT_CACHE_TTL_S", "3600"))
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", "")                              # empty: memory tier only
+RESULT_CACHE_DISK_MAX_BYTES = int(os.getenv("RESULT_CACHE_DISK_MAX_BYTES", str(1 << 30)))
+
+# Violation store (see violation_store.py) — every /detect result, written in background batches
+VIOLATION_STORE_PATH = os.getenv("VIOLATION_STORE_PATH", "")  # SQLite file, e.g. /var/lib/traffic/violations.db; empty: off
+VIOLATION_STORE_BATCH_SIZE = int(os.getenv("VIOLATION_STORE_BATCH_SIZE", "256"))  # results per insert transaction
+VIOLATION_STORE_FLUSH_MS = float(os.getenv("VIOLATION_STORE_FLUSH_MS", "200"))    # max wait to fill a batch
+VIOLATION_STORE_QUEUE_MAX = 10000  # results waiting for the writer; beyond this they are dropped (and counted)
+VIOLATION_STORE_PAGE_MAX = 1000    # max rows per query page
+
+# Evidence crops (see evidence.py) — JPEG crops of each violation, rendered off the request path
+EVIDENCE_DIR = os.getenv("EVIDENCE_DIR", "")  # e.g. /var/lib/traffic/evidence; empty: off
+EVIDENCE_WORKERS = int(os.getenv("EVIDENCE_WORKERS", "2"))
+EVIDENCE_JPEG_QUALITY = int(os.getenv("EVIDENCE_JPEG_QUALITY", "85"))
+EVIDENCE_MAX_SIDE = int(os.getenv("EVIDENCE_MAX_SIDE", "640"))  # longer crops are downscaled to this
+EVIDENCE_MARGIN = float(os.getenv("EVIDENCE_MARGIN", "0.15"))   # padding around each box, fraction of its size
+EVIDENCE_QUEUE_MAX = 256  # images waiting for the crop workers; beyond this, crops are dropped (and counted)
+EVIDENCE_QUEUE_MAX_BYTES = int(os.getenv("EVIDENCE_QUEUE_MAX_BYTES", str(128 << 20)))  # crop pixels waiting; 0: no limit
+
+# Spool-folder ingestion (see spool.py) — sites that drop JPEGs into folders instead of calling HTTP
+SPOOL_DIRS = os.getenv("SPOOL_DIRS", "")                  # "path" or "camera=path", ";"-separated; empty: off
+SPOOL_QUEUE_MAX = int(os.getenv("SPOOL_QUEUE_MAX", "64"))  # files queued ahead of the workers
+SPOOL_BACKPRESSURE = os.getenv("SPOOL_BACKPRESSURE", "pause")  # "pause" | "drop_oldest" | "block"
+SPOOL_POLL_S = float(os.getenv("SPOOL_POLL_S", "1.0"))
+SPOOL_STABLE_S = float(os.getenv("SPOOL_STABLE_S", "2.0"))  # a file must be unchanged this long (upload finished)
+SPOOL_WORKERS = int(os.getenv("SPOOL_WORKERS", "2"))
+SPOOL_WRITE_RESULTS = os.getenv("SPOOL_WRITE_RESULTS", "1") == "1"  # result JSON next to each done/ file
+
+# Compact /detect responses (see compact.py) — opt-in via the Accept header
+COMPACT_GZIP_MIN_BYTES = 1024  # smaller bodies are sent uncompressed even with Accept-Encoding: gzip
+
+# Per-request profiling (see profiling.py) — opt-in per request; off, it costs one random() per request
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(BACKEND_DIR, "profiles"))
+PROFILE_HEADER_ENABLED = os.getenv("PROFILE_HEADER_ENABLED", "0") == "1"  # 1: honour "X-Profile: 1" on /detect
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))        # fraction of /detect requests profiled
+PROFILE_MAX_KEPT = int(os.getenv("PROFILE_MAX_KEPT", "50"))               # newest profiles kept on disk
+
+# Observability (see metrics.py) — per-stage histograms on /metrics; per-request detail logging is opt-in
+PIPELINE_LOG_VERBOSE = os.getenv("PIPELINE_LOG_VERBOSE", "0") == "1"
+PIPELINE_LOG_SAMPLE_RATE = float(os.getenv("PIPELINE_LOG_SAMPLE_RATE", "1.0"))  # fraction of requests logged when verbose
+METRICS_STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)  # seconds
@@ -0,0 +1,100 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from config import PIPELINE_PASS_WORKERS, PIPELINE_ROI_WORKERS
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+# ── Shared Pools ─────────────────────────────────────────────────────────────
+# One process-wide pool for pipeline passes and one for ROI chunks. They are
+# kept separate because a pass may wait on ROI chunks: if both shared a pool,
+# enough concurrent requests could fill it with waiters and deadlock.
+
+def _pool(name, workers):
+    if workers <= 0:
+        return None
+    with _pools_lock:
+        if name not in _pools:
+            _pools[name] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        return _pools[name]
+
+
+def pass_executor():
+    """Pool for independent pipeline passes (None: run them inline, in order)."""
+    return _pool("pipeline-pass", PIPELINE_PASS_WORKERS)
+
+
+def roi_executor():
+    """Pool for concurrent ROI chunks (None: run them inline)."""
+    return _pool("roi-chunk", PIPELINE_ROI_WORKERS)
+
+
+# ── Pass Graph ───────────────────────────────────────────────────────────────
+
+class PassGraph:
+    """
+    Minimal DAG executor for one pipeline run.
+
+    `add(name, fn, *deps)` schedules `fn(*dep_results)` as soon as all named
+    dependencies have finished — on `executor` if given, otherwise inline
+    (which, since nodes are added in dependency order, is plain sequential
+    execution). Nodes never block a pool thread waiting for other nodes:
+    readiness is driven by completion callbacks. The wall time of each node
+    is written to `timings[name]` in ms; an exception in a node propagates
+    to its dependents and to `result()`.
+    """
+
+    def __init__(self, executor=None, timings=None):
+        self.executor = executor
+        self.timings = timings if timings is not None else {}
+        self._futures = {}
+
+    def add(self, name, fn, *deps):
+        future = Future()
+        self._futures[name] = future
+        dep_futures = [self._futures[d] for d in deps]
+
+        def run(args):
+            t0 = time.perf_counter()
+            try:
+                result = fn(*args)
+            except BaseException as e:
+                self.timings[name] = (time.perf_counter() - t0) * 1000
+                future.set_exception(e)
+                return
+            self.timings[name] = (time.perf_counter() - t0) * 1000
+            future.set_result(result)
+
+        def launch():
+            for dep in dep_futures:
+                if dep.exception() is not None:
+                    future.set_exception(dep.exception())
+                    return
+            args = [dep.result() for dep in dep_futures]
+            if self.executor is None:
+                run(args)
+            else:
+                self.executor.submit(run, args)
+
+        if not dep_futures:
+            launch()
+        else:
+            remaining = [len(dep_futures)]
+            lock = threading.Lock()
+
+            def on_done(_):
+                with lock:
+                    remaining[0] -= 1
+                    ready = remaining[0] == 0
+                if ready:
+                    launch()
+
+            for dep in dep_futures:
+                dep.add_done_callback(on_done)
+        return future
+
+    def result(self, name):
+        return self._futures[name].result()
@@ -0,0 +1,138 @@
+import io
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from config import DECODE_PREVIEW_MIN_SIDE
+
+EXIF_ORIENTATION = 0x0112
+CV2_REDUCED_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+# ── Orientation ──────────────────────────────────────────────────────────────
+
+def orient_view(arr, orientation):
+    """
+    Apply an EXIF orientation (1-8) to an HxWxC array as a *view* —
+    flips / rotations / transposes only change strides, no pixels are copied.
+    Matches PIL's ImageOps.exif_transpose.
+    """
+    if orientation == 2:
+        return arr[:, ::-1]
+    if orientation == 3:
+        return arr[::-1, ::-1]
+    if orientation == 4:
+        return arr[::-1]
+    if orientation == 5:
+        return arr.transpose(1, 0, 2)
+    if orientation == 6:
+        return np.rot90(arr, k=-1)
+    if orientation == 7:
+        return arr.transpose(1, 0, 2)[::-1, ::-1]
+    if orientation == 8:
+        return np.rot90(arr, k=1)
+    return arr
+
+
+# ── Frames ───────────────────────────────────────────────────────────────────
+# The pipeline reads images through a small frame interface:
+#   width / height      full-resolution (oriented) size
+#   preview             RGB array for Stage 1 and the full-image helmet pass
+#   preview_scale       (sx, sy) mapping preview coords → full-res coords
+#   crop(box)           full-resolution RGB crop for ROI passes
+
+class ArrayImage:
+    """Frame over an already-decoded RGB array (video frames, benchmarks)."""
+
+    def __init__(self, img_np):
+        self.img = img_np
+        self.height, self.width = img_np.shape[:2]
+        self.preview = img_np
+        self.preview_scale = (1.0, 1.0)
+
+    def crop(self, box):
+        x1, y1, x2, y2 = box
+        return self.img[y1:y2, x1:x2]
+
+    def full(self):
+        return self.img
+
+
+class DecodedImage:
+    """
+    Frame over encoded image bytes, decoded lazily at two resolutions.
+
+    Only the header is parsed up front (size, EXIF orientation). Both
+    resolutions are decoded on first use. The preview uses libjpeg's DCT-domain downscaling (1/2, 1/4, 1/8) to stay just above
+    DECODE_PREVIEW_MIN_SIDE, so a 48 MP upload never exists at full size
+    unless a ROI pass needs it. Full resolution is decoded once, on the first
+    crop(), and crops are cut from an orientation view of it.
+    """
+
+    def __init__(self, data, preview_min_side=DECODE_PREVIEW_MIN_SIDE):
+        self.data = data
+        self._buf = np.frombuffer(data, dtype=np.uint8)
+        with Image.open(io.BytesIO(data)) as im:
+            raw_w, raw_h = im.size
+            self.format = im.format
+            self.orientation = im.getexif().get(EXIF_ORIENTATION, 1)
+        self.raw_size = (raw_w, raw_h)
+        if self.orientation in (5, 6, 7, 8):
+            self.width, self.height = raw_h, raw_w
+        else:
+            self.width, self.height = raw_w, raw_h
+
+        self._full = None
+        self._preview = None
+        self._preview_min_side = preview_min_side
+
+    @property
+    def preview(self):
+        """Reduced-size oriented RGB array (decoded on first use)."""
+        if self._preview is None:
+            self._preview = self._decode_preview(self._preview_min_side)
+        return self._preview
+
+    @property
+    def preview_scale(self):
+        ph, pw = self.preview.shape[:2]
+        return (self.width / pw, self.height / ph)
+
+    def _decode(self, flags):
+        """cv2 decode (EXIF ignored — we orient ourselves), BGR→RGB in place; PIL fallback."""
+        img = cv2.imdecode(self._buf, flags | cv2.IMREAD_IGNORE_ORIENTATION)
+        if img is None:
+            with Image.open(io.BytesIO(self.data)) as im:
+                return np.asarray(im.convert("RGB"))
+        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=img)
+
+    def _decode_preview(self, min_side):
+        reduction = 1
+        for r in (8, 4, 2):
+            if min(self.raw_size) / r >= min_side:
+                reduction = r
+                break
+        if reduction == 1:
+            self._full = orient_view(self._decode(cv2.IMREAD_COLOR), self.orientation)
+            return np.ascontiguousarray(self._full)
+        return np.ascontiguousarray(orient_view(self._decode(CV2_REDUCED_FLAGS[reduction]), self.orientation))
+
+    def full(self):
+        """Full-resolution oriented view (decoded on first use)."""
+        if self._full is None:
+            self._full = orient_view(self._decode(cv2.IMREAD_COLOR), self.orientation)
+        return self._full
+
+    def crop(self, box):
+        x1, y1, x2, y2 = box
+        return np.ascontiguousarray(self.full()[y1:y2, x1:x2])
+
+
+def as_frame(img):
+    """Wrap a plain RGB array; pass frames through unchanged."""
+    return img if hasattr(img, "preview") else ArrayImage(img)
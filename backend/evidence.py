@@ -0,0 +1,183 @@
+import hashlib
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from config import (
+    EVIDENCE_WORKERS, EVIDENCE_JPEG_QUALITY, EVIDENCE_MAX_SIDE, EVIDENCE_MARGIN, EVIDENCE_QUEUE_MAX,
+    EVIDENCE_QUEUE_MAX_BYTES,
+)
+from decode import as_frame
+from metrics import EVIDENCE_CROPS
+
+EVIDENCE_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+def _union(boxes):
+    return [min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes)]
+
+
+def violation_boxes(violation):
+    """{"rider": box, "vehicle": box} to crop for one violation (vehicle = rider(s) + motorcycle)."""
+    riders = violation.get("person_boxes") or ([violation["person_box"]] if "person_box" in violation else [])
+    rider = _union(riders) if riders else violation["motorcycle_box"]
+    return {"rider": rider, "vehicle": _union([rider, violation["motorcycle_box"]])}
+
+
+# ── Evidence Store ───────────────────────────────────────────────────────────
+
+class EvidenceStore:
+    """
+    Content-addressed JPEG crops of violations, rendered off the request path.
+
+    attach() runs on the request thread and only hashes: each crop's id is
+    BLAKE2b of (upload digest, pixel box, crop settings), so it is known
+    before any pixel is touched, and re-uploads of the same image reuse the
+    files already on disk. The new crops are copied out of the frame the
+    pipeline already decoded, so the frame itself is not kept alive; their
+    resize and JPEG encode run as one job per image in a thread pool. Files
+    live at `<root>/<id[:2]>/<id>.jpg` and are written atomically. When
+    `queue_max` images or `queue_max_bytes` of crop pixels are already
+    waiting, crops are dropped (their ids are None) instead of queued.
+    """
+
+    def __init__(self, root, workers=EVIDENCE_WORKERS, quality=EVIDENCE_JPEG_QUALITY, max_side=EVIDENCE_MAX_SIDE,
+                 margin=EVIDENCE_MARGIN, queue_max=EVIDENCE_QUEUE_MAX, queue_max_bytes=EVIDENCE_QUEUE_MAX_BYTES):
+        self.root = root
+        self.quality = quality
+        self.max_side = max_side
+        self.margin = margin
+        self.queue_max = max(1, int(queue_max))
+        self.queue_max_bytes = int(queue_max_bytes)
+        self._settings = f"{margin}:{max_side}:{quality}".encode()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="evidence")
+        self._pending = {}          # crop id → Future of the job rendering it
+        self._jobs = 0
+        self._queued_bytes = 0      # pixel bytes of the crops waiting to be encoded
+        self._lock = threading.Lock()
+        self.counters = {"written": 0, "deduped": 0, "dropped": 0, "failed": 0, "bytes_written": 0}
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, evidence_id):
+        return os.path.join(self.root, evidence_id[:2], evidence_id + ".jpg")
+
+    def _padded(self, box, width, height):
+        x1, y1, x2, y2 = box
+        mx, my = (x2 - x1) * self.margin, (y2 - y1) * self.margin
+        return [max(0, int(x1 - mx)), max(0, int(y1 - my)), min(width, int(round(x2 + mx))),
+                min(height, int(round(y2 + my)))]
+
+    def attach(self, frame, digest, result):
+        """
+        Add an "evidence" dict ({"rider": id, "vehicle": id}) to every
+        violation in `result` and queue the crops not yet on disk. `frame`
+        is the decoded image (DecodedImage, ArrayImage or RGB array) and
+        `digest` identifies the upload bytes.
+        """
+        if not result["violations"]:
+            return result
+        frame = as_frame(frame)
+        crops, ids_by_violation = {}, []
+        for violation in result["violations"]:
+            ids = {}
+            for name, box in violation_boxes(violation).items():
+                box = self._padded(box, frame.width, frame.height)
+                if box[2] <= box[0] or box[3] <= box[1]:
+                    ids[name] = None
+                    continue
+                evidence_id = hashlib.blake2b(
+                    digest.encode() + self._settings + ",".join(map(str, box)).encode(), digest_size=16
+                ).hexdigest()
+                ids[name] = evidence_id
+                crops[evidence_id] = box
+            ids_by_violation.append(ids)
+
+        img = frame.full() if crops else None
+        with self._lock:
+            new = {i: box for i, box in crops.items() if i not in self._pending and not os.path.exists(self.path(i))}
+            self.counters["deduped"] += len(crops) - len(new)
+            size = sum((x2 - x1) * (y2 - y1) * img.shape[2] for x1, y1, x2, y2 in new.values())
+            dropped = bool(new) and (self._jobs >= self.queue_max
+                                     or self._queued_bytes + size > self.queue_max_bytes > 0)
+            if dropped:
+                self.counters["dropped"] += len(new)
+            elif new:
+                # Copies, so the job holds only the crop pixels and not the frame
+                pixels = {i: np.array(img[y1:y2, x1:x2]) for i, (x1, y1, x2, y2) in new.items()}
+                self._jobs += 1
+                self._queued_bytes += size
+                future = self._pool.submit(self._render, pixels, size)
+                for evidence_id in new:
+                    self._pending[evidence_id] = future
+        if len(crops) > len(new):
+            EVIDENCE_CROPS.inc(len(crops) - len(new), outcome="deduped")
+        if dropped:
+            EVIDENCE_CROPS.inc(len(new), outcome="dropped")
+
+        for violation, ids in zip(result["violations"], ids_by_violation):
+            violation["evidence"] = {name: None if dropped and i in new else i for name, i in ids.items()}
+        return result
+
+    def _render(self, crops, queued_bytes):
+        try:
+            for evidence_id, pixels in crops.items():
+                try:
+                    size = self._write(evidence_id, pixels)
+                except Exception as e:
+                    print(f"⚠️  Evidence: crop {evidence_id} failed: {e}")
+                    outcome, size = "failed", 0
+                else:
+                    outcome = "written"
+                EVIDENCE_CROPS.inc(outcome=outcome)
+                with self._lock:
+                    self.counters[outcome] += 1
+                    self.counters["bytes_written"] += size
+        finally:
+            with self._lock:
+                self._jobs -= 1
+                self._queued_bytes -= queued_bytes
+                for evidence_id in crops:
+                    self._pending.pop(evidence_id, None)
+
+    def _write(self, evidence_id, crop):
+        h, w = crop.shape[:2]
+        scale = self.max_side / max(h, w)
+        if scale < 1:
+            crop = cv2.resize(crop, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+        ok, buf = cv2.imencode(".jpg", cv2.cvtColor(crop, cv2.COLOR_RGB2BGR),
+                               [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            raise ValueError("JPEG encode failed")
+        path = self.path(evidence_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(buf.tobytes())
+        os.replace(tmp, path)
+        return len(buf)
+
+    # Retrieval
+
+    def get(self, evidence_id, timeout=10.0):
+        """Path of a crop's JPEG (waiting for it if still being rendered), or None."""
+        if not EVIDENCE_ID.match(evidence_id):
+            return None
+        with self._lock:
+            future = self._pending.get(evidence_id)
+        if future is not None:
+            future.result(timeout)
+        path = self.path(evidence_id)
+        return path if os.path.exists(path) else None
+
+    def close(self):
+        """Finish every queued crop."""
+        self._pool.shutdown(wait=True)
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "pending_images": self._jobs, "pending_crops": len(self._pending),
+                    "pending_bytes": self._queued_bytes, "root": self.root}
@@ -0,0 +1,37 @@
+# ── Box Geometry ─────────────────────────────────────────────────────────────
+
+def calculate_iou(box1, box2):
+    """Calculate IoU of two [x1,y1,x2,y2] boxes."""
+    x1 = max(box1[0], box2[0])
+    y1 = max(box1[1], box2[1])
+    x2 = min(box1[2], box2[2])
+    y2 = min(box1[3], box2[3])
+    intersection = max(0, x2 - x1) * max(0, y2 - y1)
+    area1 = (box1[2] - box1[0]) * (box1[3] - box1[1])
+    area2 = (box2[2] - box2[0]) * (box2[3] - box2[1])
+    union = area1 + area2 - intersection
+    return intersection / union if union > 0 else 0
+
+
+def box_center(box):
+    """Return (cx, cy) center of a box."""
+    return ((box[0] + box[2]) / 2, (box[1] + box[3]) / 2)
+
+
+def expand_box(box, img_w, img_h, ratio, ratio_above=None):
+    """
+    Expand a bounding box by `ratio` in all directions.
+    If `ratio_above` is set, use a larger expansion above the box
+    (useful for motorcycles — riders' heads extend upward).
+    Returns clipped [x1, y1, x2, y2] in integer pixel coords.
+    """
+    x1, y1, x2, y2 = box
+    w = x2 - x1
+    h = y2 - y1
+    expand_above = ratio_above if ratio_above is not None else ratio
+
+    nx1 = max(0, int(x1 - w * ratio))
+    ny1 = max(0, int(y1 - h * expand_above))  # more space above
+    nx2 = min(img_w, int(x2 + w * ratio))
+    ny2 = min(img_h, int(y2 + h * ratio))
+    return [nx1, ny1, nx2, ny2]
@@ -0,0 +1,459 @@
+"""
+Load test of the /detect endpoint: throughput, latency percentiles,
+queueing vs inference time and memory high-water mark.
+
+    python loadtest.py --concurrency 1 4 16                  # in-process app, stub models
+    python loadtest.py --rate 20 --duration 30               # open-loop arrivals (req/s)
+    python loadtest.py --url http://127.0.0.1:8000 --images ../samples --server-pid 1234
+    python loadtest.py --update-baseline                     # store this machine's baseline
+    python loadtest.py                                       # exit 1 if a run regressed, 2 without a baseline
+
+Without --url the FastAPI app is started in this process on a free
+localhost port (real HTTP, real uvicorn). --models stub swaps in stub
+detectors that need no weights. Their latency is set with
+--stub-base-ms / --stub-helmet-ms and they release the GIL like real
+inference. --models real loads the configured weights. Without --images,
+synthetic scenes from benchmark.py are used; they match what the stub base
+model reports.
+
+Closed loop (--concurrency) keeps N requests in flight. Open loop (--rate)
+sends on a fixed schedule regardless of how fast the server answers, and
+measures latency from the scheduled send time, so client-side waiting counts.
+Queueing is client latency minus the server's processing_time_ms.
+Inference is the per-request mean of the base_model / helmet_full /
+helmet_rois stage times, scraped from /metrics before and after the run
+(summed, so passes that run in parallel can add up to more than the latency).
+The result cache and violation store are off in-process, and every upload
+gets unique trailing bytes, so repeated images are never served from cache.
+Without a baseline the check exits 2. As with benchmark.py, CI creates the
+baseline on the same runner from the target branch before checking a change:
+
+    git checkout main && python loadtest.py --update-baseline --baseline /tmp/load_base.json
+    git checkout - && python loadtest.py --baseline /tmp/load_base.json
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import re
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# config is imported lazily so settings made here (stub loader) reach it
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BACKEND_DIR, "loadtest_baseline.json")
+INFERENCE_STAGES = ("base_model", "helmet_full", "helmet_rois")
+BOUNDARY = "loadtest-boundary"
+
+
+# ── Stub Models ──────────────────────────────────────────────────────────────
+# Also usable from worker processes: WORKER_MODEL_LOADER=loadtest:stub_models.
+
+def _stub_settings():
+    return {
+        "vehicles": int(os.getenv("LOADTEST_VEHICLES", "25")),
+        "seed": int(os.getenv("LOADTEST_SEED", "0")),
+        "base_ms": float(os.getenv("LOADTEST_STUB_BASE_MS", "15")),
+        "helmet_ms": float(os.getenv("LOADTEST_STUB_HELMET_MS", "2")),
+    }
+
+
+def stub_models():
+    """(base, helmet) stub detectors; latency and scene come from LOADTEST_* env vars."""
+    from benchmark import StubHelmetModel, _result, make_scene
+
+    s = _stub_settings()
+    _, persons, motorcycles = make_scene(s["vehicles"], 1920, 1080, s["seed"])
+    norm = np.asarray(persons + motorcycles, dtype=np.float32).reshape(-1, 4) / [1920, 1080, 1920, 1080]
+    classes = [0] * len(persons) + [3] * len(motorcycles)
+
+    class Base:
+        names = {0: "person", 3: "motorcycle"}
+
+        def __call__(self, source, conf=0.25, imgsz=640, **kwargs):
+            images = source if isinstance(source, list) else [source]
+            time.sleep(s["base_ms"] / 1000 * len(images))
+            return [_result(norm * [im.shape[1], im.shape[0], im.shape[1], im.shape[0]], [0.9] * len(classes), classes) for im in images]
+
+    class Helmet(StubHelmetModel):
+        def __call__(self, source, conf=0.08, imgsz=640, **kwargs):
+            images = source if isinstance(source, list) else [source]
+            time.sleep(s["helmet_ms"] / 1000 * len(images))
+            return super().__call__(images, conf=conf, imgsz=imgsz)
+
+    return Base(), Helmet()
+
+
+# ── Inputs ───────────────────────────────────────────────────────────────────
+
+def load_inputs(images_dir, n_synthetic):
+    """JPEG bytes of every image in `images_dir`, or of `n_synthetic` synthetic scenes."""
+    if images_dir:
+        from batch import IMAGE_EXTENSIONS
+        paths = sorted(os.path.join(images_dir, n) for n in os.listdir(images_dir)
+                       if n.lower().endswith(IMAGE_EXTENSIONS))
+        inputs = []
+        for path in paths:
+            with open(path, "rb") as f:
+                inputs.append(f.read())
+        if not inputs:
+            raise SystemExit(f"No images in {images_dir}")
+        return inputs
+
+    import cv2
+    from benchmark import make_scene
+    s = _stub_settings()
+    img, _, _ = make_scene(s["vehicles"], 1920, 1080, s["seed"])
+    rng = np.random.default_rng(s["seed"])
+    inputs = []
+    for _ in range(n_synthetic):
+        # Same scene (matches the stub base model), different sensor noise per image
+        noisy = np.clip(img.astype(np.int16) + rng.integers(0, 8, img.shape, dtype=np.int16), 0, 255).astype(np.uint8)
+        ok, buf = cv2.imencode(".jpg", cv2.cvtColor(noisy, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, 90])
+        inputs.append(buf.tobytes())
+    return inputs
+
+
+def _multipart(data, seq):
+    # Bytes after the JPEG EOI marker are ignored by decoders but change the content hash
+    payload = data + f"loadtest-{seq}".encode()
+    return (
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{seq}.jpg\"\r\n"
+        f"Content-Type: image/jpeg\r\n\r\n".encode() + payload + f"\r\n--{BOUNDARY}--\r\n".encode()
+    )
+
+
+# ── Server ───────────────────────────────────────────────────────────────────
+
+def start_in_process(models):
+    """Start the app with uvicorn on a free localhost port; returns (base URL, stop function)."""
+    if models == "stub":
+        os.environ.setdefault("WORKER_MODEL_LOADER", "loadtest:stub_models")
+    import uvicorn
+    import main
+
+    # Measure the pipeline, not cache hits or disk writes
+    main.RESULT_CACHE_ENABLED = False
+    main.VIOLATION_STORE_PATH = ""
+    if models == "stub":
+        main.load_models = stub_models
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=0, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="loadtest-server", daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+
+    def stop():
+        # Runs the app's shutdown (workers, shared memory, spool) before exiting
+        server.should_exit = True
+        thread.join(60)
+
+    return f"http://127.0.0.1:{port}", stop
+
+
+def wait_ready(url, timeout=600):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            status, body = _get(url, "/readyz")
+            if status == 200:
+                return
+            if json.loads(body).get("status") == "failed":
+                raise SystemExit(f"Server failed to load models: {json.loads(body).get('error')}")
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"{url} not ready after {timeout}s")
+
+
+def _get(url, path):
+    parts = urllib.parse.urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+    try:
+        conn.request("GET", path)
+        resp = conn.getresponse()
+        return resp.status, resp.read()
+    finally:
+        conn.close()
+
+
+def scrape_stage_sums(url):
+    """{stage: (sum seconds, count)} of the stage histograms on /metrics."""
+    _, body = _get(url, "/metrics")
+    sums = {}
+    for line in body.decode().splitlines():
+        m = re.match(r'traffic_stage_duration_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)', line)
+        if m:
+            kind, stage, value = m.groups()
+            entry = sums.setdefault(stage, [0.0, 0])
+            entry[0 if kind == "sum" else 1] = float(value)
+    return sums
+
+
+class MemorySampler:
+    """
+    Samples the RSS of `pid` plus its child processes (inference workers)
+    every `interval_s` and keeps the maximum.
+    """
+
+    def __init__(self, pid, interval_s=0.05):
+        self.pid = pid
+        self.interval_s = interval_s
+        self.peak_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="loadtest-memory", daemon=True)
+
+    @staticmethod
+    def _status_kb(pid):
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        return 0
+
+    def _children(self):
+        children = []
+        try:
+            for tid in os.listdir(f"/proc/{self.pid}/task"):
+                with open(f"/proc/{self.pid}/task/{tid}/children") as f:
+                    children += f.read().split()
+        except OSError:
+            pass
+        return children
+
+    def _rss_kb(self):
+        return self._status_kb(self.pid) + sum(self._status_kb(child) for child in self._children())
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_kb = max(self.peak_kb, self._rss_kb())
+            self._stop.wait(self.interval_s)
+
+    def __enter__(self):
+        self.start_kb = self._rss_kb()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+# ── Load Generation ──────────────────────────────────────────────────────────
+
+class Client:
+    """One keep-alive connection per thread; post() returns (status, processing_time_ms or None)."""
+
+    def __init__(self, url, mode):
+        parts = urllib.parse.urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port
+        self.path = "/detect" + (f"?mode={mode}" if mode else "")
+        self._local = threading.local()
+
+    def post(self, body):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=300)
+        try:
+            conn.request("POST", self.path, body, {"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"})
+            resp = conn.getresponse()
+            data = resp.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self._local.conn = None
+            return 0, None
+        if resp.status != 200:
+            return resp.status, None
+        return 200, json.loads(data).get("processing_time_ms")
+
+
+def run_load(url, inputs, mode, n_requests, concurrency=None, rate=None, max_in_flight=512):
+    """
+    Send `n_requests` uploads (cycling through `inputs`) closed-loop at
+    `concurrency` or open-loop at `rate` req/s. Returns per-request samples
+    (latency_s, status, processing_ms) and the wall time.
+    """
+    client = Client(url, mode)
+    bodies = [_multipart(inputs[i % len(inputs)], i) for i in range(n_requests)]
+    samples = [None] * n_requests
+
+    def send(i, t_sched):
+        status, processing_ms = client.post(bodies[i])
+        samples[i] = (time.perf_counter() - t_sched, status, processing_ms)
+
+    t0 = time.perf_counter()
+    if rate:
+        with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="loadtest") as pool:
+            for i in range(n_requests):
+                t_sched = t0 + i / rate
+                delay = t_sched - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(send, i, t_sched)
+    else:
+        next_i = iter(range(n_requests))
+        lock = threading.Lock()
+
+        def loop():
+            while True:
+                with lock:
+                    i = next(next_i, None)
+                if i is None:
+                    return
+                send(i, time.perf_counter())
+
+        threads = [threading.Thread(target=loop, name=f"loadtest-{k}") for k in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return samples, time.perf_counter() - t0
+
+
+def summarize(samples, wall_s, stage_before, stage_after):
+    ok = [s for s in samples if s and s[1] == 200]
+    latencies = np.asarray([s[0] * 1000 for s in ok]) if ok else np.zeros(1)
+    queueing = np.asarray([s[0] * 1000 - s[2] for s in ok if s[2] is not None]) if ok else np.zeros(1)
+    inference_ms = 0.0
+    if ok:
+        for stage in INFERENCE_STAGES:
+            before = stage_before.get(stage, (0.0, 0))
+            after = stage_after.get(stage, (0.0, 0))
+            inference_ms += (after[0] - before[0]) * 1000 / len(ok)
+
+    pct = lambda a, q: round(float(np.percentile(a, q)), 2)
+    return {
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "throughput_rps": round(len(ok) / wall_s, 3),
+        "latency_ms": {"p50": pct(latencies, 50), "p95": pct(latencies, 95), "p99": pct(latencies, 99),
+                       "mean": round(float(latencies.mean()), 2)},
+        "queueing_ms": {"p50": pct(queueing, 50), "p95": pct(queueing, 95)},
+        "inference_ms_mean": round(inference_ms, 2),
+    }
+
+
+def find_regressions(runs, baseline, tolerance):
+    """(run, metric, baseline, current) for every run slower than the baseline allows."""
+    base_by_key = {row["load"]: row for row in baseline.get("runs", [])}
+    regressions = []
+    for row in runs:
+        base = base_by_key.get(row["load"])
+        if not base:
+            continue
+        if row["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append((row["load"], "throughput_rps", base["throughput_rps"], row["throughput_rps"]))
+        for q in ("p50", "p95", "p99"):
+            old, new = base["latency_ms"][q], row["latency_ms"][q]
+            if new > old * (1 + tolerance):
+                regressions.append((row["load"], f"latency_{q}_ms", old, new))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="test a running server instead of starting the app in-process")
+    parser.add_argument("--server-pid", type=int, help="with --url: pid whose memory high-water mark is reported")
+    parser.add_argument("--models", choices=("stub", "real"), default="stub", help="in-process models")
+    parser.add_argument("--stub-base-ms", type=float, default=15.0, help="stub Stage 1 latency per image")
+    parser.add_argument("--stub-helmet-ms", type=float, default=2.0, help="stub helmet latency per crop")
+    parser.add_argument("--vehicles", type=int, default=25, help="motorcycles per synthetic scene")
+    parser.add_argument("--images", help="directory of images to replay (default: synthetic scenes)")
+    parser.add_argument("--synthetic", type=int, default=8, help="synthetic images to generate")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="closed-loop client counts")
+    parser.add_argument("--rate", type=float, nargs="+", help="open-loop arrival rates (req/s) instead")
+    parser.add_argument("--requests", type=int, default=200, help="requests per run")
+    parser.add_argument("--duration", type=float, help="open loop: seconds per run (overrides --requests)")
+    parser.add_argument("--mode", default=None, help="cascade mode sent with every request")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline results to compare against")
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression")
+    args = parser.parse_args()
+
+    os.environ.update(LOADTEST_VEHICLES=str(args.vehicles), LOADTEST_STUB_BASE_MS=str(args.stub_base_ms),
+                      LOADTEST_STUB_HELMET_MS=str(args.stub_helmet_ms))
+    if args.url:
+        url, pid, stop = args.url.rstrip("/"), args.server_pid, None
+    else:
+        url, stop = start_in_process(args.models)
+        pid = os.getpid()
+    try:
+        print(f"⏳ Waiting for {url}/readyz ...")
+        wait_ready(url)
+        inputs = load_inputs(args.images, args.synthetic)
+
+        loads = [("rate", r) for r in args.rate] if args.rate else [("concurrency", c) for c in args.concurrency]
+        runs = []
+        for kind, value in loads:
+            n = int(args.duration * value) if args.duration and kind == "rate" else args.requests
+            # Warm-up, not measured
+            run_load(url, inputs, args.mode, max(2, int(value)), concurrency=1)
+            before = scrape_stage_sums(url)
+            with MemorySampler(pid) as mem:
+                samples, wall_s = run_load(url, inputs, args.mode, n,
+                                           concurrency=value if kind == "concurrency" else None,
+                                           rate=value if kind == "rate" else None)
+            row = {"load": f"{kind}={value:g}", **summarize(samples, wall_s, before, scrape_stage_sums(url)),
+                   "rss_peak_mb": round(mem.peak_kb / 1024, 1) if pid else None,
+                   "rss_growth_mb": round((mem.peak_kb - mem.start_kb) / 1024, 1) if pid else None}
+            runs.append(row)
+            lat = row["latency_ms"]
+            print(f"▶ {row['load']:>16s}: {row['throughput_rps']:8.2f} req/s  p50 {lat['p50']:8.1f}  "
+                  f"p95 {lat['p95']:8.1f}  p99 {lat['p99']:8.1f} ms  queue p50 {row['queueing_ms']['p50']:7.1f} ms  "
+                  f"inference {row['inference_ms_mean']:7.1f} ms  peak RSS {row['rss_peak_mb']} MB  "
+                  f"errors {row['errors']}")
+    finally:
+        if stop:
+            stop()
+
+    report = {
+        "meta": {
+            "target": args.url or f"in-process ({args.models} models)",
+            "images": args.images or f"{args.synthetic} synthetic ({args.vehicles} vehicles)",
+            "requests": args.requests,
+            "mode": args.mode,
+            "stub_ms": [args.stub_base_ms, args.stub_helmet_ms] if args.models == "stub" and not args.url else None,
+            "serving_mode": os.getenv("SERVING_MODE", "threads"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+        },
+        "runs": runs,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n📝 Results written to {args.json}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📌 Baseline written to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"\n❌ No baseline at {args.baseline} — run with --update-baseline to store one")
+        raise SystemExit(2)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = find_regressions(runs, baseline, args.tolerance)
+    if regressions:
+        print(f"\n❌ {len(regressions)} regression(s) vs {args.baseline}:")
+        for load, metric, old, new in regressions:
+            print(f"   {load:>16s}  {metric:16s} {old:10.2f} → {new:10.2f}")
+        raise SystemExit(1)
+    print(f"\n✅ No run regressed more than {args.tolerance:.0%} vs {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import bisect
+import logging
+import logging.handlers
+import queue
+import random
+import threading
+
+from config import PIPELINE_LOG_VERBOSE, PIPELINE_LOG_SAMPLE_RATE, METRICS_STAGE_BUCKETS
+
+
+# ── Metric Types ─────────────────────────────────────────────────────────────
+# A minimal, thread-safe subset of the Prometheus data model — enough for
+# per-stage latency histograms and labelled counters without pulling in a
+# client library. Rendered in the Prometheus text exposition format.
+
+def _label_str(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name, self.help, self.labels = name, help_text, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_str(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets, labels=()):
+        self.name, self.help, self.labels = name, help_text, tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}   # label values → [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[idx] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{self.name}_bucket{_label_str(self.labels + ('le',), key + (le,))} {cumulative}")
+                labels = _label_str(self.labels, key)
+                lines.append(f"{self.name}_sum{labels} {series[-1]}")
+                lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+# ── Pipeline Metrics ─────────────────────────────────────────────────────────
+
+STAGE_SECONDS = Histogram(
+    "traffic_stage_duration_seconds", "Wall time of each pipeline stage.",
+    METRICS_STAGE_BUCKETS, labels=("stage",),
+)
+REQUESTS = Counter("traffic_pipeline_runs_total", "Images run through the detection pipeline.")
+ROIS = Counter("traffic_rois_total", "Stage 2 ROIs planned (before merging) and helmet tiles run.", labels=("kind",))
+HEADS = Counter("traffic_heads_total", "Head detections before and after confidence filtering + NMS.", labels=("phase",))
+VIOLATIONS = Counter("traffic_violations_total", "Violations reported.", labels=("type", "severity"))
+CASCADE_PASSES = Counter("traffic_cascade_passes_total", "Pipeline passes run, by cascade mode.", labels=("mode", "pass"))
+ROI_IMGSZ = Counter("traffic_roi_tile_imgsz_total", "Helmet ROI tiles run, by inference size bucket.", labels=("imgsz",))
+TRACK_CACHE_ROIS = Counter("traffic_track_cache_total",
+                           "Motorcycle ROI lookups in the per-track helmet cache.", labels=("outcome",))
+CHANGE_GATE = Counter("traffic_change_gate_total", "Frames and ROI tiles run or reused by the change gate.",
+                      labels=("kind", "outcome"))
+CACHE_LOOKUPS = Counter("traffic_result_cache_lookups_total", "Result-cache lookups on /detect.", labels=("outcome",))
+EVIDENCE_CROPS = Counter("traffic_evidence_crops_total", "Violation evidence crops by outcome.", labels=("outcome",))
+SPOOL_FILES = Counter("traffic_spool_files_total", "Spool-folder files by outcome.", labels=("camera", "outcome"))
+SPOOL_LAG_SECONDS = Histogram(
+    "traffic_spool_lag_seconds", "Spool file landed → result written.",
+    METRICS_STAGE_BUCKETS + (30.0, 60.0, 300.0), labels=("camera",),
+)
+
+REGISTRY = [STAGE_SECONDS, REQUESTS, ROIS, ROI_IMGSZ, HEADS, VIOLATIONS, CASCADE_PASSES, TRACK_CACHE_ROIS, CACHE_LOOKUPS,
+            CHANGE_GATE, EVIDENCE_CROPS, SPOOL_FILES, SPOOL_LAG_SECONDS]
+
+
+def record_pipeline(timings, n_rois, n_tiles, n_raw_heads, n_heads, violations, mode, passes_run, tile_sizes=()):
+    """Fold one pipeline run (per-stage ms timings + counts) into the metrics."""
+    for stage, ms in timings.items():
+        STAGE_SECONDS.observe(ms / 1000.0, stage=stage)
+    REQUESTS.inc()
+    ROIS.inc(n_rois, kind="planned")
+    ROIS.inc(n_tiles, kind="tiles")
+    for imgsz in tile_sizes:
+        ROI_IMGSZ.inc(imgsz=imgsz)
+    HEADS.inc(n_raw_heads, phase="raw")
+    HEADS.inc(n_heads, phase="final")
+    for v in violations:
+        VIOLATIONS.inc(type=v["type"], severity=v["severity"])
+    for pass_name in passes_run:
+        CASCADE_PASSES.inc(mode=mode, **{"pass": pass_name})
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ── Verbose Request Logging ──────────────────────────────────────────────────
+# Per-request detail (ROI tiles, every head, every violation) is opt-in:
+# PIPELINE_LOG_VERBOSE enables it for a PIPELINE_LOG_SAMPLE_RATE fraction of
+# requests, and records go through a queue to a listener thread, so the
+# request thread never blocks on stdout.
+
+log = logging.getLogger("traffic.pipeline")
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def _start_listener():
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            return
+        records = queue.SimpleQueue()
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        _listener = logging.handlers.QueueListener(records, handler)
+        _listener.start()
+        log.addHandler(logging.handlers.QueueHandler(records))
+        log.setLevel(logging.INFO)
+        log.propagate = False
+
+
+def sample_verbose():
+    """Should this request log its per-stage detail?"""
+    if not PIPELINE_LOG_VERBOSE or random.random() >= PIPELINE_LOG_SAMPLE_RATE:
+        return False
+    if _listener is None:
+        _start_listener()
+    return True
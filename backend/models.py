@@ -0,0 +1,319 @@
+import glob
+import hashlib
+import os
+import queue
+import shutil
+import tempfile
+import time
+import urllib.request
+
+import numpy as np
+
+from config import (
+    INFERENCE_BACKEND, INFERENCE_PRECISION, MODEL_CACHE_DIR,
+    INT8_CALIBRATION_DIR, INT8_CALIBRATION_MAX_IMAGES,
+    BASE_MODEL_IMGSZ, HELMET_FULL_IMGSZ, ROI_TARGET_SIZE, ROI_SIZE_BUCKETS,
+    WEIGHTS_DIR, HELMET_WEIGHTS_SHA256, BASE_WEIGHTS_SHA256, WARMUP_BATCH_SIZES,
+    MODEL_REPLICAS, INFERENCE_INTRA_OP_THREADS,
+)
+
+# ── Model Sources ────────────────────────────────────────────────────────────
+LOCAL_HELMET_PATH = os.path.join(WEIGHTS_DIR, "yolov11m(100epochs).pt")
+REMOTE_HELMET_URL = "https://huggingface.co/nnsohamnn/helmet-detection-yolo11/resolve/main/yolov11m%28100epochs%29.pt"
+# yolo11s.pt — better accuracy than yolo11n.pt, still fast enough for real-time
+BASE_MODEL_WEIGHTS = "yolo11s.pt"
+
+BACKENDS = ("pytorch", "onnx", "openvino")
+PRECISIONS = ("fp32", "fp16", "int8")
+
+
+# ── Weight Cache ─────────────────────────────────────────────────────────────
+
+def file_digest(path, length=12):
+    """(Short) SHA-256 of a file, used to verify weights and key exported artifacts."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()[:length]
+
+
+def verify_checksum(path, expected=None):
+    """
+    Check `path` against `expected` (full SHA-256 hex) or, if not given,
+    against its `.sha256` sidecar. With neither, the sidecar is written now
+    (trust on first use) so later loads detect a corrupted or swapped file.
+    """
+    digest = file_digest(path, length=64)
+    sidecar = path + ".sha256"
+    if not expected and os.path.exists(sidecar):
+        with open(sidecar) as f:
+            expected = f.read().split()[0]
+    if expected:
+        if digest != expected.strip().lower():
+            raise ValueError(f"Checksum mismatch for {path}: expected {expected}, got {digest}")
+    else:
+        with open(sidecar, "w") as f:
+            f.write(f"{digest}  {os.path.basename(path)}\n")
+    return digest
+
+
+def _download(url, path):
+    """Download to a temp file next to `path`, then rename (no half-written weights)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".part"
+    print(f"📥 Downloading {url} → {path}...")
+    with urllib.request.urlopen(url) as response, open(tmp, "wb") as f:
+        shutil.copyfileobj(response, f)
+    os.replace(tmp, path)
+
+
+def resolve_weights(name_or_url, local_path, expected_sha256=None):
+    """
+    Local, checksum-verified path of a weights file. Missing files are
+    fetched once into WEIGHTS_DIR — from the URL, or as an Ultralytics
+    release asset for plain names like "yolo11s.pt".
+    """
+    if not os.path.exists(local_path):
+        if name_or_url.startswith(("http://", "https://")):
+            _download(name_or_url, local_path)
+        else:
+            from ultralytics.utils.downloads import attempt_download_asset
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            attempt_download_asset(local_path)
+    verify_checksum(local_path, expected_sha256)
+    return local_path
+
+
+# ── Export Cache ─────────────────────────────────────────────────────────────
+
+
+def artifact_path(weights_path, backend, precision, imgsz):
+    """Cache location of an exported model (changes whenever the weights change)."""
+    stem = os.path.splitext(os.path.basename(weights_path))[0]
+    tag = f"{stem}-{file_digest(weights_path)}-{precision}-{imgsz}"
+    suffix = ".onnx" if backend == "onnx" else "_openvino_model"
+    return os.path.join(MODEL_CACHE_DIR, tag + suffix)
+
+
+def calibration_images(calibration_dir, max_images=INT8_CALIBRATION_MAX_IMAGES):
+    """Sorted image paths used for INT8 calibration."""
+    if not calibration_dir or not os.path.isdir(calibration_dir):
+        raise ValueError("INT8 export needs INT8_CALIBRATION_DIR pointing to a folder of local images")
+    paths = []
+    for ext in ("jpg", "jpeg", "png", "bmp", "webp"):
+        paths += glob.glob(os.path.join(calibration_dir, f"*.{ext}"))
+        paths += glob.glob(os.path.join(calibration_dir, f"*.{ext.upper()}"))
+    if not paths:
+        raise ValueError(f"No calibration images found in {calibration_dir}")
+    return sorted(set(paths))[:max_images]
+
+
+def _calibration_yaml(calibration_dir, names, workdir):
+    """Minimal Ultralytics dataset YAML pointing train/val at the calibration images."""
+    images_dir = os.path.join(workdir, "images")
+    os.makedirs(images_dir)
+    for path in calibration_images(calibration_dir):
+        shutil.copy(path, images_dir)
+    yaml_path = os.path.join(workdir, "calibration.yaml")
+    with open(yaml_path, "w") as f:
+        f.write(f"path: {workdir}\ntrain: images\nval: images\nnames:\n")
+        for cls_id, name in names.items():
+            f.write(f"  {cls_id}: {name!r}\n")
+    return yaml_path
+
+
+def quantize_onnx_int8(src_path, dst_path, calibration_dir, imgsz):
+    """Static INT8 (QDQ) quantization of an exported ONNX model with ONNX Runtime."""
+    import cv2
+    import onnxruntime
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    from roi_batching import letterbox
+
+    input_name = onnxruntime.InferenceSession(src_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+
+    class ImageReader(CalibrationDataReader):
+        def __init__(self):
+            self.paths = iter(calibration_images(calibration_dir))
+
+        def get_next(self):
+            for path in self.paths:
+                # cv2 loads BGR — the same channel order the model sees at runtime
+                img = cv2.imread(path)
+                if img is None:
+                    continue
+                canvas, _, _, _ = letterbox(img, imgsz)
+                return {input_name: (canvas.transpose(2, 0, 1)[None].astype(np.float32) / 255.0)}
+            return None
+
+    quantize_static(
+        src_path, dst_path, ImageReader(),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+    )
+
+
+def export_model(weights_path, backend, precision, imgsz, calibration_dir=INT8_CALIBRATION_DIR):
+    """
+    Export `weights_path` to ONNX / OpenVINO at the given precision, unless a
+    cached artifact for these exact weights already exists. Returns its path.
+    Exports use dynamic shapes so ROI batches of any size can be fed.
+    """
+    from ultralytics import YOLO
+
+    target = artifact_path(weights_path, backend, precision, imgsz)
+    if os.path.exists(target):
+        return target
+    os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+    print(f"📦 Exporting {os.path.basename(weights_path)} → {backend}/{precision} (imgsz={imgsz})...")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # Export from a private copy so artifacts never land next to the source weights
+        local_weights = os.path.join(workdir, os.path.basename(weights_path))
+        shutil.copy(weights_path, local_weights)
+        model = YOLO(local_weights)
+
+        if backend == "openvino":
+            kwargs = {"format": "openvino", "imgsz": imgsz, "dynamic": True, "half": precision == "fp16"}
+            if precision == "int8":
+                kwargs.update(int8=True, data=_calibration_yaml(calibration_dir, model.names, os.path.join(workdir, "calib")))
+            exported = model.export(**kwargs)
+        else:
+            # Note: Ultralytics only honours half=True for ONNX on GPU; on CPU it exports FP32
+            exported = model.export(format="onnx", imgsz=imgsz, dynamic=True, half=precision == "fp16", simplify=True)
+            if precision == "int8":
+                quantized = os.path.join(workdir, "int8.onnx")
+                quantize_onnx_int8(exported, quantized, calibration_dir, imgsz)
+                exported = quantized
+
+        shutil.move(str(exported), target)
+    return target
+
+
+# ── Model Loading ────────────────────────────────────────────────────────────
+
+def load_model(source, imgsz, backend=INFERENCE_BACKEND, precision=INFERENCE_PRECISION,
+               calibration_dir=INT8_CALIBRATION_DIR):
+    """
+    Load a YOLO model for the configured backend. Exported backends are
+    loaded through Ultralytics too, so callers get the same predict API
+    (model(images, conf=..., imgsz=...) and model.names) either way.
+    `calibration_dir` is only read when an INT8 artifact must be exported.
+    """
+    from ultralytics import YOLO
+
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend}")
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown inference precision: {precision}")
+
+    model = YOLO(source)
+    if backend == "pytorch":
+        if precision != "fp32":
+            raise ValueError("The pytorch backend runs FP32; use onnx or openvino for FP16/INT8")
+        return model
+    return YOLO(export_model(model.ckpt_path, backend, precision, imgsz, calibration_dir), task="detect")
+
+
+class ModelReplicas:
+    """
+    N independent copies of one model behind the model call API. Each call
+    checks out an idle replica, so up to N calls run concurrently (a single
+    Ultralytics model must not be called from two threads at once).
+    """
+
+    thread_safe = True
+
+    def __init__(self, replicas):
+        self.replicas = list(replicas)
+        self.names = self.replicas[0].names
+        self._idle = queue.SimpleQueue()
+        for replica in self.replicas:
+            self._idle.put(replica)
+
+    def __call__(self, source, **kwargs):
+        replica = self._idle.get()
+        try:
+            return replica(source, **kwargs)
+        finally:
+            self._idle.put(replica)
+
+
+def serialized(model):
+    """
+    `model` itself if it may be called from several threads at once
+    (`thread_safe`), else a single-replica ModelReplicas, which lets one
+    call in at a time.
+    """
+    return model if getattr(model, "thread_safe", False) else ModelReplicas([model])
+
+
+def configure_threads(intra_op_threads=INFERENCE_INTRA_OP_THREADS):
+    """
+    Cap PyTorch's intra-op thread pool. When passes run concurrently (see
+    dag.py, SCHEDULER_MODEL_WORKERS, MODEL_REPLICAS), each should get
+    roughly cores / concurrent passes threads instead of all of them.
+    """
+    if intra_op_threads > 0:
+        import torch
+        torch.set_num_threads(intra_op_threads)
+
+
+def load_models(backend=INFERENCE_BACKEND, precision=INFERENCE_PRECISION, replicas=MODEL_REPLICAS,
+                calibration_dir=INT8_CALIBRATION_DIR):
+    """
+    Load (base_model, helmet_model) for the given backend/precision from the
+    local weight cache. With `replicas` > 1 each is a ModelReplicas pool.
+    INT8 artifacts that are not cached yet are calibrated on `calibration_dir`.
+    """
+    configure_threads()
+    helmet_weights = resolve_weights(REMOTE_HELMET_URL, LOCAL_HELMET_PATH, HELMET_WEIGHTS_SHA256)
+    base_weights = resolve_weights(BASE_MODEL_WEIGHTS, os.path.join(WEIGHTS_DIR, BASE_MODEL_WEIGHTS), BASE_WEIGHTS_SHA256)
+
+    def load(weights, imgsz):
+        return load_model(weights, imgsz, backend, precision, calibration_dir)
+
+    if replicas > 1:
+        helmet_model = ModelReplicas(load(helmet_weights, ROI_TARGET_SIZE) for _ in range(replicas))
+        base_model = ModelReplicas(load(base_weights, BASE_MODEL_IMGSZ) for _ in range(replicas))
+        return base_model, helmet_model
+    helmet_model = load(helmet_weights, ROI_TARGET_SIZE)
+    base_model = load(base_weights, BASE_MODEL_IMGSZ)
+    return base_model, helmet_model
+
+
+def model_identity(backend=INFERENCE_BACKEND, precision=INFERENCE_PRECISION):
+    """Backend, precision and weight checksums (from the .sha256 sidecars) of the loaded models."""
+    identity = {"backend": backend, "precision": precision}
+    for name, path in (("base", os.path.join(WEIGHTS_DIR, BASE_MODEL_WEIGHTS)), ("helmet", LOCAL_HELMET_PATH)):
+        sidecar = path + ".sha256"
+        if os.path.exists(sidecar):
+            with open(sidecar) as f:
+                identity[name] = f.read().split()[0]
+        else:
+            identity[name] = os.path.basename(path)
+    return identity
+
+
+# ── Warm-up ──────────────────────────────────────────────────────────────────
+
+def warmup_models(base_model, helmet_model, batch_sizes=WARMUP_BATCH_SIZES):
+    """
+    Run dummy inferences at every input shape the pipeline uses, so graph
+    compilation / allocator growth happens before the first real request.
+    Returns {"<model>@<imgsz>x<batch>": ms} timings.
+    """
+    timings = {}
+    shapes = [("base", base_model, BASE_MODEL_IMGSZ)]
+    shapes += [("helmet", helmet_model, size) for size in sorted({HELMET_FULL_IMGSZ, *ROI_SIZE_BUCKETS})]
+    for name, model, imgsz in shapes:
+        for batch in batch_sizes:
+            frames = [np.zeros((imgsz, imgsz, 3), dtype=np.uint8) for _ in range(batch)]
+            t0 = time.perf_counter()
+            for replica in getattr(model, "replicas", [model]):
+                replica(frames, conf=0.25, imgsz=imgsz, verbose=False)
+            timings[f"{name}@{imgsz}x{batch}"] = round((time.perf_counter() - t0) * 1000)
+    return timings
@@ -0,0 +1,83 @@
+import numpy as np
+
+
+# ── Vectorized IoU / NMS ─────────────────────────────────────────────────────
+
+def boxes_array(detections):
+    """Stack the 'box' of each detection dict into an (N,4) array."""
+    if not detections:
+        return np.zeros((0, 4), dtype=np.float64)
+    return np.asarray([d["box"] for d in detections], dtype=np.float64).reshape(-1, 4)
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """
+    Pairwise IoU of two (N,4) / (M,4) [x1,y1,x2,y2] arrays via broadcasting.
+    Pairs with zero union get IoU 0, matching calculate_iou().
+    """
+    a = boxes_a[:, None, :]
+    b = boxes_b[None, :, :]
+    iw = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    ih = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    inter = iw * ih
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+
+def nms_indices(boxes, scores, priority=None, iou_threshold=0.45, groups=None):
+    """
+    Greedy NMS over an (N,4) box array. Returns kept indices, best first.
+
+    Candidates are visited by `priority` desc, then `scores` desc, then
+    original index (a stable sort, like sorted(..., reverse=True)). A box only
+    suppresses boxes with the same `groups` id when `groups` is given.
+    """
+    n = len(boxes)
+    if n == 0:
+        return []
+    scores = np.asarray(scores, dtype=np.float64)
+    priority = np.zeros(n) if priority is None else np.asarray(priority, dtype=np.float64)
+    order = np.lexsort((np.arange(n), -scores, -priority))
+
+    overlap = iou_matrix(boxes, boxes) >= iou_threshold
+    if groups is not None:
+        groups = np.asarray(groups)
+        overlap &= groups[:, None] == groups[None, :]
+
+    suppressed = np.zeros(n, dtype=bool)
+    keep = []
+    for i in order:
+        if suppressed[i]:
+            continue
+        keep.append(int(i))
+        suppressed |= overlap[i]
+    return keep
+
+
+def apply_nms(detections, iou_threshold=0.45, class_aware=False, per_source=False):
+    """
+    Non-Maximum Suppression. On ties, prefers 'no_helmet' labels (safety-first).
+    - class_aware: only suppress boxes of the same class_id
+    - per_source: only suppress boxes from the same pass (full image / one ROI)
+    """
+    if not detections:
+        return []
+    groups = None
+    if class_aware or per_source:
+        keys = [
+            (d.get("class_id") if class_aware else None, d.get("source") if per_source else None)
+            for d in detections
+        ]
+        key_ids = {}
+        groups = [key_ids.setdefault(k, len(key_ids)) for k in keys]
+
+    keep = nms_indices(
+        boxes_array(detections),
+        [d["confidence"] for d in detections],
+        priority=[d.get("is_no_helmet", False) for d in detections],
+        iou_threshold=iou_threshold,
+        groups=groups,
+    )
+    return [detections[i] for i in keep]
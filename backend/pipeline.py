@@ -0,0 +1,502 @@
+import time
+
+from config import (
+    CONF_WITH_HELMET, CONF_WITHOUT_HELMET,
+    BASE_MODEL_IMGSZ, HELMET_FULL_IMGSZ,
+    HEAD_NMS_IOU, HEAD_NMS_CLASS_AWARE, HEAD_NMS_PER_SOURCE,
+    ASSOCIATION_MODE, CASCADE_PROFILES, PIPELINE_SPECULATIVE_FULL_PASS,
+)
+from association import associate
+from cascade import helmet_skip_reason, resolve_mode, select_tiles
+from dag import PassGraph, pass_executor, roi_executor
+from nms import apply_nms
+from profiling import traced
+from decode import as_frame
+from metrics import log, record_pipeline, sample_verbose
+from roi_batching import result_arrays, run_helmet_batched
+from roi_planner import plan_rois
+
+
+# ── Utility Functions ────────────────────────────────────────────────────────
+
+def filter_head_detections(raw_detections):
+    """
+    Apply asymmetric per-class confidence filtering.
+    'Without Helmet' → low threshold (catch violations).
+    'With Helmet' → higher threshold (reduce false positives like caps).
+    """
+    filtered = []
+    for det in raw_detections:
+        is_no_helmet = det.get("is_no_helmet", False)
+        min_conf = CONF_WITHOUT_HELMET if is_no_helmet else CONF_WITH_HELMET
+        if det["confidence"] >= min_conf:
+            filtered.append(det)
+    return filtered
+
+
+def _lap(timings, name, t0):
+    """Record the ms since `t0` as `timings[name]` and return a new t0."""
+    now = time.perf_counter()
+    timings[name] = (now - t0) * 1000
+    return now
+
+
+def _update_track_cache(track_cache, track_ids, motorcycles, plan, tiles, region_heads, riders_per_bike):
+    """Store the confidence-filtered heads each freshly zoomed motorcycle's ROI produced."""
+    for tile, heads in zip(tiles, region_heads):
+        for source in tile["sources"]:
+            if not source.startswith("roi_moto_"):
+                continue
+            m_idx = int(source[len("roi_moto_"):])
+            x1, y1, x2, y2 = plan["moto_rois"][m_idx]
+            own = [h for h in heads if x1 <= (h["box"][0] + h["box"][2]) / 2 <= x2
+                   and y1 <= (h["box"][1] + h["box"][3]) / 2 <= y2]
+            rider_count = riders_per_bike.get(m_idx, {}).get("total_count", 0)
+            track_cache.store(track_ids[m_idx], motorcycles[m_idx]["box"], filter_head_detections(own), rider_count)
+
+
+# ── Detection Pipeline ───────────────────────────────────────────────────────
+
+def run_pipeline(img_np, base_model, helmet_model, t_start=None, timings=None, mode=None,
+                 record=record_pipeline, track_cache=None, profiler=None, gate=None):
+    """
+    Run the 5-stage detection pipeline on a decoded RGB image (or a
+    decode.py frame, which lets Stage 1 run on a reduced-size decode).
+    `base_model` / `helmet_model` are any YOLO-callables (plain models or
+    scheduler-backed wrappers). `t_start` lets the caller include decode
+    time in `processing_time_ms`. Per-stage wall times (ms) are recorded
+    into the /metrics histograms and, if `timings` is a dict, returned in it
+    (see benchmark.py). `mode` selects the cascade profile (fast /
+    balanced / accurate, see cascade.py). `record` receives the run's
+    metrics (worker processes forward them to the API process). With a
+    `track_cache` (consecutive frames of one camera, see track_cache.py),
+    motorcycles whose helmet status is cached skip their ROI pass. With a
+    `profiler` (see profiling.py) the passes run inline in this thread and
+    every model call is traced. A `gate` (change_gate.py decision for a
+    fixed camera) drops ROI tiles in unchanged areas and reuses the last
+    result's heads there.
+    Returns the /detect response dict.
+    """
+    mode = resolve_mode(mode)
+    if t_start is None:
+        t_start = time.time()
+    if timings is None:
+        timings = {} if profiler is None else profiler.timings
+    verbose = sample_verbose()
+
+    frame = as_frame(img_np)
+    h_orig, w_orig = frame.height, frame.width
+    if verbose:
+        log.info(f"📸 Processing image: {w_orig}x{h_orig}")
+
+    # ═══════════════════════════════════════════════════════════════
+    # STAGE 1: Detect persons & motorcycles with YOLO11s
+    #
+    # yolo11s.pt is more accurate than yolo11n.pt (higher mAP)
+    # while still being fast enough for real-time use.
+    # We also detect bicycles (class 1) for completeness.
+    # ═══════════════════════════════════════════════════════════════
+    def detect_vehicles():
+        with traced(profiler, "base_model", imgsz=BASE_MODEL_IMGSZ):
+            base_results = base_model(frame.preview, conf=0.25, imgsz=BASE_MODEL_IMGSZ)[0]
+        xyxy, confs, clss = result_arrays(base_results)
+        sx, sy = frame.preview_scale
+        xyxy = (xyxy * [sx, sy, sx, sy]).tolist()  # preview → full-resolution coords
+
+        persons = []
+        motorcycles = []
+        for coords, conf, cls in zip(xyxy, confs.tolist(), clss.tolist()):
+            if cls == 0:
+                persons.append({"box": coords, "conf": conf, "id": len(persons)})
+            elif cls == 3:  # motorcycle
+                motorcycles.append({"box": coords, "conf": conf, "id": len(motorcycles)})
+        return persons, motorcycles
+
+    # ═══════════════════════════════════════════════════════════════
+    # STAGE 2: Multi-scale Helmet Detection (ROI Zooming + Full Image)
+    #
+    # PROBLEM: In a typical traffic image (1920x1080), a rider's
+    # head might be only 15-25px after resize to 640. The helmet
+    # model can miss these tiny heads entirely.
+    #
+    # SOLUTION: ROI Zooming — for each motorcycle detected, we:
+    #   1. Expand the motorcycle bbox by 60% (more above — heads
+    #      extend upward from the bike)
+    #   2. Crop that expanded region from the original image
+    #   3. Resize the crop to 640x640 → the head now occupies
+    #      maybe 80-120px instead of 15-25px (smaller crops use a
+    #      320/480 bucket instead — see roi_bucket in roi_planner.py)
+    #   4. Run helmet model on this zoomed crop
+    #   5. Map detections back to original image coordinates
+    #
+    # We ALSO run on the full image to catch any heads not near
+    # a detected motorcycle, then MERGE all detections with NMS
+    # to remove duplicates from overlapping crops.
+    # ═══════════════════════════════════════════════════════════════
+
+    # The cascade (see cascade.py) decides per `mode` which passes run:
+    # nothing on frames with no riders to check, no 2c in fast mode, and
+    # no ROI tile whose zoom barely beats the full-image pass.
+    profile = CASCADE_PROFILES[mode]
+
+    # Pass A: Full-image detection (catches everything, but lower res on small heads)
+    def full_image_pass(*stage1):
+        if stage1 and helmet_skip_reason(mode, len(stage1[0][0]), len(stage1[0][1])):
+            return None
+        return run_helmet_batched(helmet_model, frame, [(None, HELMET_FULL_IMGSZ, "full_image")],
+                                  profiler=profiler)[0]
+
+    # Pass B: ROI Zoom on each motorcycle (high-res on the area that matters)
+    # Pass C: ROI Zoom on each person (catches riders on bikes not detected as motorcycles)
+    #         Only for persons not already covered by a motorcycle ROI
+    # Overlapping B/C ROIs (e.g. bikes queued at a signal) are merged into
+    # shared tiles as long as the zoom loss stays bounded (see roi_planner.py).
+    # All B/C tiles are planned first, then run through the helmet model in
+    # one batched call — one forward pass per ROI_BATCH_SIZE crops instead
+    # of one per crop.
+    def plan_passes(stage1):
+        persons, motorcycles = stage1
+        skip_reason = helmet_skip_reason(mode, len(persons), len(motorcycles))
+        track_ids, cached_heads = [], {}
+        if track_cache is not None and skip_reason is None:
+            track_ids, cached_heads = track_cache.lookup([m["box"] for m in motorcycles])
+        plan = plan_rois(
+            [m["box"] for m in motorcycles] if skip_reason is None else [],
+            [p["box"] for p in persons] if skip_reason is None and profile["person_rois"] else [],
+            w_orig, h_orig,
+            skip_motos=cached_heads,
+        )
+        tiles, low_zoom_tiles = select_tiles(mode, plan["tiles"], w_orig, h_orig)
+        gated_heads = []
+        if gate is not None and skip_reason is None:
+            tiles, gated_heads = gate.restrict(tiles)
+        return skip_reason, plan, tiles, low_zoom_tiles, track_ids, cached_heads, gated_heads
+
+    def roi_passes(planned, *_):
+        regions = [(tile["box"], tile["imgsz"], tile["source"]) for tile in planned[2]]
+        executor = roi_executor() if profiler is None else None
+        return regions, run_helmet_batched(helmet_model, frame, regions, executor=executor, profiler=profiler)
+
+    # The passes form a small DAG (see dag.py): 2a needs only the image, so
+    # it runs alongside Stage 1 in modes that never skip it. Modes that may
+    # skip it wait for Stage 1 so a skip actually saves the pass (unless
+    # PIPELINE_SPECULATIVE_FULL_PASS trades that for latency); ROI planning and 2b/2c wait for Stage 1. A plain model must not be
+    # called from two threads at once, so unless the helmet model is
+    # thread-safe (scheduler / replicas), 2b/2c also wait for 2a.
+    graph = PassGraph(pass_executor() if profiler is None else None, timings)
+    graph.add("base_model", detect_vehicles)
+    if profile["skip_helmet_when"] == "never" or PIPELINE_SPECULATIVE_FULL_PASS:
+        graph.add("helmet_full", full_image_pass)
+    else:
+        graph.add("helmet_full", full_image_pass, "base_model")
+    graph.add("roi_plan", plan_passes, "base_model")
+    if getattr(helmet_model, "thread_safe", False):
+        graph.add("helmet_rois", roi_passes, "roi_plan")
+    else:
+        graph.add("helmet_rois", roi_passes, "roi_plan", "helmet_full")
+
+    persons, motorcycles = graph.result("base_model")
+    skip_reason, plan, tiles, low_zoom_tiles, track_ids, cached_heads, gated_heads = graph.result("roi_plan")
+    regions, region_heads = graph.result("helmet_rois")
+    full_result = graph.result("helmet_full")
+    full_heads = full_result if skip_reason is None and full_result is not None else []
+    all_raw_heads = full_heads + [det for heads in region_heads for det in heads]
+    for heads in cached_heads.values():
+        for det in heads:
+            x1, y1, x2, y2 = det["box"]
+            det["box"] = [min(max(x1, 0), w_orig), min(max(y1, 0), h_orig),
+                          min(max(x2, 0), w_orig), min(max(y2, 0), h_orig)]
+            all_raw_heads.append(det)
+    all_raw_heads += gated_heads
+    stats = plan["stats"]
+
+    passes_run = ["base"]
+    if skip_reason is None:
+        passes_run.append("full_image")
+    for pass_name, prefix in (("moto_rois", "roi_moto_"), ("person_rois", "roi_person_")):
+        if any(s.startswith(prefix) for tile in tiles for s in tile["sources"]):
+            passes_run.append(pass_name)
+
+    if verbose:
+        log.info(f"🔍 Stage 1: {len(persons)} persons, {len(motorcycles)} motorcycles")
+        log.info(f"🔬 Stage 2a: {len(full_heads)} raw detections from full image"
+                 + (f" (skipped: {skip_reason})" if skip_reason else ""))
+        if skip_reason:
+            log.info(f"🔬 Stage 2b/2c: skipped ({skip_reason})")
+        else:
+            # Counted from the planned tiles, so skipped passes, cached
+            # motorcycles and modes without person ROIs are not reported as run
+            sources = [s for tile in plan["tiles"] for s in tile["sources"]]
+            n_moto = sum(s.startswith("roi_moto_") for s in sources)
+            n_person = sum(s.startswith("roi_person_") for s in sources)
+            log.info(f"🔬 Stage 2b/2c: {n_moto} motorcycle + {n_person} uncovered person "
+                     f"ROI(s) ({sum(plan['covered'])} persons covered) → {stats['tiles']} tile(s), "
+                     f"{stats['passes_saved']} pass(es) saved")
+        for tile in tiles:
+            log.info(f"   Tile {tile['source']}: ROI {tile['box']} @ {tile['imgsz']} (zoom ~{tile['zoom']:.1f}x)")
+        if low_zoom_tiles:
+            log.info(f"   Skipped {len(low_zoom_tiles)} low-zoom tile(s) (mode={mode})")
+        for (_, _, source_tag), heads in zip(regions, region_heads):
+            log.info(f"   → {len(heads)} detections from {source_tag} crop")
+        if cached_heads:
+            log.info(f"   ♻️  {len(cached_heads)} motorcycle(s) reused cached helmet status "
+                     f"({sum(len(h) for h in cached_heads.values())} heads)")
+        if gated_heads or (gate is not None and gate.tiles_reused):
+            log.info(f"   💤 {gate.tiles_reused} unchanged tile(s) reused {len(gated_heads)} head(s)")
+    t_lap = time.perf_counter()
+
+    # Filter per-class confidence and apply NMS to merge all sources
+    filtered_heads = filter_head_detections(all_raw_heads)
+    head_detections = apply_nms(
+        filtered_heads,
+        iou_threshold=HEAD_NMS_IOU,
+        class_aware=HEAD_NMS_CLASS_AWARE,
+        per_source=HEAD_NMS_PER_SOURCE,
+    )
+
+    if verbose:
+        log.info(f"🎯 Stage 2 FINAL: {len(head_detections)} head detections after multi-scale merge + NMS")
+        for hd in head_detections:
+            log.info(f"   {hd['label']:16s} conf={hd['confidence']:.2f}  src={hd.get('source','-'):16s}  box={[round(c) for c in hd['box']]}")
+    t_lap = _lap(timings, "nms", t_lap)
+
+    # ═══════════════════════════════════════════════════════════════
+    # STAGE 3: HYBRID Matching — heads + person fallback
+    #
+    # PRIMARY: head detection → motorcycle (precise helmet status)
+    # FALLBACK: person box → motorcycle (catches riders whose heads
+    #           were missed by the helmet model entirely)
+    #
+    # This is critical: YOLO11s detects persons very reliably, but
+    # the helmet model can miss heads in occluded/crowded scenes.
+    # Without the fallback, those riders simply don't exist in
+    # our system, leading to "0 riders" on occupied motorcycles.
+    # ═══════════════════════════════════════════════════════════════
+
+    # Gating masks and score matrices for all head/person/motorcycle pairs
+    # are built once in NumPy (see association.py); Steps 3a-3c below only
+    # read the resulting assignments.
+    head_to_person, head_to_moto, fallback_matches = associate(
+        [h["box"] for h in head_detections],
+        [p["box"] for p in persons],
+        [m["box"] for m in motorcycles],
+        mode=ASSOCIATION_MODE,
+    )
+
+    # Step 3a: Head → Person matching
+    person_helmet_status = {p["id"]: "unknown" for p in persons}
+    for h_idx, p_idx in head_to_person.items():
+        # Safety-first: if ANY detection says no_helmet, mark as no_helmet
+        if head_detections[h_idx]["is_no_helmet"]:
+            person_helmet_status[p_idx] = "no_helmet"
+        elif person_helmet_status[p_idx] == "unknown":
+            person_helmet_status[p_idx] = "helmet"
+
+    if verbose:
+        log.info("👤 Stage 3a: Head-to-person:")
+        for h_idx, p_idx in head_to_person.items():
+            log.info(f"   Head {h_idx} ({head_detections[h_idx]['label']}) → Person {p_idx}")
+
+    # Step 3b: Head → Motorcycle matching (primary rider signal)
+    riders_per_bike_heads = {}  # moto_idx -> [head_indices]
+    for h_idx, m_idx in head_to_moto.items():
+        riders_per_bike_heads.setdefault(m_idx, []).append(h_idx)
+
+    if verbose:
+        log.info("🏍️  Stage 3b: Head-to-motorcycle (primary):")
+        for m_idx, h_ids in riders_per_bike_heads.items():
+            labels = [head_detections[h]['label'] for h in h_ids]
+            log.info(f"   Motorcycle {m_idx}: {len(h_ids)} rider(s) via heads = {labels}")
+
+    # Step 3c: FALLBACK — Person → Motorcycle matching
+    #
+    # For persons who have NO head detection matched to them,
+    # check if their body position indicates they're on a motorcycle.
+    # This catches riders the helmet model completely missed.
+    #
+    # Criteria for person-to-motorcycle match:
+    #   1. Person's height is NOT much taller than motorcycle (filters standing people)
+    #   2. Person's horizontal center overlaps the motorcycle's horizontal span
+    #   3. Person's bottom is near the motorcycle's bottom
+    #   4. Person overlaps the motorcycle vertically by at least 30%
+    #   5. Person is not already matched via head detection
+    person_bike_assignment = [-1] * len(persons)
+    riders_per_bike_fallback = {}  # moto_idx -> [person_indices] (fallback-matched only)
+
+    # First, assign from head-based matching
+    for h_idx, m_idx in head_to_moto.items():
+        if h_idx in head_to_person:
+            p_idx = head_to_person[h_idx]
+            person_bike_assignment[p_idx] = m_idx
+
+    # Then, fallback for unmatched persons
+    for p_idx, (m_idx, score) in fallback_matches.items():
+        person_bike_assignment[p_idx] = m_idx
+        riders_per_bike_fallback.setdefault(m_idx, []).append(p_idx)
+        if verbose:
+            log.info(f"   🔄 FALLBACK: Person {p_idx} → Motorcycle {m_idx} (score={score:.2f}, helmet=unknown)")
+
+    # Combine: total riders per bike = head-matched + fallback-matched
+    riders_per_bike = {}  # final combined count
+    for m_idx in range(len(motorcycles)):
+        head_riders = riders_per_bike_heads.get(m_idx, [])
+        fallback_riders = riders_per_bike_fallback.get(m_idx, [])
+        # Get person IDs from head-matched riders
+        head_person_ids = set()
+        for h_idx in head_riders:
+            if h_idx in head_to_person:
+                head_person_ids.add(head_to_person[h_idx])
+        # Fallback riders that aren't already counted via heads
+        unique_fallback = [p for p in fallback_riders if p not in head_person_ids]
+        total_rider_count = len(head_riders) + len(unique_fallback)
+        if total_rider_count > 0:
+            riders_per_bike[m_idx] = {
+                "head_indices": head_riders,
+                "fallback_person_indices": unique_fallback,
+                "total_count": total_rider_count,
+            }
+
+    if track_cache is not None and track_ids:
+        _update_track_cache(track_cache, track_ids, motorcycles, plan, tiles, region_heads, riders_per_bike)
+
+    if verbose:
+        log.info("🏍️  Stage 3 FINAL — Combined rider counts:")
+        for m_idx, info in riders_per_bike.items():
+            log.info(f"   Motorcycle {m_idx}: {info['total_count']} total riders "
+                     f"({len(info['head_indices'])} via heads + {len(info['fallback_person_indices'])} via fallback)")
+    t_lap = _lap(timings, "matching", t_lap)
+
+    # ═══════════════════════════════════════════════════════════════
+    # STAGE 4: Violation Assembly
+    # ═══════════════════════════════════════════════════════════════
+    violations = []
+
+    # Violation 1: No helmet on motorcycle rider (from head detections)
+    for h_idx, m_idx in head_to_moto.items():
+        head = head_detections[h_idx]
+        if head["is_no_helmet"]:
+            p_idx = head_to_person.get(h_idx)
+            violations.append({
+                "type": "no_helmet",
+                "severity": "high",
+                "description": "Rider on motorcycle without helmet",
+                "person_box": persons[p_idx]["box"] if p_idx is not None else head["box"],
+                "motorcycle_box": motorcycles[m_idx]["box"],
+                "person_id": p_idx,
+                "motorcycle_id": m_idx,
+            })
+
+    # Violation 1b: Fallback riders with unknown helmet status
+    # (no head detected = we can't confirm a helmet → flag as warning)
+    for m_idx, info in riders_per_bike.items():
+        for p_idx in info["fallback_person_indices"]:
+            if person_helmet_status.get(p_idx) == "unknown":
+                violations.append({
+                    "type": "no_helmet",
+                    "severity": "medium",
+                    "description": "Rider on motorcycle — helmet not detected (possible violation)",
+                    "person_box": persons[p_idx]["box"],
+                    "motorcycle_box": motorcycles[m_idx]["box"],
+                    "person_id": p_idx,
+                    "motorcycle_id": m_idx,
+                })
+
+    # Violation 2: Triple riding (>2 riders per motorcycle)
+    for m_idx, info in riders_per_bike.items():
+        if info["total_count"] > 2:
+            # Gather all rider person IDs from both sources
+            all_rider_pids = []
+            for h_idx in info["head_indices"]:
+                if h_idx in head_to_person:
+                    all_rider_pids.append(head_to_person[h_idx])
+            all_rider_pids.extend(info["fallback_person_indices"])
+
+            violations.append({
+                "type": "triple_riding",
+                "severity": "high",
+                "description": f"{info['total_count']} persons detected on one motorcycle (max allowed: 2)",
+                "rider_count": info["total_count"],
+                "person_boxes": [persons[pid]["box"] for pid in all_rider_pids],
+                "motorcycle_box": motorcycles[m_idx]["box"],
+                "person_ids": all_rider_pids,
+                "motorcycle_id": m_idx,
+            })
+
+    t_elapsed = time.time() - t_start
+    if verbose:
+        log.info(f"🚨 Stage 4: {len(violations)} violations detected")
+        for v in violations:
+            log.info(f"   {v['type']}({v['severity']}): {v['description']}")
+        log.info(f"⏱️  Total processing time: {t_elapsed:.2f}s")
+    t_lap = _lap(timings, "violations", t_lap)
+
+    # ── Build Response ───────────────────────────────────────────
+    response_persons = []
+    for p_idx, person in enumerate(persons):
+        response_persons.append({
+            "id": p_idx,
+            "box": person["box"],
+            "confidence": person["conf"],
+            "helmet_status": person_helmet_status.get(p_idx, "unknown"),
+            "on_motorcycle": person_bike_assignment[p_idx] >= 0,
+            "motorcycle_id": person_bike_assignment[p_idx] if person_bike_assignment[p_idx] >= 0 else None,
+        })
+
+    response_motorcycles = []
+    for m_idx, moto in enumerate(motorcycles):
+        info = riders_per_bike.get(m_idx, {"head_indices": [], "fallback_person_indices": [], "total_count": 0})
+        # Collect all rider person IDs from both head and fallback matching
+        all_rider_pids = []
+        for h_idx in info["head_indices"]:
+            if h_idx in head_to_person:
+                all_rider_pids.append(head_to_person[h_idx])
+        all_rider_pids.extend(info["fallback_person_indices"])
+
+        response_motorcycles.append({
+            "id": m_idx,
+            "box": moto["box"],
+            "confidence": moto["conf"],
+            "rider_count": info["total_count"],
+            "rider_ids": all_rider_pids,
+        })
+        if track_ids:
+            response_motorcycles[-1]["track_id"] = track_ids[m_idx]
+            response_motorcycles[-1]["helmet_cached"] = m_idx in cached_heads
+
+    frontend_detections = []
+    for h_idx, head in enumerate(head_detections):
+        frontend_detections.append({
+            "box": head["box"],
+            "confidence": head["confidence"],
+            "label": head["label"],
+            "class_id": head["class_id"],
+            "person_id": head_to_person.get(h_idx),
+        })
+
+    response = {
+        "detections": frontend_detections,
+        "persons": response_persons,
+        "motorcycles": response_motorcycles,
+        "violations": violations,
+        "image_size": {
+            "width": w_orig,
+            "height": h_orig,
+        },
+        "roi_plan": plan["stats"],
+        "roi_tiles": [
+            {"source": tile["source"], "box": tile["box"], "imgsz": tile["imgsz"], "zoom": round(tile["zoom"], 3)}
+            for tile in tiles
+        ],
+        "cascade": {
+            "mode": mode,
+            "passes_run": passes_run,
+            "skip_reason": skip_reason,
+            "tiles_run": len(tiles),
+            "tiles_skipped_low_zoom": len(low_zoom_tiles),
+        },
+        "processing_time_ms": round(t_elapsed * 1000),
+    }
+    _lap(timings, "response", t_lap)
+    record(timings, stats["rois"], len(tiles), len(all_raw_heads), len(head_detections), violations,
+           mode, passes_run, [tile["imgsz"] for tile in tiles])
+    return response
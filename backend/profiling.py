@@ -0,0 +1,159 @@
+import contextlib
+import cProfile
+import json
+import os
+import random
+import threading
+import time
+import tracemalloc
+import uuid
+
+from config import PROFILE_DIR, PROFILE_HEADER_ENABLED, PROFILE_SAMPLE_RATE, PROFILE_MAX_KEPT
+
+PROFILE_HEADER = "x-profile"
+_NULL = contextlib.nullcontext()
+_active = threading.Lock()  # cProfile and tracemalloc are process-wide: one profiled request at a time
+
+
+def request_profiler(header_value=None):
+    """A RequestProfile if this request should be profiled (header or sampling), else None."""
+    wanted = PROFILE_HEADER_ENABLED and header_value not in (None, "", "0")
+    if not wanted and (PROFILE_SAMPLE_RATE <= 0 or random.random() >= PROFILE_SAMPLE_RATE):
+        return None
+    return RequestProfile("header" if wanted else "sampled")
+
+
+def traced(profiler, name, **args):
+    """Context manager recording one span (e.g. a model call) into `profiler`; a no-op without one."""
+    return _NULL if profiler is None else profiler.span(name, **args)
+
+
+# ── Request Profile ──────────────────────────────────────────────────────────
+
+class RequestProfile:
+    """
+    Detailed trace of one request, written to PROFILE_DIR as
+
+        <id>.pstats      cProfile of the request (python -m pstats, snakeviz)
+        <id>.trace.json  Chrome trace (chrome://tracing, Perfetto): one span
+                         per model call — each helmet batch with its imgsz and
+                         original crop sizes — plus decode / pipeline spans;
+                         stage timings and tracemalloc peak in "otherData"
+
+    run() enables cProfile and tracemalloc in the calling thread. The
+    pipeline runs its passes inline for a profiled request (see
+    run_pipeline), so the profile covers the whole call tree; compare
+    per-call times rather than wall time with unprofiled requests. When
+    another request is already being profiled, the request runs unprofiled.
+    Only the newest PROFILE_MAX_KEPT profiles are kept.
+    """
+
+    def __init__(self, trigger="header", root=PROFILE_DIR, max_kept=PROFILE_MAX_KEPT):
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.trigger = trigger
+        self.root = root
+        self.max_kept = max_kept
+        self.timings = {}
+        self.events = []
+        self.summary = None
+        self._t0 = time.perf_counter()
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.events.append({
+                "name": name, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+                "ts": round((t0 - self._t0) * 1e6, 1), "dur": round((time.perf_counter() - t0) * 1e6, 1),
+                "args": args,
+            })
+
+    def run(self, fn, *args, **kwargs):
+        """fn(*args, profiler=self) under cProfile + tracemalloc; the trace is written afterwards."""
+        if not _active.acquire(blocking=False):
+            self.summary = {"id": None, "skipped": "another request is being profiled"}
+            return fn(*args, profiler=None, **kwargs)
+        started_tracing = not tracemalloc.is_tracing()
+        try:
+            if started_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+            profile = cProfile.Profile()
+            self._t0 = time.perf_counter()
+            profile.enable()
+            try:
+                with self.span("request", trigger=self.trigger):
+                    return fn(*args, profiler=self, **kwargs)
+            finally:
+                profile.disable()
+                _, peak = tracemalloc.get_traced_memory()
+                top = tracemalloc.take_snapshot().statistics("lineno")[:15]
+                if started_tracing:
+                    tracemalloc.stop()
+                self._write(profile, peak - baseline, top)
+        finally:
+            _active.release()
+
+    def _write(self, profile, peak_bytes, top):
+        os.makedirs(self.root, exist_ok=True)
+        base = os.path.join(self.root, self.id)
+        try:
+            profile.dump_stats(base + ".pstats")
+            with open(base + ".trace.json", "w") as f:
+                json.dump({
+                    "traceEvents": self.events,
+                    "displayTimeUnit": "ms",
+                    "otherData": {
+                        "id": self.id,
+                        "trigger": self.trigger,
+                        "stage_ms": {k: round(v, 3) for k, v in self.timings.items()},
+                        "alloc_peak_bytes": peak_bytes,
+                        "top_allocations": [
+                            {"where": f"{s.traceback[0].filename}:{s.traceback[0].lineno}", "bytes": s.size,
+                             "count": s.count}
+                            for s in top
+                        ],
+                    },
+                }, f)
+        except OSError as e:
+            print(f"⚠️  Profiling: could not write {base}: {e}")
+            self.summary = {"id": None, "skipped": str(e)}
+            return
+        self.summary = {"id": self.id, "files": [self.id + ".pstats", self.id + ".trace.json"],
+                        "alloc_peak_bytes": peak_bytes}
+        prune(self.root, self.max_kept)
+
+
+# ── Profile Directory ────────────────────────────────────────────────────────
+
+def list_profiles(root=PROFILE_DIR):
+    """Newest-first [{"id", "files", "time"}] of the profiles on disk."""
+    profiles = {}
+    try:
+        entries = list(os.scandir(root))
+    except OSError:
+        return []
+    for entry in entries:
+        profile_id = entry.name.split(".", 1)[0]
+        item = profiles.setdefault(profile_id, {"id": profile_id, "files": [], "time": 0.0})
+        item["files"].append(entry.name)
+        item["time"] = max(item["time"], entry.stat().st_mtime)
+    return sorted(profiles.values(), key=lambda p: p["time"], reverse=True)
+
+
+def prune(root=PROFILE_DIR, max_kept=PROFILE_MAX_KEPT):
+    for profile in list_profiles(root)[max_kept:]:
+        for name in profile["files"]:
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(root, name))
+
+
+def profile_path(name, root=PROFILE_DIR):
+    """Path of one profile file by name, or None (names are never joined unchecked)."""
+    for profile in list_profiles(root):
+        if name in profile["files"]:
+            return os.path.join(root, name)
+    return None
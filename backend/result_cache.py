@@ -0,0 +1,182 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import config
+from config import RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL_S, RESULT_CACHE_DISK_MAX_BYTES
+
+# Config names that change what /detect returns for the same bytes
+FINGERPRINT_PREFIXES = ("CONF_", "ROI_", "HEAD_NMS_", "ASSOCIATION_", "CASCADE_")
+FINGERPRINT_NAMES = ("HELMET_MODEL_CONF", "BASE_MODEL_IMGSZ", "HELMET_FULL_IMGSZ",
+                     "DECODE_PREVIEW_MIN_SIDE", "LETTERBOX_PAD_VALUE")
+
+
+# ── Keys ─────────────────────────────────────────────────────────────────────
+
+def config_fingerprint(model_ids=None):
+    """
+    Short hash of every config constant that affects a pipeline result plus
+    the model identities (backend, precision, weight checksums). Changing
+    any of them changes every cache key, so stale results are never served.
+    """
+    settings = {
+        name: getattr(config, name) for name in sorted(dir(config))
+        if name.startswith(FINGERPRINT_PREFIXES) or name in FINGERPRINT_NAMES
+    }
+    payload = json.dumps({"config": settings, "models": model_ids or {}}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def content_key(data, fingerprint):
+    """Cache key of an upload: BLAKE2b of the raw bytes, salted with the config fingerprint."""
+    h = hashlib.blake2b(data, digest_size=16, key=fingerprint.encode()[:64])
+    return h.hexdigest()
+
+
+# ── Result Cache ─────────────────────────────────────────────────────────────
+
+class ResultCache:
+    """
+    Bounded LRU + TTL cache of /detect results, keyed by content_key().
+
+    Results are stored JSON-encoded, so the memory bound (`max_bytes`) counts
+    real payload bytes. Entries older than `ttl_s` are treated as misses and
+    dropped. With `disk_dir`, every stored result is also written there
+    (one file per key, survives restarts, bounded by `disk_max_bytes`);
+    a memory miss falls back to disk and promotes the entry.
+    """
+
+    def __init__(self, max_bytes=RESULT_CACHE_MAX_BYTES, ttl_s=RESULT_CACHE_TTL_S,
+                 disk_dir=None, disk_max_bytes=RESULT_CACHE_DISK_MAX_BYTES):
+        self.max_bytes = max(0, int(max_bytes))
+        self.ttl_s = ttl_s
+        self.disk_dir = disk_dir or None
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()   # key → (stored_at, payload bytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+        self._disk_bytes = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, _, size in self._disk_files())
+
+    def get(self, key):
+        """Cached result dict for `key`, or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, payload = entry
+                if now - stored_at <= self.ttl_s:
+                    self._entries.move_to_end(key)
+                    self.counters["hits"] += 1
+                    return json.loads(payload)
+                self._drop(key)
+                self.counters["expired"] += 1
+
+        entry = self._disk_get(key, now)
+        with self._lock:
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["disk_hits"] += 1
+            self._insert(key, *entry)
+        return json.loads(entry[1])
+
+    def put(self, key, result):
+        payload = json.dumps(result, separators=(",", ":")).encode()
+        stored_at = time.time()
+        with self._lock:
+            self._insert(key, stored_at, payload)
+        if self.disk_dir:
+            self._disk_put(key, payload)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["disk_hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "hit_rate": round((self.counters["hits"] + self.counters["disk_hits"]) / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_s": self.ttl_s,
+                "disk_dir": self.disk_dir,
+                "disk_bytes": self._disk_bytes if self.disk_dir else 0,
+            }
+
+    # Memory tier (callers hold the lock)
+
+    def _insert(self, key, stored_at, payload):
+        if len(payload) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (stored_at, payload)
+        self._bytes += len(payload)
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.counters["evictions"] += 1
+
+    def _drop(self, key):
+        _, payload = self._entries.pop(key)
+        self._bytes -= len(payload)
+
+    # Disk tier
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key + ".json")
+
+    def _disk_files(self):
+        """(mtime, path, size) of every cached file, oldest first."""
+        files = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith(".json"):
+                st = entry.stat()
+                files.append((st.st_mtime, entry.path, st.st_size))
+        return sorted(files)
+
+    def _disk_get(self, key, now):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            stored_at = os.path.getmtime(path)
+            if now - stored_at > self.ttl_s:
+                os.unlink(path)
+                return None
+            with open(path, "rb") as f:
+                return stored_at, f.read()
+        except OSError:
+            return None
+
+    def _disk_put(self, key, payload):
+        path = self._disk_path(key)
+        tmp = f"{path}.{threading.get_ident()}.part"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(payload)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"⚠️  Result cache: could not write {path}: {e}")
+            return
+        with self._lock:
+            self._disk_bytes += len(payload)
+            if self._disk_bytes <= self.disk_max_bytes:
+                return
+            # Over budget: delete oldest files down to 90% of the bound
+            files = self._disk_files()
+            self._disk_bytes = sum(size for _, _, size in files)
+            for _, old_path, size in files:
+                if self._disk_bytes <= self.disk_max_bytes * 0.9:
+                    break
+                try:
+                    os.unlink(old_path)
+                except OSError:
+                    continue
+                self._disk_bytes -= size
@@ -0,0 +1,130 @@
+import cv2
+import numpy as np
+
+from config import HELMET_MODEL_CONF, ROI_BATCH_SIZE, LETTERBOX_PAD_VALUE
+from decode import as_frame
+
+
+# ── Letterboxing ─────────────────────────────────────────────────────────────
+
+def letterbox(img, size):
+    """
+    Resize `img` to fit inside a size×size square (aspect ratio preserved)
+    and pad the rest with gray, centered — the same transform Ultralytics
+    applies internally, but done here so crops of any shape can share a batch.
+    Returns (canvas, scale, pad_x, pad_y).
+    """
+    h, w = img.shape[:2]
+    scale = min(size / h, size / w)
+    new_w = max(1, int(round(w * scale)))
+    new_h = max(1, int(round(h * scale)))
+    if (new_w, new_h) != (w, h):
+        img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+
+    pad_x = (size - new_w) // 2
+    pad_y = (size - new_h) // 2
+    canvas = np.full((size, size, img.shape[2]), LETTERBOX_PAD_VALUE, dtype=img.dtype)
+    canvas[pad_y:pad_y + new_h, pad_x:pad_x + new_w] = img
+    return canvas, scale, pad_x, pad_y
+
+
+# ── Result Parsing ───────────────────────────────────────────────────────────
+
+def result_arrays(result):
+    """Return (xyxy [N,4], conf [N], cls [N]) numpy arrays from a YOLO result."""
+    boxes = result.boxes
+    arrays = []
+    for t in (boxes.xyxy, boxes.conf, boxes.cls):
+        if hasattr(t, "cpu"):
+            t = t.cpu().numpy()
+        arrays.append(np.asarray(t, dtype=np.float32))
+    xyxy, conf, cls = arrays
+    return xyxy.reshape(-1, 4), conf.reshape(-1), cls.reshape(-1).astype(np.int64)
+
+
+def make_head_detection(box, conf, cls_id, names, source_tag):
+    """Build the raw head-detection dict used throughout Stage 2/3."""
+    label = names[cls_id]
+    return {
+        "box": box,
+        "confidence": conf,
+        "label": label,
+        "class_id": cls_id,
+        "is_no_helmet": cls_id == 1 or "without" in label.lower(),
+        "source": source_tag,
+    }
+
+
+# ── Batched Helmet Inference ─────────────────────────────────────────────────
+
+def run_helmet_batched(model, frame, regions, batch_size=ROI_BATCH_SIZE, executor=None, profiler=None):
+    """
+    Run the helmet model over many regions of one image in as few forward
+    passes as possible.
+
+    `frame` is an RGB array or a decode.py frame. `regions` is a list of
+    (roi_box, imgsz, source_tag); `roi_box` is an [x1, y1, x2, y2] integer
+    crop, or None for the whole image (run on the frame's preview). Every
+    crop is letterboxed to its imgsz; crops sharing an imgsz are stacked into
+    batches of at most `batch_size`, and detections are mapped back to
+    original image coordinates. With an `executor` and a model that is safe
+    to call from several threads (`thread_safe`: scheduler-backed wrappers,
+    replica pools), the batches run concurrently. A `profiler` (see
+    profiling.py) gets one span per model call with the batch's crop sizes.
+
+    Returns a list (one entry per region, same order) of raw head detections.
+    """
+    frame = as_frame(frame)
+    out = [[] for _ in regions]
+
+    # Crop + letterbox every non-empty region, grouped by inference size
+    groups = {}
+    for r_idx, (roi_box, imgsz, source_tag) in enumerate(regions):
+        if roi_box is None:
+            crop = frame.preview
+            sx, sy = frame.preview_scale
+            offset = (0, 0)
+        else:
+            crop = frame.crop(roi_box)
+            sx, sy = 1.0, 1.0
+            offset = (roi_box[0], roi_box[1])
+        if crop.size == 0:
+            continue
+        canvas, scale, pad_x, pad_y = letterbox(crop, imgsz)
+        groups.setdefault(imgsz, []).append(
+            (r_idx, canvas, scale, pad_x, pad_y, crop.shape[:2], offset, (sx, sy), source_tag)
+        )
+
+    chunks = [
+        (imgsz, items[start:start + batch_size])
+        for imgsz, items in groups.items()
+        for start in range(0, len(items), batch_size)
+    ]
+
+    def infer(imgsz, chunk):
+        if profiler is None:
+            return model([it[1] for it in chunk], conf=HELMET_MODEL_CONF, imgsz=imgsz)
+        with profiler.span("helmet_model", imgsz=imgsz, batch=len(chunk), sources=[it[8] for it in chunk],
+                           crop_sizes=[[it[5][1], it[5][0]] for it in chunk]):
+            return model([it[1] for it in chunk], conf=HELMET_MODEL_CONF, imgsz=imgsz)
+
+    if executor is not None and len(chunks) > 1 and getattr(model, "thread_safe", False):
+        futures = [executor.submit(infer, imgsz, chunk) for imgsz, chunk in chunks]
+        chunk_results = [f.result() for f in futures]
+    else:
+        chunk_results = [infer(imgsz, chunk) for imgsz, chunk in chunks]
+
+    for (_, chunk), results in zip(chunks, chunk_results):
+        for item, result in zip(chunk, results):
+            r_idx, _, scale, pad_x, pad_y, (crop_h, crop_w), (off_x, off_y), (sx, sy), source_tag = item
+            xyxy, confs, clss = result_arrays(result)
+            if len(xyxy) == 0:
+                continue
+            # Letterbox canvas → crop coords (clipped to the crop) → image coords
+            xyxy = (xyxy - [pad_x, pad_y, pad_x, pad_y]) / scale
+            xyxy[:, [0, 2]] = xyxy[:, [0, 2]].clip(0, crop_w) * sx + off_x
+            xyxy[:, [1, 3]] = xyxy[:, [1, 3]].clip(0, crop_h) * sy + off_y
+            for box, conf, cls_id in zip(xyxy.tolist(), confs.tolist(), clss.tolist()):
+                out[r_idx].append(make_head_detection(box, conf, cls_id, model.names, source_tag))
+
+    return out
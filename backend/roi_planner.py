@@ -0,0 +1,190 @@
+import numpy as np
+
+from config import (
+    ROI_EXPAND_RATIO, ROI_ABOVE_EXPAND, ROI_TARGET_SIZE,
+    ROI_MERGE_ENABLED, ROI_MERGE_MAX_ZOOM_LOSS,
+    ROI_SIZE_BUCKETS, ROI_TARGET_HEAD_PX, ROI_HEAD_FRACTION, ROI_MAX_UPSCALE,
+)
+from geometry import expand_box, box_center
+
+
+# ── ROI Geometry ─────────────────────────────────────────────────────────────
+
+def roi_zoom(box, target_size=ROI_TARGET_SIZE):
+    """Effective zoom when `box` is letterboxed to target_size."""
+    return min(target_size / max(box[2] - box[0], 1), target_size / max(box[3] - box[1], 1))
+
+
+def roi_bucket(box, head_px, buckets=ROI_SIZE_BUCKETS):
+    """
+    Inference size for a tile, from its native side: the smallest bucket
+    that does not downscale the crop, or — for crops whose expected head of
+    `head_px` native pixels would still be below ROI_TARGET_HEAD_PX at that
+    size — the one that brings the head up to it. Never more than
+    ROI_MAX_UPSCALE × the native side (a bigger input costs compute without
+    adding detail); falls back to the largest bucket.
+    """
+    side = max(box[2] - box[0], box[3] - box[1], 1)
+    wanted = min(max(side, side * ROI_TARGET_HEAD_PX / max(head_px, 1e-6)), side * ROI_MAX_UPSCALE)
+    for size in buckets:
+        if size >= wanted:
+            return size
+    return buckets[-1]
+
+
+def person_head_roi(box, img_w, img_h):
+    """Upper 45% of a person (head + shoulders), widened 10% and raised 10%."""
+    px1, py1, px2, py2 = box
+    p_w = px2 - px1
+    p_h = py2 - py1
+    return [
+        max(0, int(px1 - p_w * 0.10)),
+        max(0, int(py1 - p_h * 0.10)),
+        min(img_w, int(px2 + p_w * 0.10)),
+        min(img_h, int(py1 + p_h * 0.45)),
+    ]
+
+
+# ── Spatial Index ────────────────────────────────────────────────────────────
+
+class RoiIndex:
+    """
+    Uniform-grid index over ROI boxes. Each ROI is registered in every cell
+    it touches, so a point query only tests the few ROIs sharing its cell
+    instead of every ROI in the frame.
+    """
+
+    def __init__(self, boxes, cell_size=None):
+        self.boxes = [list(b) for b in boxes]
+        if cell_size is None:
+            sides = [max(b[2] - b[0], b[3] - b[1]) for b in self.boxes]
+            cell_size = max(32, float(np.median(sides))) if sides else 32
+        self.cell_size = cell_size
+        self.cells = {}
+        for i, (x1, y1, x2, y2) in enumerate(self.boxes):
+            for cx in range(int(x1 // cell_size), int(x2 // cell_size) + 1):
+                for cy in range(int(y1 // cell_size), int(y2 // cell_size) + 1):
+                    self.cells.setdefault((cx, cy), []).append(i)
+
+    def query(self, point):
+        """Indices of ROIs containing `point` (inclusive bounds)."""
+        x, y = point
+        cell = (int(x // self.cell_size), int(y // self.cell_size))
+        return [
+            i for i in self.cells.get(cell, ())
+            if self.boxes[i][0] <= x <= self.boxes[i][2] and self.boxes[i][1] <= y <= self.boxes[i][3]
+        ]
+
+    def covers(self, point):
+        return bool(self.query(point))
+
+
+# ── Tile Merging ─────────────────────────────────────────────────────────────
+
+def merge_rois(boxes, max_zoom_loss=ROI_MERGE_MAX_ZOOM_LOSS, target_size=ROI_TARGET_SIZE):
+    """
+    Greedily merge overlapping ROIs into shared zoom tiles.
+
+    Each step merges the overlapping pair whose union box loses the least
+    zoom, as long as the union keeps at least (1 - max_zoom_loss) of the best
+    zoom any of its member ROIs had on its own. Returns tiles as
+    {"box", "members" (ROI indices), "zoom"}, ordered by first member.
+    """
+    tiles = [{"box": list(b), "members": [i], "best_zoom": roi_zoom(b, target_size)} for i, b in enumerate(boxes)]
+    while len(tiles) > 1:
+        arr = np.asarray([t["box"] for t in tiles], dtype=np.float64)
+        best_zoom = np.asarray([t["best_zoom"] for t in tiles])
+        x1, y1, x2, y2 = (arr[:, k] for k in range(4))
+
+        overlap = (
+            (np.minimum(x2[:, None], x2[None, :]) > np.maximum(x1[:, None], x1[None, :]))
+            & (np.minimum(y2[:, None], y2[None, :]) > np.maximum(y1[:, None], y1[None, :]))
+        )
+        uw = np.maximum(x2[:, None], x2[None, :]) - np.minimum(x1[:, None], x1[None, :])
+        uh = np.maximum(y2[:, None], y2[None, :]) - np.minimum(y1[:, None], y1[None, :])
+        union_zoom = np.minimum(target_size / np.maximum(uw, 1), target_size / np.maximum(uh, 1))
+        loss = 1.0 - union_zoom / np.maximum(best_zoom[:, None], best_zoom[None, :])
+
+        valid = overlap & (loss <= max_zoom_loss) & np.triu(np.ones_like(overlap), k=1)
+        if not valid.any():
+            break
+        i, j = np.unravel_index(np.where(valid, loss, np.inf).argmin(), loss.shape)
+        a, b = tiles[i], tiles[j]
+        a["box"] = [min(a["box"][0], b["box"][0]), min(a["box"][1], b["box"][1]),
+                    max(a["box"][2], b["box"][2]), max(a["box"][3], b["box"][3])]
+        a["members"] = sorted(a["members"] + b["members"])
+        a["best_zoom"] = max(a["best_zoom"], b["best_zoom"])
+        del tiles[j]
+
+    return [
+        {"box": t["box"], "members": t["members"], "zoom": roi_zoom(t["box"], target_size)}
+        for t in sorted(tiles, key=lambda t: t["members"][0])
+    ]
+
+
+# ── Stage 2 Planning ─────────────────────────────────────────────────────────
+
+def plan_rois(moto_boxes, person_boxes, img_w, img_h, merge=ROI_MERGE_ENABLED, skip_motos=()):
+    """
+    Plan the Stage 2b/2c helmet passes for one frame.
+
+    - every motorcycle ROI is expanded exactly once
+    - persons whose center lies in a motorcycle ROI (grid-index lookup) are
+      "covered"; the rest get a head ROI
+    - overlapping ROIs are merged into shared tiles (bounded zoom loss)
+
+    - motorcycles in `skip_motos` (helmet status reused from the track
+      cache) get no ROI of their own but still cover their persons
+    - each tile gets an inference size from ROI_SIZE_BUCKETS by its native
+      side, raised for the smallest head expected in any of its member ROIs
+      (see roi_bucket)
+
+    Returns {"moto_rois", "covered", "tiles", "stats"}; each tile has
+    "box", "source", "sources" (member tags), "imgsz" and "zoom" (the zoom
+    achieved at that imgsz).
+    """
+    moto_rois = [
+        expand_box(box, img_w, img_h, ratio=ROI_EXPAND_RATIO, ratio_above=ROI_ABOVE_EXPAND)
+        for box in moto_boxes
+    ]
+    index = RoiIndex(moto_rois)
+    covered = [index.covers(box_center(box)) for box in person_boxes]
+
+    rois = [(roi, f"roi_moto_{m_idx}", "moto") for m_idx, roi in enumerate(moto_rois) if m_idx not in skip_motos]
+    rois += [
+        (person_head_roi(box, img_w, img_h), f"roi_person_{p_idx}", "person")
+        for p_idx, box in enumerate(person_boxes)
+        if not covered[p_idx]
+    ]
+
+    boxes = [roi for roi, _, _ in rois]
+    head_px = [ROI_HEAD_FRACTION[kind] * max(roi[2] - roi[0], roi[3] - roi[1]) for roi, _, kind in rois]
+    if merge:
+        merged = merge_rois(boxes)
+    else:
+        merged = [{"box": list(b), "members": [i], "zoom": roi_zoom(b)} for i, b in enumerate(boxes)]
+
+    tiles = []
+    for tile in merged:
+        sources = [rois[i][1] for i in tile["members"]]
+        box = [int(c) for c in tile["box"]]
+        imgsz = roi_bucket(box, min(head_px[i] for i in tile["members"]))
+        tiles.append({
+            "box": box,
+            "source": "+".join(sources),
+            "sources": sources,
+            "imgsz": imgsz,
+            "zoom": roi_zoom(box, imgsz),
+        })
+
+    return {
+        "moto_rois": moto_rois,
+        "covered": covered,
+        "tiles": tiles,
+        "stats": {
+            "rois": len(rois),
+            "tiles": len(tiles),
+            "passes_saved": len(rois) - len(tiles),
+            "cached": len(skip_motos),
+        },
+    }
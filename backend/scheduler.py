@@ -0,0 +1,150 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from config import SCHEDULER_MAX_BATCH_SIZE, SCHEDULER_MAX_WAIT_MS, SCHEDULER_MODEL_WORKERS
+
+
+# ── Cross-request Micro-batching ─────────────────────────────────────────────
+
+class InferenceScheduler:
+    """
+    Dynamic micro-batcher shared by all requests of a worker.
+
+    Request threads submit (model, images, conf, imgsz, options) and get a
+    Future. A single worker thread drains the queue: it waits up to
+    `max_wait_ms` after the first pending item (or until `max_batch_size`
+    images are queued), groups compatible work (same model, conf, imgsz and
+    extra call options such as `classes` or `iou`) from all
+    requests, runs each group in batches of `max_batch_size`, and hands each
+    request back exactly the results for its own images.
+
+    With `model_workers` > 1, the groups of *different* models collected in
+    one cycle (e.g. base-model Stage 1 and helmet pass 2a) run concurrently;
+    calls to the same model object are never concurrent.
+    """
+
+    def __init__(self, max_batch_size=SCHEDULER_MAX_BATCH_SIZE, max_wait_ms=SCHEDULER_MAX_WAIT_MS,
+                 model_workers=SCHEDULER_MODEL_WORKERS):
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms / 1000.0)
+        self._pool = None
+        if model_workers > 1:
+            self._pool = ThreadPoolExecutor(max_workers=model_workers, thread_name_prefix="scheduler-model")
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._worker, name="inference-scheduler", daemon=True)
+        self._thread.start()
+
+    def submit(self, model, images, conf, imgsz, options=None):
+        """
+        Queue `images` for `model`; the Future resolves to a list of results.
+        `options` are further keyword arguments for the model call.
+        """
+        future = Future()
+        if self._closed:
+            future.set_exception(RuntimeError("Inference scheduler is shut down"))
+            return future
+        if not images:
+            future.set_result([])
+            return future
+        self._queue.put((model, list(images), conf, imgsz, dict(options or {}), future))
+        return future
+
+    def close(self):
+        """Stop the worker thread after the already-queued work is done."""
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        if self._pool:
+            self._pool.shutdown()
+
+    def _collect(self):
+        """Block for the first item, then gather more until the batch is full or the wait expires."""
+        first = self._queue.get()
+        if first is None:
+            return None
+        pending = [first]
+        n_images = len(first[1])
+        deadline = time.monotonic() + self.max_wait
+        while n_images < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # re-queue the stop marker for the next loop
+                break
+            pending.append(item)
+            n_images += len(item[1])
+        return pending
+
+    def _worker(self):
+        while True:
+            pending = self._collect()
+            if pending is None:
+                return
+
+            by_model = {}
+            for item in pending:
+                model, _, conf, imgsz, options, _ = item
+                key = (conf, imgsz, _options_key(options))
+                by_model.setdefault(id(model), {}).setdefault(key, []).append(item)
+
+            if self._pool is None or len(by_model) == 1:
+                for groups in by_model.values():
+                    self._run_groups(groups)
+            else:
+                for f in [self._pool.submit(self._run_groups, groups) for groups in by_model.values()]:
+                    f.result()
+
+    def _run_groups(self, groups):
+        """Run one model's compatible groups, one after the other."""
+        for items in groups.values():
+            model, _, conf, imgsz, options, _ = items[0]
+            images = [img for item in items for img in item[1]]
+            try:
+                results = []
+                for start in range(0, len(images), self.max_batch_size):
+                    results.extend(model(images[start:start + self.max_batch_size], conf=conf, imgsz=imgsz,
+                                         **options))
+            except Exception as e:
+                for item in items:
+                    item[5].set_exception(e)
+                continue
+
+            offset = 0
+            for _, item_images, _, _, _, future in items:
+                future.set_result(results[offset:offset + len(item_images)])
+                offset += len(item_images)
+
+
+def _options_key(options):
+    """Hashable grouping key of a call's extra keyword arguments (values may be lists, e.g. classes)."""
+    return tuple(sorted((name, repr(value)) for name, value in options.items()))
+
+
+class ScheduledModel:
+    """
+    Drop-in stand-in for a YOLO model that routes calls through an
+    InferenceScheduler. Calls block the calling (request) thread until the
+    batched results are ready, so the pipeline code stays unchanged. Extra
+    keyword arguments are forwarded to the model; only calls with equal
+    arguments share a batch. Safe to call from several threads at once (the
+    scheduler serializes).
+    """
+
+    thread_safe = True
+
+    def __init__(self, model, scheduler):
+        self.model = model
+        self.scheduler = scheduler
+        self.names = model.names
+
+    def __call__(self, source, conf=0.25, imgsz=640, **kwargs):
+        images = source if isinstance(source, (list, tuple)) else [source]
+        return self.scheduler.submit(self.model, images, conf, imgsz, kwargs).result()
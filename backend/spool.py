@@ -0,0 +1,255 @@
+import collections
+import json
+import os
+import threading
+import time
+
+from batch import IMAGE_EXTENSIONS
+from config import (
+    SPOOL_QUEUE_MAX, SPOOL_BACKPRESSURE, SPOOL_POLL_S, SPOOL_STABLE_S, SPOOL_WORKERS, SPOOL_WRITE_RESULTS,
+)
+from metrics import SPOOL_FILES, SPOOL_LAG_SECONDS
+
+BACKPRESSURE_POLICIES = ("pause", "drop_oldest", "block")
+
+
+def parse_spool_dirs(spec):
+    """
+    [(camera, path)] from SPOOL_DIRS: ";"-separated entries, each "path" (the
+    camera id is the folder name) or "camera=path".
+    """
+    dirs = []
+    for entry in (spec or "").split(";"):
+        entry = entry.strip()
+        if not entry:
+            continue
+        camera, _, path = entry.rpartition("=")
+        path = os.path.abspath(path)
+        dirs.append((camera or os.path.basename(path.rstrip(os.sep)), path))
+    return dirs
+
+
+def _move(path, folder):
+    """Move `path` into `folder`, never overwriting an earlier file of the same name."""
+    os.makedirs(folder, exist_ok=True)
+    target = os.path.join(folder, os.path.basename(path))
+    if os.path.exists(target):
+        stem, ext = os.path.splitext(target)
+        target = f"{stem}.{int(time.time() * 1000)}{ext}"
+    os.replace(path, target)
+    return target
+
+
+# ── Spool Ingestion ──────────────────────────────────────────────────────────
+
+class SpoolIngestor:
+    """
+    Watches spool directories (e.g. FTP drop folders) and runs every new
+    image through `process(bytes, camera, name)`.
+
+    A scanner thread polls the folders every `poll_s` and queues image files
+    that have not changed for `stable_s` (so half-uploaded files are left
+    alone). `workers` threads take files from the bounded queue, run them and
+    move each into `<spool>/done` (plus a .json result when `write_results`)
+    or `<spool>/failed` (plus a .error.txt). A file that cannot be moved out
+    of the spool is logged once and left alone (see stats()["stuck"]) until
+    it is replaced by a newer file of the same name. When the queue is full, the
+    `backpressure` policy applies:
+
+        pause        stop scanning until the queue drains to half; files wait on disk
+        drop_oldest  evict the oldest queued file to failed/ and queue the new one
+        block        the scanner waits for a free slot mid-scan
+
+    stats() reports throughput, queue / backlog size and lag (file landed →
+    result written).
+    """
+
+    def __init__(self, dirs, process, queue_max=SPOOL_QUEUE_MAX, backpressure=SPOOL_BACKPRESSURE,
+                 poll_s=SPOOL_POLL_S, stable_s=SPOOL_STABLE_S, workers=SPOOL_WORKERS,
+                 write_results=SPOOL_WRITE_RESULTS):
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown spool backpressure policy: {backpressure} "
+                             f"(expected one of {', '.join(BACKPRESSURE_POLICIES)})")
+        self.dirs = list(dirs)
+        self.process = process
+        self.queue_max = max(1, int(queue_max))
+        self.backpressure = backpressure
+        self.poll_s = poll_s
+        self.stable_s = stable_s
+        self.write_results = write_results
+        self.n_workers = max(1, int(workers))
+
+        self._queue = collections.deque()   # (path, camera, landed_at)
+        self._claimed = set()               # queued or in-flight paths
+        self._stuck = {}                    # path → mtime of files that could not be moved out of the spool
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._paused = False
+        self._backlog = 0
+        self._done_times = collections.deque()  # completion times within the throughput window
+        self._last_lag_s = None
+        self.counters = {"queued": 0, "processed": 0, "failed": 0, "dropped": 0, "pauses": 0}
+        self._threads = []
+
+    def start(self):
+        for _, path in self.dirs:
+            os.makedirs(path, exist_ok=True)
+        self._threads.append(threading.Thread(target=self._scan_loop, name="spool-scanner", daemon=True))
+        self._threads += [
+            threading.Thread(target=self._work_loop, name=f"spool-worker-{i}", daemon=True)
+            for i in range(self.n_workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def close(self, timeout=10.0):
+        """Stop scanning; workers finish the file they are on, queued files stay in the spool."""
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    # Scanning
+
+    def _scan_once(self):
+        now = time.time()
+        found = []
+        for camera, folder in self.dirs:
+            try:
+                entries = list(os.scandir(folder))
+            except OSError as e:
+                print(f"⚠️  Spool: cannot scan {folder}: {e}")
+                continue
+            for entry in entries:
+                if not entry.is_file() or not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                try:
+                    mtime = entry.stat().st_mtime
+                except OSError:
+                    continue
+                if now - mtime >= self.stable_s:
+                    found.append((mtime, entry.path, camera))
+        found.sort()  # oldest first
+        return found
+
+    def _scan_loop(self):
+        while not self._stop.is_set():
+            with self._cond:
+                if self._paused and len(self._queue) <= self.queue_max // 2:
+                    self._paused = False
+            if not self._paused:
+                found = self._scan_once()
+                with self._cond:
+                    found = [f for f in found if f[1] not in self._claimed and self._stuck.get(f[1]) != f[0]]
+                    self._backlog = len(found)
+                for landed_at, path, camera in found:
+                    if not self._enqueue(path, camera, landed_at):
+                        break
+            self._stop.wait(self.poll_s)
+
+    def _enqueue(self, path, camera, landed_at):
+        """Queue one file under the backpressure policy; False stops this scan pass."""
+        dropped = None
+        with self._cond:
+            if len(self._queue) >= self.queue_max:
+                if self.backpressure == "pause":
+                    self._paused = True
+                    self.counters["pauses"] += 1
+                    return False
+                if self.backpressure == "block":
+                    while len(self._queue) >= self.queue_max and not self._stop.is_set():
+                        self._cond.wait(0.5)
+                    if self._stop.is_set():
+                        return False
+                else:
+                    dropped = self._queue.popleft()
+            self._queue.append((path, camera, landed_at))
+            self._claimed.add(path)
+            self._backlog = max(0, self._backlog - 1)
+            self.counters["queued"] += 1
+            self._cond.notify()
+
+        if dropped is not None:
+            self._finish(dropped, "dropped", error="Dropped by spool backpressure (drop_oldest)")
+        return True
+
+    # Processing
+
+    def _work_loop(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._stop.is_set():
+                    self._cond.wait()
+                if self._stop.is_set():
+                    return
+                item = self._queue.popleft()
+                self._cond.notify_all()  # a blocked scanner may continue
+
+            path, camera, _ = item
+            try:
+                with open(path, "rb") as f:
+                    contents = f.read()
+                result = self.process(contents, camera, os.path.basename(path))
+            except Exception as e:
+                self._finish(item, "failed", error=f"{type(e).__name__}: {e}")
+            else:
+                self._finish(item, "processed", result=result)
+
+    def _finish(self, item, outcome, result=None, error=None):
+        path, camera, landed_at = item
+        folder = os.path.join(os.path.dirname(path), "done" if outcome == "processed" else "failed")
+        stuck = False
+        try:
+            target = _move(path, folder)
+        except FileNotFoundError:
+            target = None  # removed from the spool meanwhile: nothing left to re-run
+        except OSError as e:
+            # Still in the inbox: keep it out of later scans instead of re-running it every poll
+            print(f"⚠️  Spool: could not move {path} to {folder}, leaving it in the spool: {e}")
+            target, stuck = None, True
+        try:
+            if target is not None and result is not None and self.write_results:
+                with open(target + ".json", "w") as f:
+                    json.dump(result, f)
+            elif target is not None and error is not None:
+                with open(target + ".error.txt", "w") as f:
+                    f.write(error + "\n")
+        except OSError as e:
+            print(f"⚠️  Spool: could not write the result of {target}: {e}")
+
+        now = time.time()
+        lag = max(0.0, now - landed_at)
+        SPOOL_FILES.inc(camera=camera, outcome=outcome)
+        if outcome != "dropped":
+            SPOOL_LAG_SECONDS.observe(lag, camera=camera)
+        with self._cond:
+            self._claimed.discard(path)
+            if stuck:
+                self._stuck[path] = landed_at
+            self.counters[outcome] += 1
+            if outcome != "dropped":
+                self._last_lag_s = lag
+                self._done_times.append(now)
+
+    def stats(self, window_s=60.0):
+        now = time.time()
+        with self._cond:
+            while self._done_times and now - self._done_times[0] > window_s:
+                self._done_times.popleft()
+            oldest = self._queue[0][2] if self._queue else None
+            return {
+                "dirs": [{"camera": camera, "path": path} for camera, path in self.dirs],
+                "backpressure": self.backpressure,
+                "paused": self._paused,
+                "queue": len(self._queue),
+                "queue_max": self.queue_max,
+                "in_flight": len(self._claimed) - len(self._queue),
+                "backlog": self._backlog,
+                "stuck": len(self._stuck),
+                "throughput_per_s": round(len(self._done_times) / window_s, 3),
+                "oldest_queued_lag_s": round(now - oldest, 3) if oldest is not None else 0.0,
+                "last_lag_s": round(self._last_lag_s, 3) if self._last_lag_s is not None else None,
+                **self.counters,
+            }
@@ -0,0 +1,52 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+# The backend is a flat set of modules run from backend/ (uvicorn main:app)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class ConcurrencyProbe:
+    """Wraps a stub model and records how many calls were inside it at once."""
+
+    def __init__(self, model):
+        self.model = model
+        self.names = model.names
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, source, **kwargs):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(0.02)  # long enough for an unserialized second call to overlap
+            return self.model(source, **kwargs)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+@pytest.fixture
+def stub_service(monkeypatch):
+    """
+    main with loadtest's stub models loaded in process and the scheduler
+    off; no result cache, stores or worker pool. Returns the (base, helmet)
+    ConcurrencyProbes.
+    """
+    import loadtest
+    import main
+
+    base, helmet = (ConcurrencyProbe(m) for m in loadtest.stub_models())
+    monkeypatch.setattr(main, "SCHEDULER_ENABLED", False)
+    monkeypatch.setattr(main, "load_models", lambda: (base, helmet))
+    monkeypatch.setattr(main, "warmup_models", lambda base_model, helmet_model: {})
+    for name in ("base_model", "helmet_model", "scheduler", "worker_pool", "result_cache", "evidence_store",
+                 "violation_store"):
+        monkeypatch.setattr(main, name, None)
+    main.load_in_process()
+    return base, helmet
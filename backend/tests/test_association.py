@@ -0,0 +1,140 @@
+import random
+
+import numpy as np
+import pytest
+
+from association import associate, solve_assignment
+
+
+def reference_greedy(heads, persons, motos):
+    """The nested-loop Stage 3 matcher that associate(mode="greedy") replaced."""
+    head_to_person = {}
+    for h_idx, head in enumerate(heads):
+        hcx, hcy = (head[0] + head[2]) / 2, (head[1] + head[3]) / 2
+        best_person, best_dist = -1, float("inf")
+        for p_idx, (px1, py1, px2, py2) in enumerate(persons):
+            p_h = py2 - py1
+            margin = max((px2 - px1) * 0.20, p_h * 0.20)
+            if px1 - margin <= hcx <= px2 + margin and py1 - margin <= hcy <= py1 + p_h * 0.60 + margin:
+                dist = abs(hcx - (px1 + px2) / 2) + abs(hcy - (py1 + py2) / 2)
+                if dist < best_dist:
+                    best_dist, best_person = dist, p_idx
+        if best_person >= 0:
+            head_to_person[h_idx] = best_person
+
+    head_to_moto = {}
+    for h_idx, head in enumerate(heads):
+        hcx, hcy = (head[0] + head[2]) / 2, (head[1] + head[3]) / 2
+        best_moto, best_score = -1, 0
+        for m_idx, (mx1, my1, mx2, my2) in enumerate(motos):
+            m_w, m_h = mx2 - mx1, my2 - my1
+            h_margin = m_w * 0.30
+            if hcx < mx1 - h_margin or hcx > mx2 + h_margin:
+                continue
+            if head[3] > my2 + m_h * 0.15:
+                continue
+            if head[1] < my1 - m_h * 2.0:
+                continue
+            h_dist = abs(hcx - (mx1 + mx2) / 2) / max(m_w, 1)
+            v_dist = abs(hcy - (my1 + my2) / 2) / max(m_h, 1)
+            score = 1.0 / (1.0 + h_dist + v_dist)
+            if score > best_score:
+                best_score, best_moto = score, m_idx
+        if best_moto >= 0:
+            head_to_moto[h_idx] = best_moto
+
+    person_bike = [-1] * len(persons)
+    for h_idx, m_idx in head_to_moto.items():
+        if h_idx in head_to_person:
+            person_bike[head_to_person[h_idx]] = m_idx
+
+    fallback = {}
+    for p_idx, (px1, py1, px2, py2) in enumerate(persons):
+        if person_bike[p_idx] >= 0:
+            continue
+        p_h = py2 - py1
+        p_cx, p_cy = (px1 + px2) / 2, (py1 + py2) / 2
+        best_moto, best_score = -1, 0
+        for m_idx, (mx1, my1, mx2, my2) in enumerate(motos):
+            m_w, m_h = mx2 - mx1, my2 - my1
+            if p_h > m_h * 1.5:
+                continue
+            h_margin = m_w * 0.30
+            if p_cx < mx1 - h_margin or p_cx > mx2 + h_margin:
+                continue
+            if abs(py2 - my2) > m_h * 0.50:
+                continue
+            v_ratio = max(0, min(py2, my2) - max(py1, my1)) / max(p_h, 1)
+            if v_ratio < 0.30:
+                continue
+            h_dist = abs(p_cx - (mx1 + mx2) / 2) / max(m_w, 1)
+            v_dist = abs(p_cy - (my1 + my2) / 2) / max(m_h, 1)
+            score = v_ratio / (1.0 + h_dist + v_dist)
+            if score > best_score:
+                best_score, best_moto = score, m_idx
+        if best_moto >= 0 and best_score > 0.1:
+            fallback[p_idx] = (best_moto, best_score)
+    return head_to_person, head_to_moto, fallback
+
+
+def random_scene(rng):
+    """Motorcycles with riders and heads on a 10 px grid; duplicated boxes make score ties."""
+    motos, persons, heads = [], [], []
+    for _ in range(rng.randrange(0, 6)):
+        x, y = rng.randrange(0, 400, 10), rng.randrange(100, 400, 10)
+        w = rng.randrange(60, 130, 10)
+        motos.append([x, y, x + w, y + w * 0.8])
+        if rng.random() < 0.3:
+            motos.append(list(motos[-1]))
+        for r in range(rng.randrange(0, 4)):
+            px = x + rng.randrange(-20, 40, 10) + r * 20
+            ph = rng.randrange(60, 150, 10)
+            person = [px, y + w * 0.6 - ph, px + 40, y + w * 0.6]
+            persons.append(person)
+            if rng.random() < 0.7:
+                hx, hy = px + rng.randrange(0, 20, 10), person[1] + rng.randrange(-10, 20, 10)
+                heads.append([hx, hy, hx + 20, hy + 20])
+                if rng.random() < 0.2:
+                    heads.append(list(heads[-1]))
+    for _ in range(rng.randrange(0, 4)):  # stray heads and pedestrians
+        hx, hy = rng.randrange(0, 500, 10), rng.randrange(0, 500, 10)
+        heads.append([hx, hy, hx + 20, hy + 20])
+        px, py = rng.randrange(0, 500, 10), rng.randrange(0, 300, 10)
+        persons.append([px, py, px + 40, py + rng.randrange(80, 200, 10)])
+    return heads, persons, motos
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_greedy_matches_nested_loops(seed):
+    rng = random.Random(seed)
+    for _ in range(200):
+        heads, persons, motos = random_scene(rng)
+        exp_hp, exp_hm, exp_fb = reference_greedy(heads, persons, motos)
+        got_hp, got_hm, got_fb = associate(heads, persons, motos, mode="greedy")
+        assert got_hp == exp_hp
+        assert got_hm == exp_hm
+        assert got_fb.keys() == exp_fb.keys()
+        for p, (m, score) in exp_fb.items():
+            assert got_fb[p][0] == m
+            assert got_fb[p][1] == pytest.approx(score)
+
+
+def test_solve_assignment_hand_checked():
+    cost = np.array([[4.0, 1.0, 3.0],
+                     [2.0, 0.0, 5.0],
+                     [3.0, 2.0, 2.0]])
+    # Total 1 + 2 + 2 = 5; every other permutation costs 6 or more
+    assert solve_assignment(cost).tolist() == [1, 0, 2]
+    # More columns than rows: row 0 gives up its cheapest column to row 1
+    assert solve_assignment(np.array([[1.0, 2.0, 9.0],
+                                      [1.0, 8.0, 9.0]])).tolist() == [1, 0]
+
+
+def test_optimal_respects_seat_limit():
+    motos = [[0, 100, 100, 180], [100, 100, 200, 180]]
+    head_a = [80, 60, 100, 80]   # gates both bikes, closer to bike 0
+    head_b = [50, 60, 70, 80]    # gates only bike 0
+    _, greedy, _ = associate([head_a, head_b], [], motos, mode="greedy")
+    assert greedy == {0: 0, 1: 0}
+    _, optimal, _ = associate([head_a, head_b], [], motos, mode="optimal", max_riders=1)
+    assert optimal == {0: 1, 1: 0}
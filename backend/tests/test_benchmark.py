@@ -0,0 +1,36 @@
+import json
+import sys
+
+import pytest
+
+import benchmark
+
+
+def run_main(monkeypatch, tmp_path, baseline_ms):
+    """benchmark.main() on one small scene against a baseline where every stage took `baseline_ms`."""
+    baseline = tmp_path / "baseline.json"
+    stages = {stage: {"median_ms": baseline_ms, "p95_ms": baseline_ms} for stage in benchmark.STAGES}
+    baseline.write_text(json.dumps({"results": [{"vehicles": 5, "stages": stages}]}))
+    monkeypatch.setattr(sys, "argv", ["benchmark.py", "--vehicles", "5", "--repeat", "2", "--size", "640x360",
+                                      "--baseline", str(baseline), "--noise-floor-ms", "0"])
+    benchmark.main()
+
+
+def test_regressed_stage_exits_1(monkeypatch, tmp_path, capsys):
+    with pytest.raises(SystemExit) as exc:
+        run_main(monkeypatch, tmp_path, baseline_ms=0.0)
+    assert exc.value.code == 1
+    assert "stage regression(s)" in capsys.readouterr().out
+
+
+def test_no_regression_returns_normally(monkeypatch, tmp_path, capsys):
+    run_main(monkeypatch, tmp_path, baseline_ms=1e6)
+    assert "No stage regressed" in capsys.readouterr().out
+
+
+def test_missing_baseline_exits_2(monkeypatch, tmp_path):
+    monkeypatch.setattr(sys, "argv", ["benchmark.py", "--vehicles", "1", "--repeat", "0", "--size", "320x240",
+                                      "--baseline", str(tmp_path / "absent.json")])
+    with pytest.raises(SystemExit) as exc:
+        benchmark.main()
+    assert exc.value.code == 2
@@ -0,0 +1,26 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import loadtest
+import main
+
+
+def test_concurrent_detects_never_share_a_model_call(stub_service):
+    base, helmet = stub_service
+    data = loadtest.load_inputs(None, 1)[0]
+    expected = main.detect_from_bytes(data)
+
+    start = threading.Barrier(2)
+
+    def detect():
+        start.wait()
+        return main.detect_from_bytes(data)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        results = [f.result() for f in [pool.submit(detect), pool.submit(detect)]]
+
+    assert base.max_active == 1
+    assert helmet.max_active == 1
+    for result in results:
+        assert result["violations"] == expected["violations"]
+        assert result["detections"] == expected["detections"]
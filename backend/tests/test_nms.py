@@ -0,0 +1,60 @@
+import random
+
+import pytest
+
+from geometry import calculate_iou
+from nms import apply_nms
+
+
+def reference_nms(detections, iou_threshold, class_aware=False, per_source=False):
+    """The original pop(0) NMS (safety-first sort), with the class / source grouping added."""
+    def group(d):
+        return (d["class_id"] if class_aware else None, d["source"] if per_source else None)
+
+    sorted_dets = sorted(detections, key=lambda x: (x.get("is_no_helmet", False), x["confidence"]), reverse=True)
+    keep = []
+    while sorted_dets:
+        best = sorted_dets.pop(0)
+        keep.append(best)
+        sorted_dets = [d for d in sorted_dets
+                       if group(d) != group(best) or calculate_iou(best["box"], d["box"]) < iou_threshold]
+    return keep
+
+
+def random_detections(rng, n):
+    """Heads on a coarse grid with few distinct confidences, so boxes and scores often tie."""
+    dets = []
+    for _ in range(n):
+        if dets and rng.random() < 0.15:
+            dets.append(dict(rng.choice(dets)))   # exact duplicate box and score
+            continue
+        x1, y1 = rng.randrange(0, 200, 4), rng.randrange(0, 200, 4)
+        w, h = rng.randrange(0, 60, 4), rng.randrange(0, 60, 4)  # includes zero-area boxes
+        class_id = rng.choice([0, 1])
+        dets.append({
+            "box": [x1, y1, x1 + w, y1 + h],
+            "confidence": rng.choice([0.3, 0.5, 0.5, 0.7, 0.9]),
+            "class_id": class_id,
+            "is_no_helmet": class_id == 1,
+            "source": rng.choice(["full", "roi_0", "roi_1"]),
+        })
+    return dets
+
+
+@pytest.mark.parametrize("per_source", [False, True])
+@pytest.mark.parametrize("class_aware", [False, True])
+@pytest.mark.parametrize("iou_threshold", [0.30, 0.40, 0.45])
+def test_apply_nms_matches_reference(iou_threshold, class_aware, per_source):
+    rng = random.Random(f"{iou_threshold}-{class_aware}-{per_source}")
+    for _ in range(200):
+        dets = random_detections(rng, rng.randrange(0, 40))
+        expected = reference_nms(dets, iou_threshold, class_aware, per_source)
+        got = apply_nms(dets, iou_threshold, class_aware=class_aware, per_source=per_source)
+        assert [id(d) for d in got] == [id(d) for d in expected]
+
+
+def test_apply_nms_threshold_is_inclusive():
+    a = {"box": [0, 0, 10, 10], "confidence": 0.9, "class_id": 0, "source": "full"}
+    b = {"box": [0, 0, 10, 5], "confidence": 0.8, "class_id": 0, "source": "full"}  # IoU exactly 0.5
+    assert apply_nms([a, b], 0.5) == reference_nms([a, b], 0.5) == [a]
+    assert apply_nms([a, b], 0.51) == reference_nms([a, b], 0.51) == [a, b]
@@ -0,0 +1,30 @@
+import uuid
+
+import loadtest
+import main
+from change_gate import gate_stats
+from result_cache import ResultCache
+from track_cache import cache_stats
+
+
+def test_camera_frames_bypass_the_result_cache(stub_service, monkeypatch):
+    monkeypatch.setattr(main, "result_cache", ResultCache())
+    monkeypatch.setattr(main, "cache_fingerprint", "test")
+    monkeypatch.setattr(main, "CHANGE_GATE_ENABLED", True)
+    monkeypatch.setattr(main, "TRACK_CACHE_ENABLED", True)
+    data = loadtest.load_inputs(None, 1)[0]
+    cam_a, cam_b = f"a-{uuid.uuid4().hex[:8]}", f"b-{uuid.uuid4().hex[:8]}"
+
+    # Uploads without a camera are still served from the cache
+    main.detect_from_bytes(data)
+    assert main.detect_from_bytes(data).get("cached") is True
+
+    result_a = main.detect_from_bytes(data, camera=cam_a)
+    result_b = main.detect_from_bytes(data, camera=cam_b)
+    assert not result_a.get("cached") and not result_b.get("cached")
+    assert result_b["change_gate"]["skipped"] is False
+
+    # Camera B's own gate and track cache saw its frame
+    assert gate_stats()[cam_b]["processed"] == 1
+    assert cam_b in cache_stats()
+    assert result_b["violations"] == result_a["violations"]
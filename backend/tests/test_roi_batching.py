@@ -0,0 +1,104 @@
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pytest
+
+from benchmark import StubHelmetModel, make_scene
+from config import HELMET_MODEL_CONF, ROI_ABOVE_EXPAND, ROI_EXPAND_RATIO
+from geometry import expand_box
+from roi_batching import make_head_detection, result_arrays, run_helmet_batched
+
+
+class RecordingModel(StubHelmetModel):
+    """Finds the painted heads in whatever it is given and records each call's inputs."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, source, conf=0.08, imgsz=640, **kwargs):
+        images = source if isinstance(source, list) else [source]
+        self.calls.append({"shapes": [img.shape for img in images], "conf": conf, "imgsz": imgsz})
+        return super().__call__(images, conf=conf, imgsz=imgsz)
+
+
+def per_crop_reference(model, img, roi_box, source_tag):
+    """The old path: model.predict on the raw crop, boxes shifted by the crop origin."""
+    x1, y1, x2, y2 = roi_box if roi_box is not None else (0, 0, img.shape[1], img.shape[0])
+    xyxy, confs, clss = result_arrays(model(img[y1:y2, x1:x2])[0])
+    return [make_head_detection([bx1 + x1, by1 + y1, bx2 + x1, by2 + y1], conf, cls_id, model.names, source_tag)
+            for (bx1, by1, bx2, by2), conf, cls_id in zip(xyxy.tolist(), confs.tolist(), clss.tolist())]
+
+
+def assert_same_detections(got, expected, tol):
+    assert len(got) == len(expected)
+    remaining = list(got)
+    for exp in expected:
+        match = next((g for g in remaining if g["class_id"] == exp["class_id"] and g["source"] == exp["source"]
+                      and np.allclose(g["box"], exp["box"], atol=tol)), None)
+        assert match is not None, f"no batched match for {exp}"
+        remaining.remove(match)
+
+
+@pytest.fixture(scope="module")
+def scene():
+    img, _, motorcycles = make_scene(12, 1280, 720, seed=3)
+    h, w = img.shape[:2]
+    rois = [expand_box(m, w, h, ratio=ROI_EXPAND_RATIO, ratio_above=ROI_ABOVE_EXPAND) for m in motorcycles]
+    return img, rois
+
+
+def test_batched_rois_match_per_crop_inference(scene):
+    img, rois = scene
+    model = RecordingModel()
+    regions = [(roi, 640, f"roi_moto_{i}") for i, roi in enumerate(rois)]
+    got = run_helmet_batched(model, img, regions, batch_size=5)
+
+    for (roi, _, tag), dets in zip(regions, got):
+        # Letterboxing upsamples each ~250 px crop; blob edges may move by a resampled pixel
+        assert_same_detections(dets, per_crop_reference(model, img, roi, tag), tol=1.5)
+    assert sum(len(d) for d in got) > 0
+
+
+def test_last_partial_batch(scene):
+    img, rois = scene
+    model = RecordingModel()
+    regions = [(roi, 640, f"roi_moto_{i}") for i, roi in enumerate(rois)]
+    got = run_helmet_batched(model, img, regions, batch_size=5)
+
+    assert [len(call["shapes"]) for call in model.calls] == [5, 5, 2]
+    assert all(shape == (640, 640, 3) for call in model.calls for shape in call["shapes"])
+    assert all(call["conf"] == HELMET_MODEL_CONF and call["imgsz"] == 640 for call in model.calls)
+    # The regions of the last, partial batch still get their own detections
+    for (roi, _, tag), dets in list(zip(regions, got))[10:]:
+        assert_same_detections(dets, per_crop_reference(RecordingModel(), img, roi, tag), tol=1.5)
+
+
+def test_mixed_sizes_are_batched_per_imgsz(scene):
+    img, rois = scene
+    model = RecordingModel()
+    regions = [(roi, 320 if i % 2 else 640, f"roi_moto_{i}") for i, roi in enumerate(rois[:6])]
+    run_helmet_batched(model, img, regions, batch_size=16)
+    assert sorted((call["imgsz"], len(call["shapes"])) for call in model.calls) == [(320, 3), (640, 3)]
+
+
+def test_full_image_region_runs_on_the_preview(scene):
+    img, _ = scene
+    model = RecordingModel()
+    # A frame whose preview is a 2× downscaled decode, like decode.DecodedImage
+    preview = cv2.resize(img, (img.shape[1] // 2, img.shape[0] // 2), interpolation=cv2.INTER_NEAREST)
+    frame = SimpleNamespace(preview=preview, preview_scale=(2.0, 2.0), width=img.shape[1], height=img.shape[0])
+    got = run_helmet_batched(model, frame, [(None, 640, "full_image")])
+
+    assert model.calls[0]["shapes"] == [(640, 640, 3)]
+    expected = per_crop_reference(RecordingModel(), preview, None, "full_image")
+    for det in expected:
+        det["box"] = [c * 2.0 for c in det["box"]]
+    assert len(expected) > 0
+    assert_same_detections(got[0], expected, tol=2.0)
+
+
+def test_full_image_region_of_a_plain_array(scene):
+    img, _ = scene
+    got = run_helmet_batched(RecordingModel(), img, [(None, 1280, "full_image")])
+    assert_same_detections(got[0], per_crop_reference(RecordingModel(), img, None, "full_image"), tol=0.0)
@@ -0,0 +1,31 @@
+from config import ROI_HEAD_FRACTION
+from roi_planner import plan_rois, roi_bucket
+
+BUCKETS = (320, 480, 640)
+
+
+def bucket(side, kind):
+    return roi_bucket([0, 0, side, side], ROI_HEAD_FRACTION[kind] * side, BUCKETS)
+
+
+def test_bucket_follows_native_side():
+    assert bucket(100, "moto") == 320     # capped at 2× upscale
+    assert bucket(300, "moto") == 480     # raised so the expected head reaches the target size
+    assert bucket(600, "moto") == 640     # smallest bucket that does not downscale
+    assert bucket(200, "person") == 320
+    assert bucket(400, "person") == 480
+    assert bucket(1500, "person") == 640  # larger than every bucket
+
+
+def test_large_and_small_crops_of_one_kind_get_different_buckets():
+    small_moto = [100, 300, 215, 392]     # expands to a ~250 px ROI
+    large_moto = [1000, 400, 1250, 600]   # expands to a ~550 px ROI
+    plan = plan_rois([small_moto, large_moto], [], 1920, 1080, merge=False)
+    sizes = {tile["source"]: tile["imgsz"] for tile in plan["tiles"]}
+    assert sizes["roi_moto_0"] < sizes["roi_moto_1"]
+
+    small_person = [200, 600, 260, 700]   # ~70 px head ROI
+    large_person = [800, 100, 1100, 800]  # ~385 px head ROI
+    plan = plan_rois([], [small_person, large_person], 1920, 1080, merge=False)
+    sizes = {tile["source"]: tile["imgsz"] for tile in plan["tiles"]}
+    assert sizes["roi_person_0"] < sizes["roi_person_1"]
@@ -0,0 +1,48 @@
+import numpy as np
+
+from video import analyze_frames
+
+MOTO = [400, 300, 700, 600]
+FRONT, BACK = [420, 150, 540, 450], [560, 140, 680, 440]
+
+
+def no_helmet(person_box, person_id, severity="high"):
+    return {"type": "no_helmet", "severity": severity, "person_box": person_box, "motorcycle_box": MOTO,
+            "person_id": person_id, "motorcycle_id": 0}
+
+
+def replay(results):
+    """analyze_frames over canned per-frame pipeline results."""
+    frames = ((i, i / 10, np.zeros((8, 8, 3), np.uint8)) for i in range(len(results)))
+    it = iter(results)
+    events = list(analyze_frames(frames, None, None, run=lambda img, mode=None: next(it)))
+    return [e for e in events if e["event"] == "violation"], events[-1]
+
+
+def frame(*violations):
+    return {"motorcycles": [{"box": MOTO}], "violations": list(violations)}
+
+
+def test_two_riders_on_one_bike_are_both_reported():
+    violations, summary = replay([frame(no_helmet(FRONT, 0), no_helmet(BACK, 1))] * 3)
+    assert [v["person_box"] for v in violations] == [FRONT, BACK]
+    assert violations[0]["rider_track_id"] != violations[1]["rider_track_id"]
+    assert summary["unique_violations"] == 2
+    assert summary["raw_violations"] == 6
+
+
+def test_same_rider_is_not_re_emitted_when_indices_change():
+    # Rider 1 shows up alone first, then both riders with swapped person ids
+    violations, summary = replay([frame(no_helmet(BACK, 0)),
+                                  frame(no_helmet(FRONT, 0), no_helmet(BACK, 1)),
+                                  frame(no_helmet(BACK, 0), no_helmet(FRONT, 1))])
+    assert [(v["frame_index"], v["person_box"]) for v in violations] == [(0, BACK), (1, FRONT)]
+    assert summary["unique_violations"] == 2
+
+
+def test_triple_riding_is_reported_once_per_bike():
+    triple = {"type": "triple_riding", "severity": "high", "rider_count": 3, "motorcycle_box": MOTO,
+              "person_boxes": [FRONT, BACK, BACK], "motorcycle_id": 0}
+    violations, _ = replay([frame(triple)] * 2)
+    assert len(violations) == 1
+    assert "rider_track_id" not in violations[0]
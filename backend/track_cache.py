@@ -0,0 +1,129 @@
+import threading
+import time
+from collections import OrderedDict
+
+from config import (
+    TRACK_CACHE_MIN_CONF, TRACK_CACHE_DECAY, TRACK_CACHE_TTL_S, TRACK_CACHE_MAX_CAMERAS,
+)
+from metrics import TRACK_CACHE_ROIS
+from tracking import IoUTracker
+
+_caches = OrderedDict()
+_caches_lock = threading.Lock()
+
+
+# ── Per-Track Helmet Status Cache ────────────────────────────────────────────
+
+class TrackCache:
+    """
+    Helmet status per motorcycle track for one camera.
+
+    Stage 1 motorcycles are tracked across frames (IoU + Kalman step,
+    tracking.py). After a motorcycle's ROI pass, its head detections (in
+    coordinates relative to the motorcycle box), rider count and confidence
+    — the weakest head it kept — are stored on its track. On later frames
+    the ROI pass is skipped and the stored heads are re-projected onto the
+    new box, as long as the entry is younger than `ttl_s` and its
+    confidence, decayed by `decay` per frame, is still ≥ `min_conf`. New,
+    low-confidence and expired tracks always get a fresh ROI pass.
+    """
+
+    def __init__(self, min_conf=TRACK_CACHE_MIN_CONF, decay=TRACK_CACHE_DECAY, ttl_s=TRACK_CACHE_TTL_S):
+        self.min_conf = min_conf
+        self.decay = decay
+        self.ttl_s = ttl_s
+        self.tracker = IoUTracker(kalman=True)
+        self.entries = {}       # track_id → {"heads", "confidence", "rider_count", "helmet_status", "frame", "time"}
+        self.lock = threading.Lock()
+        self.counters = {"reused": 0, "new": 0, "low_confidence": 0, "expired": 0}
+
+    def lookup(self, moto_boxes, now=None):
+        """
+        Advance the tracker by one frame. Returns (track id per motorcycle,
+        {motorcycle index: heads re-projected onto its current box}) for the
+        motorcycles whose cached status can be reused.
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            track_ids = self.tracker.update(moto_boxes)
+            frame = self.tracker.frame_idx
+            for t in [t for t in self.entries if t not in self.tracker.tracks]:
+                del self.entries[t]
+
+            reuse = {}
+            for m_idx, (track_id, box) in enumerate(zip(track_ids, moto_boxes)):
+                entry = self.entries.get(track_id)
+                if entry is None:
+                    outcome = "new"
+                elif now - entry["time"] > self.ttl_s:
+                    outcome = "expired"
+                elif entry["confidence"] * self.decay ** (frame - entry["frame"]) < self.min_conf:
+                    outcome = "low_confidence"
+                else:
+                    outcome = "reused"
+                    reuse[m_idx] = [_project(head, box, track_id) for head in entry["heads"]]
+                self.counters[outcome] += 1
+                TRACK_CACHE_ROIS.inc(outcome=outcome)
+        return track_ids, reuse
+
+    def store(self, track_id, moto_box, heads, rider_count, now=None):
+        """Cache the heads found by a motorcycle's ROI pass (already confidence-filtered)."""
+        if any(h["is_no_helmet"] for h in heads):
+            status = "no_helmet"
+        else:
+            status = "helmet" if heads else "unknown"
+        with self.lock:
+            if track_id not in self.tracker.tracks:
+                return
+            self.entries[track_id] = {
+                "heads": [_relative(head, moto_box) for head in heads],
+                "confidence": min((h["confidence"] for h in heads), default=0.0),
+                "rider_count": rider_count,
+                "helmet_status": status,
+                "frame": self.tracker.frame_idx,
+                "time": time.time() if now is None else now,
+            }
+
+    def stats(self):
+        with self.lock:
+            lookups = sum(self.counters.values())
+            return {
+                **self.counters,
+                "reuse_rate": round(self.counters["reused"] / lookups, 4) if lookups else 0.0,
+                "live_tracks": len(self.tracker.tracks),
+                "cached_tracks": len(self.entries),
+            }
+
+
+def _relative(head, box):
+    x1, y1, x2, y2 = box
+    w, h = max(x2 - x1, 1e-6), max(y2 - y1, 1e-6)
+    hx1, hy1, hx2, hy2 = head["box"]
+    return {**head, "box": [(hx1 - x1) / w, (hy1 - y1) / h, (hx2 - x1) / w, (hy2 - y1) / h]}
+
+
+def _project(head, box, track_id):
+    x1, y1, x2, y2 = box
+    w, h = x2 - x1, y2 - y1
+    rx1, ry1, rx2, ry2 = head["box"]
+    return {**head, "box": [x1 + rx1 * w, y1 + ry1 * h, x1 + rx2 * w, y1 + ry2 * h],
+            "source": f"track_{track_id}"}
+
+
+# ── Camera Registry ──────────────────────────────────────────────────────────
+
+def camera_cache(camera):
+    """The TrackCache of `camera` (the least recently used camera is evicted past TRACK_CACHE_MAX_CAMERAS)."""
+    with _caches_lock:
+        cache = _caches.get(camera)
+        if cache is None:
+            cache = _caches[camera] = TrackCache()
+            while len(_caches) > TRACK_CACHE_MAX_CAMERAS:
+                _caches.popitem(last=False)
+        _caches.move_to_end(camera)
+        return cache
+
+
+def cache_stats():
+    with _caches_lock:
+        return {camera: cache.stats() for camera, cache in _caches.items()}
@@ -0,0 +1,135 @@
+import numpy as np
+
+from config import TRACK_IOU_THRESHOLD, TRACK_MAX_AGE, TRACK_CENTROID_GATE, TRACK_KALMAN_Q, TRACK_KALMAN_R
+from nms import iou_matrix
+
+
+# ── Kalman Step ──────────────────────────────────────────────────────────────
+
+class BoxKalman:
+    """
+    Constant-velocity Kalman filter over a box's (cx, cy, w, h), one
+    independent position/velocity filter per coordinate. predict() gives
+    where the box should be on the next analysed frame, so fast movers still
+    overlap their track.
+    """
+
+    def __init__(self, box, q=TRACK_KALMAN_Q, r=TRACK_KALMAN_R):
+        self.x = np.zeros((4, 2))
+        self.x[:, 0] = self._measure(box)
+        self.p = np.tile(np.diag([r, 10.0 * r]), (4, 1, 1))
+        self.q, self.r = q, r
+
+    @staticmethod
+    def _measure(box):
+        x1, y1, x2, y2 = box
+        return np.array([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1])
+
+    def predict(self):
+        f = np.array([[1.0, 1.0], [0.0, 1.0]])
+        self.x = self.x @ f.T
+        self.p = f @ self.p @ f.T + np.diag([self.q, self.q])
+        return self.box()
+
+    def update(self, box):
+        s = self.p[:, 0, 0] + self.r
+        k = self.p[:, :, 0] / s[:, None]
+        self.x += k * (self._measure(box) - self.x[:, 0])[:, None]
+        self.p -= k[:, :, None] * self.p[:, None, 0, :]
+
+    def box(self):
+        cx, cy, w, h = self.x[:, 0]
+        w, h = max(w, 1.0), max(h, 1.0)
+        return [cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2]
+
+
+# ── Motorcycle Tracking ──────────────────────────────────────────────────────
+
+class IoUTracker:
+    """
+    Minimal multi-object tracker for consecutive frames of one camera.
+    Each frame's boxes are matched to live tracks greedily by IoU (highest
+    first, at least `iou_threshold`); unmatched boxes start new tracks and
+    tracks unseen for more than `max_age` frames are dropped.
+
+    With `kalman`, boxes are matched against each track's predicted box
+    (BoxKalman), and boxes left over after IoU matching may still join a
+    track whose center is within `centroid_gate` × its diagonal.
+    """
+
+    def __init__(self, iou_threshold=TRACK_IOU_THRESHOLD, max_age=TRACK_MAX_AGE, kalman=False,
+                 centroid_gate=TRACK_CENTROID_GATE):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.kalman = kalman
+        self.centroid_gate = centroid_gate
+        self.tracks = {}        # track_id -> {"box", "last_seen", "hits"} (+ "filter" with kalman)
+        self.frame_idx = -1
+        self._next_id = 0
+
+    @property
+    def total_tracks(self):
+        """Number of distinct tracks started so far."""
+        return self._next_id
+
+    def update(self, boxes):
+        """Advance one frame. Returns the track id of each box, in order."""
+        self.frame_idx += 1
+        track_ids = list(self.tracks)
+        assigned = [-1] * len(boxes)
+
+        if self.kalman:
+            for t in track_ids:
+                self.tracks[t]["predicted"] = self.tracks[t]["filter"].predict()
+        key = "predicted" if self.kalman else "box"
+
+        if track_ids and boxes:
+            box_arr = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+            track_arr = np.asarray([self.tracks[t][key] for t in track_ids], dtype=np.float64)
+            ious = iou_matrix(box_arr, track_arr)
+            # Greedy: best remaining (box, track) pair first
+            used_tracks = set()
+            for flat in np.argsort(-ious, axis=None, kind="stable"):
+                b, t = divmod(int(flat), len(track_ids))
+                if ious[b, t] < self.iou_threshold:
+                    break
+                if assigned[b] >= 0 or t in used_tracks:
+                    continue
+                assigned[b] = track_ids[t]
+                used_tracks.add(t)
+
+            if self.kalman and self.centroid_gate > 0:
+                self._match_centroids(box_arr, track_arr, track_ids, assigned, used_tracks)
+
+        for b, box in enumerate(boxes):
+            if assigned[b] < 0:
+                assigned[b] = self._next_id
+                self.tracks[self._next_id] = {"box": box, "last_seen": self.frame_idx, "hits": 0}
+                if self.kalman:
+                    self.tracks[self._next_id]["filter"] = BoxKalman(box)
+                self._next_id += 1
+            elif self.kalman:
+                self.tracks[assigned[b]]["filter"].update(box)
+            track = self.tracks[assigned[b]]
+            track["box"] = box
+            track["last_seen"] = self.frame_idx
+            track["hits"] += 1
+
+        for t in [t for t, tr in self.tracks.items() if self.frame_idx - tr["last_seen"] > self.max_age]:
+            del self.tracks[t]
+        return assigned
+
+    def _match_centroids(self, box_arr, track_arr, track_ids, assigned, used_tracks):
+        """Greedy nearest-center matching of the boxes IoU left unassigned."""
+        centers = (box_arr[:, :2] + box_arr[:, 2:]) / 2
+        track_centers = (track_arr[:, :2] + track_arr[:, 2:]) / 2
+        diag = np.hypot(track_arr[:, 2] - track_arr[:, 0], track_arr[:, 3] - track_arr[:, 1])
+        dist = np.linalg.norm(centers[:, None, :] - track_centers[None, :, :], axis=2) / np.maximum(diag, 1.0)
+        for flat in np.argsort(dist, axis=None, kind="stable"):
+            b, t = divmod(int(flat), len(track_ids))
+            if dist[b, t] > self.centroid_gate:
+                break
+            if assigned[b] >= 0 or t in used_tracks:
+                continue
+            assigned[b] = track_ids[t]
+            used_tracks.add(t)
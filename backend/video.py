@@ -0,0 +1,239 @@
+import json
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from config import VIDEO_FRAME_STRIDE, VIDEO_DECODE_QUEUE, TRACK_CACHE_ENABLED
+from pipeline import run_pipeline
+from track_cache import TrackCache
+from tracking import IoUTracker
+
+JPEG_SOI = b"\xff\xd8"
+JPEG_EOI = b"\xff\xd9"
+
+
+# ── Frame Sources ────────────────────────────────────────────────────────────
+# Each source yields (frame_index, timestamp_s, RGB frame) for every
+# `stride`-th frame, skipping the others as cheaply as the format allows.
+
+def iter_video_file(path, stride=VIDEO_FRAME_STRIDE):
+    """Frames of a video file decoded with OpenCV (skipped frames are grabbed, not decoded)."""
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise ValueError("Could not open video")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 0
+    try:
+        frame_idx = 0
+        while cap.grab():
+            if frame_idx % stride == 0:
+                ok, frame = cap.retrieve()
+                if not ok:
+                    break
+                timestamp = frame_idx / fps if fps > 0 else None
+                yield frame_idx, timestamp, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            frame_idx += 1
+    finally:
+        cap.release()
+
+
+def iter_mjpeg_stream(stream, stride=VIDEO_FRAME_STRIDE, chunk_size=1 << 16):
+    """
+    Frames of an MJPEG stream (multipart or plain concatenated JPEGs),
+    split on JPEG start/end markers. Skipped frames are never decoded.
+    """
+    buf = b""
+    frame_idx = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        buf += chunk
+        while True:
+            start = buf.find(JPEG_SOI)
+            if start < 0:
+                buf = buf[-1:]
+                break
+            end = buf.find(JPEG_EOI, start + 2)
+            if end < 0:
+                buf = buf[start:]
+                break
+            jpeg, buf = buf[start:end + 2], buf[end + 2:]
+            if frame_idx % stride == 0:
+                frame = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+                if frame is not None:
+                    yield frame_idx, None, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            frame_idx += 1
+
+
+def iter_raw_stream(stream, width, height, stride=VIDEO_FRAME_STRIDE):
+    """Frames of a raw packed RGB24 stream of fixed width × height."""
+    if not width or not height:
+        raise ValueError("Raw streams need width and height")
+    frame_bytes = width * height * 3
+    frame_idx = 0
+    while True:
+        data = stream.read(frame_bytes)
+        if len(data) < frame_bytes:
+            break
+        if frame_idx % stride == 0:
+            yield frame_idx, None, np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3).copy()
+        frame_idx += 1
+
+
+def open_frame_source(source, fmt="video", stride=VIDEO_FRAME_STRIDE, width=None, height=None):
+    """
+    Frame iterator for `source` — a file path or a binary file-like object.
+    fmt is "video" (any container OpenCV can read), "mjpeg" or "raw".
+    """
+    stride = max(1, int(stride))
+    if fmt == "video":
+        if isinstance(source, (str, os.PathLike)):
+            return iter_video_file(source, stride)
+        return _iter_video_fileobj(source, stride)
+    if fmt not in ("mjpeg", "raw"):
+        raise ValueError(f"Unknown frame format: {fmt}")
+
+    def stream_frames():
+        stream = open(source, "rb") if isinstance(source, (str, os.PathLike)) else source
+        try:
+            if fmt == "mjpeg":
+                yield from iter_mjpeg_stream(stream, stride)
+            else:
+                yield from iter_raw_stream(stream, width, height, stride)
+        finally:
+            if stream is not source:
+                stream.close()
+    return stream_frames()
+
+
+def _iter_video_fileobj(fileobj, stride):
+    """OpenCV needs a path — spool a file-like video to a temp file first."""
+    tmp = tempfile.NamedTemporaryFile(suffix=".video", delete=False)
+    try:
+        with tmp:
+            shutil.copyfileobj(fileobj, tmp)
+        yield from iter_video_file(tmp.name, stride)
+    finally:
+        os.unlink(tmp.name)
+
+
+def prefetch(frames, maxsize=VIDEO_DECODE_QUEUE):
+    """
+    Decode `frames` in a background thread into a bounded queue, so the next
+    frames are being decoded while the current one runs through inference.
+    """
+    q = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def worker():
+        try:
+            for item in frames:
+                if not put(item):
+                    return
+        except Exception as e:
+            put(e)
+        finally:
+            put(done)
+
+    thread = threading.Thread(target=worker, name="frame-decoder", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = q.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+# ── Temporal Analysis ────────────────────────────────────────────────────────
+
+def analyze_frames(frames, base_model, helmet_model, mode=None, run=None):
+    """
+    Run the detection pipeline over a frame iterator and yield event dicts.
+
+    Motorcycles are tracked across frames, and so are the riders flagged
+    without a helmet (by their person box, or head box when no person
+    matched). Each violation is reported once per (motorcycle track, rider
+    track, type, severity). The same rider seen on later frames is not
+    re-emitted, but two riders on one bike are reported separately. Events: "violation" as they are found, then a
+    final "summary". `mode` is the cascade mode used for every frame.
+    `run(img, mode=...)` replaces the in-process pipeline call (e.g. with
+    WorkerPool.run when inference lives in worker processes). In-process
+    runs keep a per-stream TrackCache, so motorcycles already classified
+    with confidence skip their ROI pass on the following frames.
+    """
+    t_start = time.time()
+    tracker = IoUTracker()
+    rider_tracker = IoUTracker()
+    track_cache = TrackCache() if TRACK_CACHE_ENABLED and run is None else None
+    reported = set()
+    n_frames = 0
+    n_raw_violations = 0
+
+    for frame_idx, timestamp, img_np in prefetch(frames):
+        if run is None:
+            result = run_pipeline(img_np, base_model, helmet_model, mode=mode, track_cache=track_cache)
+        else:
+            result = run(img_np, mode=mode)
+        n_frames += 1
+        track_ids = tracker.update([m["box"] for m in result["motorcycles"]])
+        rider_ids = iter(rider_tracker.update([v["person_box"] for v in result["violations"] if "person_box" in v]))
+
+        for violation in result["violations"]:
+            n_raw_violations += 1
+            track_id = track_ids[violation["motorcycle_id"]]
+            rider_id = next(rider_ids) if "person_box" in violation else None
+            key = (track_id, rider_id, violation["type"], violation["severity"])
+            if key in reported:
+                continue
+            reported.add(key)
+            yield {
+                "event": "violation",
+                "frame_index": frame_idx,
+                "timestamp_s": timestamp,
+                "track_id": track_id,
+                **({"rider_track_id": rider_id} if rider_id is not None else {}),
+                **violation,
+            }
+
+    yield {
+        "event": "summary",
+        "frames_analyzed": n_frames,
+        "motorcycle_tracks": tracker.total_tracks,
+        "raw_violations": n_raw_violations,
+        "unique_violations": len(reported),
+        "processing_time_ms": round((time.time() - t_start) * 1000),
+    }
+
+
+def analyze_video(source, base_model, helmet_model, fmt="video", stride=VIDEO_FRAME_STRIDE, width=None, height=None,
+                  mode=None, run=None):
+    """In-process API: de-duplicated violation events for a video file or frame stream."""
+    return analyze_frames(open_frame_source(source, fmt, stride, width, height), base_model, helmet_model, mode, run)
+
+
+def ndjson_lines(events):
+    """Serialize event dicts as newline-delimited JSON."""
+    for event in events:
+        yield json.dumps(event) + "\n"
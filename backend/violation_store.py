@@ -0,0 +1,230 @@
+import base64
+import json
+import queue
+import sqlite3
+import threading
+import time
+
+from config import (
+    VIOLATION_STORE_BATCH_SIZE, VIOLATION_STORE_FLUSH_MS, VIOLATION_STORE_QUEUE_MAX,
+    VIOLATION_STORE_PAGE_MAX,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS detections (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    camera TEXT NOT NULL,
+    source TEXT,
+    mode TEXT,
+    processing_time_ms INTEGER,
+    n_persons INTEGER,
+    n_motorcycles INTEGER,
+    n_violations INTEGER,
+    rider_counts TEXT
+);
+CREATE TABLE IF NOT EXISTS violations (
+    id INTEGER PRIMARY KEY,
+    detection_id INTEGER NOT NULL REFERENCES detections(id),
+    ts REAL NOT NULL,
+    camera TEXT NOT NULL,
+    type TEXT NOT NULL,
+    severity TEXT NOT NULL,
+    motorcycle_id INTEGER,
+    rider_count INTEGER,
+    person_boxes TEXT,
+    motorcycle_box TEXT
+);
+CREATE INDEX IF NOT EXISTS detections_ts ON detections (ts, id);
+CREATE INDEX IF NOT EXISTS detections_camera_ts ON detections (camera, ts, id);
+CREATE INDEX IF NOT EXISTS violations_ts ON violations (ts, id);
+CREATE INDEX IF NOT EXISTS violations_camera_ts ON violations (camera, ts, id);
+CREATE INDEX IF NOT EXISTS violations_type_ts ON violations (type, ts, id);
+CREATE INDEX IF NOT EXISTS violations_severity_ts ON violations (severity, ts, id);
+"""
+
+
+# ── Cursors ──────────────────────────────────────────────────────────────────
+# Keyset pagination: a cursor is the (ts, id) of the last row returned, so
+# every page is one index range scan no matter how deep the client pages.
+
+def encode_cursor(ts, row_id):
+    return base64.urlsafe_b64encode(f"{ts!r}:{row_id}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    """(ts, id) from a cursor string; ValueError if malformed."""
+    try:
+        ts, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        return float(ts), int(row_id)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+# ── Violation Store ──────────────────────────────────────────────────────────
+
+class ViolationStore:
+    """
+    SQLite store of every /detect result (one detections row) and its
+    violations (one row each).
+
+    record() only enqueues: a background writer drains the queue in batches
+    of up to `batch_size` (or whatever arrived within `flush_ms`) and
+    inserts each batch in a single transaction, so the request path never
+    touches disk. When the queue is full, results are dropped and counted
+    rather than blocking requests. Queries run on per-thread read
+    connections (WAL mode lets them proceed while the writer commits).
+    """
+
+    def __init__(self, path, batch_size=VIOLATION_STORE_BATCH_SIZE, flush_ms=VIOLATION_STORE_FLUSH_MS,
+                 queue_max=VIOLATION_STORE_QUEUE_MAX):
+        self.path = path
+        self.batch_size = max(1, int(batch_size))
+        self.flush_s = flush_ms / 1000.0
+        self._queue = queue.Queue(maxsize=queue_max)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.counters = {"queued": 0, "written": 0, "violations_written": 0, "dropped": 0, "batches": 0,
+                         "write_errors": 0}
+
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        conn.commit()
+        self._writer = threading.Thread(target=self._write_loop, args=(conn,), name="violation-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    # Writes
+
+    def record(self, result, camera="", source=None, ts=None):
+        """Queue one pipeline result for storage (never blocks)."""
+        item = (time.time() if ts is None else ts, camera or "", source, result)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self.counters["dropped"] += 1
+            return False
+        with self._lock:
+            self.counters["queued"] += 1
+        return True
+
+    def close(self, timeout=10.0):
+        """Flush everything queued so far and stop the writer."""
+        self._queue.put(None)
+        self._writer.join(timeout)
+
+    def _write_loop(self, conn):
+        while True:
+            item = self._queue.get()
+            batch, stop = [], item is None
+            if not stop:
+                batch.append(item)
+                deadline = time.monotonic() + self.flush_s
+                while len(batch) < self.batch_size:
+                    try:
+                        item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stop = True
+                        break
+                    batch.append(item)
+            if batch:
+                self._write_batch(conn, batch)
+            if stop:
+                conn.close()
+                return
+
+    def _write_batch(self, conn, batch):
+        n_violations = 0
+        try:
+            with conn:
+                for ts, camera, source, result in batch:
+                    cur = conn.execute(
+                        "INSERT INTO detections (ts, camera, source, mode, processing_time_ms, n_persons, "
+                        "n_motorcycles, n_violations, rider_counts) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (ts, camera, source, result.get("cascade", {}).get("mode"), result.get("processing_time_ms"),
+                         len(result["persons"]), len(result["motorcycles"]), len(result["violations"]),
+                         json.dumps([m["rider_count"] for m in result["motorcycles"]])),
+                    )
+                    detection_id = cur.lastrowid
+                    conn.executemany(
+                        "INSERT INTO violations (detection_id, ts, camera, type, severity, motorcycle_id, "
+                        "rider_count, person_boxes, motorcycle_box) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        [
+                            (detection_id, ts, camera, v["type"], v["severity"], v.get("motorcycle_id"),
+                             v.get("rider_count"),
+                             json.dumps(v["person_boxes"] if "person_boxes" in v else [v.get("person_box")]),
+                             json.dumps(v.get("motorcycle_box")))
+                            for v in result["violations"]
+                        ],
+                    )
+                    n_violations += len(result["violations"])
+        except sqlite3.Error as e:
+            print(f"⚠️  Violation store: dropped a batch of {len(batch)} result(s): {e}")
+            with self._lock:
+                self.counters["write_errors"] += len(batch)
+            return
+        with self._lock:
+            self.counters["written"] += len(batch)
+            self.counters["violations_written"] += n_violations
+            self.counters["batches"] += 1
+
+    # Queries
+
+    def _reader(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _page(self, table, filters, start, end, limit, cursor):
+        clauses, params = [], []
+        for column, value in filters:
+            if value:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if start is not None:
+            clauses.append("ts >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("ts < ?")
+            params.append(end)
+        if cursor:
+            clauses.append("(ts, id) < (?, ?)")
+            params.extend(decode_cursor(cursor))
+        limit = max(1, min(int(limit), VIOLATION_STORE_PAGE_MAX))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._reader().execute(
+            f"SELECT * FROM {table} {where} ORDER BY ts DESC, id DESC LIMIT ?", params + [limit + 1]
+        ).fetchall()
+        items = [dict(row) for row in rows[:limit]]
+        next_cursor = encode_cursor(items[-1]["ts"], items[-1]["id"]) if len(rows) > limit else None
+        return items, next_cursor
+
+    def violations(self, start=None, end=None, camera=None, type=None, severity=None, limit=100, cursor=None):
+        """Newest-first page of violations matching the filters: (rows, next cursor or None)."""
+        items, next_cursor = self._page("violations", [("camera", camera), ("type", type), ("severity", severity)],
+                                        start, end, limit, cursor)
+        for item in items:
+            item["person_boxes"] = json.loads(item["person_boxes"])
+            item["motorcycle_box"] = json.loads(item["motorcycle_box"])
+        return items, next_cursor
+
+    def detections(self, start=None, end=None, camera=None, limit=100, cursor=None):
+        """Newest-first page of stored /detect results: (rows, next cursor or None)."""
+        items, next_cursor = self._page("detections", [("camera", camera)], start, end, limit, cursor)
+        for item in items:
+            item["rider_counts"] = json.loads(item["rider_counts"])
+        return items, next_cursor
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "pending": self._queue.qsize(), "path": self.path}
@@ -0,0 +1,312 @@
+import importlib
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from config import (
+    WORKER_PROCESSES, WORKER_QUEUE_DEPTH, WORKER_CPU_AFFINITY, WORKER_MODEL_LOADER,
+    INFERENCE_INTRA_OP_THREADS,
+)
+
+
+# ── CPU Affinity ─────────────────────────────────────────────────────────────
+
+def parse_affinity(spec, n_workers):
+    """
+    Per-worker CPU sets from WORKER_CPU_AFFINITY: "" (no pinning), "auto"
+    (split the CPUs this process may use into equal contiguous blocks) or
+    explicit sets like "0-3;4-7" (one ";"-separated entry per worker).
+    """
+    if not spec:
+        return [None] * n_workers
+    if spec == "auto":
+        cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+        per = max(1, len(cpus) // n_workers)
+        return [cpus[(i * per) % len(cpus):(i * per) % len(cpus) + per] for i in range(n_workers)]
+
+    sets = []
+    for entry in spec.split(";"):
+        cpus = []
+        for part in entry.split(","):
+            if "-" in part:
+                lo, hi = part.split("-")
+                cpus.extend(range(int(lo), int(hi) + 1))
+            elif part.strip():
+                cpus.append(int(part))
+        sets.append(cpus)
+    return [sets[i % len(sets)] for i in range(n_workers)]
+
+
+# ── Worker Process ───────────────────────────────────────────────────────────
+
+def _load(loader):
+    module, func = loader.split(":")
+    return getattr(importlib.import_module(module), func)()
+
+
+def _worker_main(worker_id, cpus, jobs, results, loader):
+    """
+    Inference worker: pin to `cpus`, load + warm its own models, then run
+    jobs. A job names a shared-memory slot holding either encoded image
+    bytes (layout = byte count; decoded here, lazily, like the in-process
+    path) or a decoded RGB frame (layout = shape; used in place). Nothing is
+    pickled on the way in, and only the result dict — plus the per-run
+    metrics — goes back through `results`.
+    """
+    from decode import DecodedImage
+    from models import configure_threads, warmup_models
+    from pipeline import run_pipeline
+
+    try:
+        if cpus and hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cpus)
+        threads = INFERENCE_INTRA_OP_THREADS or (len(cpus) if cpus else 0)
+        if threads:
+            import cv2
+            cv2.setNumThreads(threads)
+            configure_threads(threads)
+
+        t0 = time.perf_counter()
+        base_model, helmet_model = _load(loader)
+        warmup_models(base_model, helmet_model)
+        results.put(("ready", worker_id, round((time.perf_counter() - t0) * 1000)))
+    except Exception as e:
+        results.put(("failed", worker_id, str(e)))
+        return
+
+    attached = {}  # slot index → SharedMemory
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        job_id, slot, shm_name, layout, mode, t_start = job
+        shm = attached.get(slot)
+        if shm is None or shm.name != shm_name:
+            if shm is not None:
+                shm.close()
+            shm = attached[slot] = shared_memory.SharedMemory(name=shm_name)
+
+        recorded = []
+        try:
+            if isinstance(layout, int):
+                img = DecodedImage(bytes(shm.buf[:layout]))
+            else:
+                img = np.ndarray(layout, dtype=np.uint8, buffer=shm.buf)
+            result = run_pipeline(img, base_model, helmet_model, t_start=t_start, mode=mode,
+                                  record=lambda *args: recorded.append(args))
+            del img
+            results.put(("result", job_id, (result, recorded[0] if recorded else None)))
+        except Exception as e:
+            results.put(("error", job_id, f"{type(e).__name__}: {e}"))
+
+    for shm in attached.values():
+        shm.close()
+
+
+# ── Worker Pool ──────────────────────────────────────────────────────────────
+
+class WorkerPool:
+    """
+    N inference processes fed through shared memory.
+
+    Each worker owns `queue_depth` shared-memory slots. submit() copies the
+    encoded upload (or, for video frames, a decoded RGB frame) into a free
+    slot of the least-loaded worker (blocking while every slot is busy —
+    that is the backpressure) and sends only the slot name and layout, so
+    uploads are decoded in the workers and not in the API process; a
+    collector thread resolves the returned Future
+    when the worker's result arrives, and frees the slot. Slots grow (are
+    re-created) when a larger frame arrives. A worker that dies is restarted
+    and its in-flight jobs fail.
+    """
+
+    def __init__(self, n_workers=WORKER_PROCESSES, queue_depth=WORKER_QUEUE_DEPTH,
+                 affinity=WORKER_CPU_AFFINITY, loader=WORKER_MODEL_LOADER):
+        self.n_workers = max(1, int(n_workers))
+        self.queue_depth = max(1, int(queue_depth))
+        self.cpus = parse_affinity(affinity, self.n_workers)
+        self.loader = loader
+        self._ctx = mp.get_context("spawn")
+        self._results = self._ctx.Queue()
+        self._cond = threading.Condition()
+        self._workers = []
+        self._pending = {}      # job_id → (worker index, slot, Future)
+        self._next_job = 0
+        self._closed = False
+        self.load_ms = {}
+        self.counters = {"submitted": 0, "completed": 0, "failed": 0, "restarts": 0}
+
+    # Lifecycle
+
+    def start(self, timeout=None):
+        """Spawn every worker and block until all have loaded their models."""
+        for i in range(self.n_workers):
+            self._workers.append({"process": None, "jobs": None, "slots": [None] * self.queue_depth,
+                                  "free": list(range(self.queue_depth))})
+            self._spawn(i)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        ready = 0
+        while ready < self.n_workers:
+            try:
+                kind, worker_id, payload = self._results.get(timeout=1.0)
+            except queue.Empty:
+                dead = [i for i, w in enumerate(self._workers) if not w["process"].is_alive()]
+                timed_out = deadline is not None and time.monotonic() > deadline
+                if dead or timed_out:
+                    self.close()
+                    raise RuntimeError(f"Workers {dead} exited during start-up" if dead
+                                       else f"Workers not ready after {timeout}s")
+                continue
+            if kind == "failed":
+                self.close()
+                raise RuntimeError(f"Worker {worker_id} failed to load models: {payload}")
+            self.load_ms[worker_id] = payload
+            ready += 1
+        self._collector = threading.Thread(target=self._collect, name="worker-results", daemon=True)
+        self._collector.start()
+        return self
+
+    def _spawn(self, i):
+        worker = self._workers[i]
+        worker["jobs"] = self._ctx.Queue(maxsize=self.queue_depth)
+        worker["process"] = self._ctx.Process(
+            target=_worker_main, name=f"inference-worker-{i}",
+            args=(i, self.cpus[i], worker["jobs"], self._results, self.loader), daemon=True,
+        )
+        worker["process"].start()
+
+    def close(self):
+        self._closed = True
+        for worker in self._workers:
+            if worker["process"] and worker["process"].is_alive():
+                worker["jobs"].put(None)
+        for worker in self._workers:
+            if worker["process"]:
+                worker["process"].join(timeout=5)
+                if worker["process"].is_alive():
+                    worker["process"].terminate()
+            for shm in worker["slots"]:
+                if shm is not None:
+                    shm.close()
+                    shm.unlink()
+            worker["slots"] = [None] * self.queue_depth
+        with self._cond:
+            for _, _, future in self._pending.values():
+                future.set_exception(RuntimeError("Worker pool is shut down"))
+            self._pending.clear()
+            self._cond.notify_all()
+
+    # Submission
+
+    def submit(self, img, mode=None, t_start=None):
+        """
+        Queue encoded image bytes or one RGB uint8 frame (any strides); the
+        Future resolves to (result, metrics args).
+        """
+        if isinstance(img, (bytes, bytearray, memoryview)):
+            img = np.frombuffer(img, dtype=np.uint8)
+            layout = img.size
+        else:
+            img = np.asarray(img, dtype=np.uint8)
+            layout = img.shape
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Worker pool is shut down")
+                candidates = [i for i, w in enumerate(self._workers) if w["free"]]
+                if candidates:
+                    break
+                self._cond.wait()
+            i = max(candidates, key=lambda k: len(self._workers[k]["free"]))
+            worker = self._workers[i]
+            slot = worker["free"].pop()
+            job_id = self._next_job
+            self._next_job += 1
+            future = Future()
+            self._pending[job_id] = (i, slot, future)
+            self.counters["submitted"] += 1
+
+            shm = worker["slots"][slot]
+            if shm is None or shm.size < img.nbytes:
+                if shm is not None:
+                    shm.close()
+                    shm.unlink()
+                shm = worker["slots"][slot] = shared_memory.SharedMemory(create=True, size=max(img.nbytes, 1))
+            jobs = worker["jobs"]
+
+        # The slot is ours until the result comes back — copy outside the lock
+        np.ndarray(img.shape, dtype=np.uint8, buffer=shm.buf)[...] = img
+        jobs.put((job_id, slot, shm.name, layout, mode, t_start))
+        return future
+
+    def run(self, img, mode=None, t_start=None):
+        """Blocking submit(): the pipeline result dict (metrics are recorded here)."""
+        from metrics import record_pipeline
+        result, recorded = self.submit(img, mode, t_start).result()
+        if recorded:
+            record_pipeline(*recorded)
+        return result
+
+    # Results
+
+    def _finish(self, job_id, value=None, error=None):
+        with self._cond:
+            entry = self._pending.pop(job_id, None)
+            if entry is None:
+                return
+            i, slot, future = entry
+            self._workers[i]["free"].append(slot)
+            self.counters["failed" if error else "completed"] += 1
+            self._cond.notify()
+        if error:
+            future.set_exception(RuntimeError(error))
+        else:
+            future.set_result(value)
+
+    def _collect(self):
+        while not self._closed:
+            try:
+                kind, job_id, payload = self._results.get(timeout=0.25)
+            except queue.Empty:
+                kind = None
+            except (EOFError, OSError):
+                return
+            if kind == "result":
+                self._finish(job_id, value=payload)
+            elif kind == "error":
+                self._finish(job_id, error=payload)
+            elif kind == "ready":
+                self.load_ms[job_id] = payload
+            # Every iteration, not only when idle: while other workers keep
+            # returning results, a crashed worker's requests must not wait for
+            # their own timeouts
+            self._check_workers()
+
+    def _check_workers(self):
+        """Restart dead workers; fail the jobs they had in flight (is_alive() is a non-blocking waitpid)."""
+        for i, worker in enumerate(self._workers):
+            if self._closed or worker["process"].is_alive():
+                continue
+            print(f"⚠️  Inference worker {i} died (exit {worker['process'].exitcode}) — restarting")
+            lost = [job_id for job_id, (w, _, _) in list(self._pending.items()) if w == i]
+            for job_id in lost:
+                self._finish(job_id, error=f"Inference worker {i} died")
+            self.counters["restarts"] += 1
+            self._spawn(i)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "workers": self.n_workers,
+                "queue_depth": self.queue_depth,
+                "cpu_affinity": self.cpus,
+                "in_flight": [self.queue_depth - len(w["free"]) for w in self._workers],
+                "load_ms": self.load_ms,
+                **self.counters,
+            }